@@ -17,6 +17,11 @@ USAGE = """USAGE: ispncon [options] <operation> [operation_options] <op_argument
     -v --version                prints the ispncon version and exits
     -e --exit-on-error          if operation fails, don't print ERROR output, but fail with error exit code
     -P --config "<key> <value>" set configuration key to given value
+    --profile                   print time spent in parse, encode, decode, network and output phases
+                                of each command to stderr when finished
+    --profile-output <file>     dump cProfile statistics of the whole session into the file (see pstats)
+    --limit-ops <n>             perform at most n cache operations per second (config limit.ops_per_second)
+    --limit-bytes <n>           transfer at most n bytes of values per second (config limit.bytes_per_second)
     use operation help to get list of supported operations
     or help <operation> to display info on particular operation"""
 
@@ -33,6 +38,12 @@ HELP = {
     -I <maxidle>   specifies max idle time, integer, number of seconds
     -a             put if absent, same as put but returns CONFLICT if value already exists 
                    and doesn't put anything in that case
+
+  note:
+    if config value chunking.threshold is set and the value is longer, the value is stored as several
+    chunks of chunking.chunk_size bytes plus a small manifest under the key and a marker entry. the chunks are
+    written in parallel. the chunks of a value that is overwritten or deleted are removed. only keys with the
+    marker have their old value fetched to find the chunks, puts of other keys don't read anything.
   
   return:
     * in case the entry was stored successfully, one line: 
@@ -118,7 +129,66 @@ HELP = {
     (exit code 3)
     * if option -v was used and versions don't match, one line: 
     CONFLICT""",
+
+  "mdelete" : """deletes many entries, pipelined where the protocol allows it
+
+  format:
+    mdelete [options] [<key>...]
+
+  options:
+    -f <filename>  read the keys from the file, one key per line, - means standard input
+    -p <prefix>    delete only keys starting with the prefix. if neither keys nor key file are supplied,
+                   all keys in the cache are enumerated and the ones with the prefix deleted
+
+  note:
+    key enumeration isn't supported by the memcached client. hotrod client has to transfer all the
+    entries to enumerate keys. the memcached client reads the replies even with memcached.noreply_bulk.
+
+  return:
+    (exit code 0)
+    * counts, one per line:
+    DELETED <number of deleted entries>
+    NOT_FOUND <number of keys that weren't in the cache>
+    ERRORS <number of failed deletes>
+
+    (exit code 1)
+    * if some deletes failed, one line per failed key before the counts:
+    ERROR <key> <msg>
+    * in case of general error, one line:
+    ERROR <msg>""",
     
+  "touch" : """resets lifespan and max idle time of many entries without changing their values
+  the keys are processed in batches by several workers in parallel. memcached client sends native touch commands
+  pipelined over the connection of the worker, no values are transferred. hotrod and rest clients read every
+  value and re-put it with its current version, so that a concurrent write isn't overwritten. the value crosses
+  the wire twice then. rest client skips the re-put of entries the server reports without expiration when
+  neither -l nor -I is given.
+
+  format:
+    touch [options] [<key>...]
+
+  options:
+    -f <filename>  read the keys from the file, one key per line, - means standard input
+    -l <lifespan>  new lifespan, integer, number of seconds
+    -I <maxidle>   new max idle time (not supported by memcached)
+    -w <workers>   number of parallel workers (connections). Default: config value bulk.workers
+
+  note:
+    without -l and -I the entries are made immortal: their current lifespan and max idle time are removed
+
+  return:
+    (exit code 0)
+    * counts, one per line:
+    TOUCHED <number of touched entries>
+    NOT_FOUND <number of keys that weren't in the cache>
+    ERRORS <number of failed touches>
+
+    (exit code 1)
+    * if some touches failed, one line per failed key before the counts:
+    ERROR <key> <msg>
+    * in case of general error, one line:
+    ERROR <msg>""",
+
   "clear" : """clears the cache
 
   format:
@@ -163,6 +233,60 @@ HELP = {
   host        - host name
   port        - port on host
   client.type - client type: hotrod|memcached|rest
+  default_codec - codec used when put/get don't specify one: None|RiverString|RiverByteArray|RiverInt|RiverLong|
+                  RiverBoolean|RiverList|RiverMap. RiverList and RiverMap values are given and printed as JSON
+  hotrod.key_codec - codec of the keys when hotrod.use_river_string_keys is true, e.g. RiverInt for keys
+                     that java clients store as java.lang.Integer
+  hotrod.servers   - comma separated host[:port] list of hotrod servers. requests go to the servers round robin,
+                     a server that stops responding is skipped for hotrod.retry_interval seconds and the request
+                     is retried on the next one. empty (default) means just host and port
+  hotrod.pool_size - max number of connections kept to each hotrod server
+  hotrod.retry_interval - seconds before a failed hotrod server is tried again
+  hotrod.pipeline_window - max number of hotrod requests sent before reading their responses in bulk deletes
+  hotkeys.capacity    - max number of keys tracked by the hot key sampler, 0 turns sampling off
+  hotkeys.sample_rate - fraction of operations sampled by the hot key sampler
+  bulk.workers        - default number of parallel workers for bulk operations
+  chunking.threshold  - values longer than this number of bytes are split into chunks, 0 turns chunking off
+  chunking.chunk_size - size of one chunk in bytes
+  rest.pipeline_window - max number of requests the rest client sends ahead without waiting for responses
+                         in bulk operations (HTTP/1.1 pipelining), 1 turns pipelining off
+  rest.accept_encoding - Accept-Encoding of the rest client's GET requests, gzip and deflate responses are
+                         decompressed on the fly. identity turns response compression off
+  rest.compress_threshold - values of at least this many bytes are sent gzip compressed (Content-Encoding: gzip),
+                            the server has to support it. 0 (default) turns request compression off
+  memcached.pipeline_window - max number of requests the memcached client sends ahead in bulk operations
+  memcached.noreply_bulk    - if true, bulk puts of the memcached client don't wait for a reply per entry.
+                              a server error fails the whole window of entries it was sent in then
+  memcached.meta_commands   - true|false|auto. version, exists, size and watch use meta commands (mg) that
+                              don't transfer the value. auto (default) checks whether the server supports them
+  limit.ops_per_second   - max number of cache operations per second, summed over all parallel workers,
+                           0 means no limit. can be changed in the middle of an include file
+  limit.bytes_per_second - max number of value bytes sent and received per second, 0 means no limit
+  buffer.max_entries     - if positive, puts without -v and -a are buffered and written in bulk on background,
+                           repeated puts of the same key are written once. the buffer is written when it holds
+                           this many entries, after buffer.flush_interval, on flush operation and on exit
+  buffer.flush_interval  - max number of seconds a put waits in the buffer
+  client_cache.max_clients  - number of clients kept connected for configs used earlier in the session, so that
+                              switching back to them (config cache X, config host Y) doesn't reconnect
+  client_cache.idle_timeout - seconds after which a client not used by the current config is closed, 0 means never
+  bloom.file       - Bloom filter of the keys built by the bloom operation, lets get and exists skip the server
+                     for absent keys. empty (default) means no filter
+  bloom.capacity   - default number of keys the Bloom filter is sized for
+  bloom.error_rate - default false positive probability of the Bloom filter
+  metrics.port     - if not 0, operation counters and latency histograms per client type and operation are served
+                     in OpenMetrics text format on http://metrics.host:metrics.port/ (default 0). workers of
+                     include -j don't export metrics
+  metrics.host     - address the metrics endpoint listens on (default 127.0.0.1)
+  metrics.file     - if set, the metrics are written into this file every metrics.interval seconds and on exit
+  metrics.interval - seconds between writes of metrics.file
+  transport.tcp_nodelay     - disable Nagle's algorithm on client connections (default True)
+  transport.keepalive       - enable TCP keepalive on client connections
+  transport.send_buffer     - socket send buffer size in bytes, 0 means system default
+  transport.receive_buffer  - socket receive buffer size in bytes, 0 means system default
+  transport.connect_timeout - connect timeout in seconds, 0 means no timeout
+  transport.read_timeout    - timeout of socket reads and writes in seconds, 0 means no timeout
+  transport.dns_cache_ttl   - seconds to cache resolved host addresses for, 0 turns caching off
+  host can also be unix:<path> to connect to a Unix domain socket, the port is ignored then
   
   return:
     (exit code 0)
@@ -179,11 +303,246 @@ HELP = {
   "include" : """processes cache commands from the specified file. 
   the output depends on the commands present in the input file. the commands will be processed line by line.
 
+  the file is parsed once, the parsed commands are kept and reused until the file changes.
+
   format:
-    include <filename>
-  
+    include [options] <filename>
+
+  options:
+    -s  print number of lines and lines per second of parsing and executing the file to stderr
+    -j <jobs> execute the file in this many worker processes, each with its own client. put, get, version,
+        delete, exists, incr and update are distributed by hash of the key, so commands on the same key keep
+        their order. other commands run in the first worker after all the commands before them finished,
+        config, flush and hotkeys in every worker (hotkeys prints the heaviest keys of all the workers).
+        bloom -i is refused, every worker has its own Bloom filter, after clear and bloom the other workers
+        load the filter the first one saved. limit.* values are divided among the workers. the output keeps
+        the order of the file. with --exit-on-error commands after the failed one may already have been
+        executed by other workers
+
+  return:
+    exit code = exit code of the last command in the file.""",
+
+  "incr" : """atomically adds delta to the integer stored under the key (as decimal string)
+  memcached client uses the native incr/decr operations (note that memcached doesn't decrement below 0),
+  the other clients do optimistic versioned updates and retry if the entry was changed concurrently.
+
+  format:
+    incr [options] <key> [<delta>]
+
+  options:
+    -r <retries>  max number of retries after a concurrent change. Default: 10
+
+  note:
+    delta is an integer, can be negative. Default: 1
+
+  return:
+    (exit code 0)
+    * the new value, one line:
+    <value>
+
+    (exit code 1)
+    * in case of general error or if the value isn't an integer, one line:
+    ERROR <msg>
+
+    (exit code 2)
+    * if the entry wasn't found in the cache, one line:
+    NOT_FOUND
+
+    (exit code 3)
+    * if the entry kept changing concurrently and the retries ran out, one line:
+    CONFLICT""",
+
+  "update" : """replaces the value under the key by the output of a filter command
+  the current value is piped to the standard input of the filter command (run by shell) and its output
+  is stored with a versioned put. if the entry was changed concurrently, the update starts over.
+
+  format:
+    update [options] <key> <filter command>
+
+  options:
+    -r <retries>  max number of retries after a concurrent change. Default: 10
+
+  example:
+    update mykey "tr a-z A-Z"
+
+  return:
+    (exit code 0)
+    * the value was updated, one line:
+    STORED
+
+    (exit code 1)
+    * in case of general error or if the filter command fails, one line:
+    ERROR <msg>
+
+    (exit code 2)
+    * if the entry wasn't found in the cache, one line:
+    NOT_FOUND
+
+    (exit code 3)
+    * if the entry kept changing concurrently and the retries ran out, one line:
+    CONFLICT""",
+
+  "hotkeys" : """prints the most frequently accessed keys of this session
+  keys are sampled only if config value hotkeys.capacity is greater than 0. at most that many keys are tracked
+  at once (Space-Saving sketch), so the counts are estimates. hotkeys.sample_rate (0, 1] sets the fraction
+  of operations that get sampled.
+
+  format:
+    hotkeys [options] [<count>]
+
+  options:
+    -r  reset the collected statistics after printing them
+
   return:
-    exit code = exit code of the last command in the file."""
+    (exit code 0)
+    * one line per key, heaviest first, at most <count> lines (default 10):
+    <key> <estimated access count> <max overestimation> <estimated bytes transferred>
+
+    (exit code 1)
+    * in case of general error or if sampling is off, one line:
+    ERROR <msg>""",
+
+  "bloom" : """builds the Bloom filter of the keys in the cache and saves it to the file set by config value bloom.file
+  while there's a filter for the current cache in bloom.file, get and exists of keys that aren't in the filter return
+  NOT_FOUND without asking the server, puts of this client add their keys to the filter. the filter is built from
+  the keys at that moment, writes of other clients after that aren't seen, rebuild it when they add entries.
+
+  format:
+    bloom [options] [<key>...]
+
+  options:
+    -f <filename>   read the keys from the file, one key per line, - means standard input
+    -n <capacity>   number of keys the filter is sized for. Default: config value bloom.capacity
+    -e <error_rate> false positive probability at capacity keys. Default: config value bloom.error_rate
+    -i              only print the statistics of the current filter
+
+  note:
+    if neither keys nor key file are supplied, all keys in the cache are enumerated. key enumeration isn't
+    supported by the memcached client. hotrod client has to transfer all the entries to enumerate keys.
+
+  return:
+    (exit code 0)
+    * statistics of the filter, one per line:
+    KEYS <number of keys added>
+    BITS <size of the filter in bits>
+    HASHES <number of hash functions>
+    FILL <fraction of bits set>
+    ERROR_RATE <estimated false positive probability>
+    SKIPPED <lookups answered by the filter in this session>
+
+    (exit code 1)
+    * in case of general error or if there's no filter for the cache with -i, one line:
+    ERROR <msg>""",
+
+  "sizes" : """prints statistics of value sizes in the cache without storing the values anywhere
+  only the value lengths are fetched where the protocol allows it (HEAD on rest), otherwise the values are
+  transferred and thrown away. the keys are processed by several workers in parallel.
+
+  format:
+    sizes [options] [<key>...]
+
+  options:
+    -f <filename>  read the keys from the file, one key per line, - means standard input
+    -w <workers>   number of parallel workers (connections). Default: config value bulk.workers
+
+  note:
+    if neither keys nor key file are supplied, all keys in the cache are processed. key enumeration
+    isn't supported by the memcached client. hotrod client has to transfer all the entries to enumerate keys.
+
+  return:
+    (exit code 0)
+    * statistics, one per line:
+    COUNT <number of entries>
+    TOTAL <total bytes>
+    MIN <smallest value size>
+    MAX <largest value size>
+    MEAN <mean value size>
+    NOT_FOUND <number of keys not found>
+    ERRORS <number of keys that failed>
+    * followed by the size histogram with power of two buckets, one line per non-empty bucket:
+    <lower bound>-<upper bound> <number of entries>
+
+    (exit code 1)
+    * in case of general error, one line:
+    ERROR <msg>""",
+
+  "checksum" : """computes order independent digest of the cache entries, to compare two caches (e.g. replica and
+  its source) without dumping them. the entries are fetched by several workers in parallel, the digest is
+  the sum of 64-bit hashes of the entries (key and value) and doesn't depend on the order of the keys.
+
+  format:
+    checksum [options] [<key>...]
+
+  options:
+    -f <filename>  read the keys from the file, one key per line, - means standard input
+    -w <workers>   number of parallel workers (connections). Default: config value bulk.workers
+    -b <buckets>   also print digests of <buckets> buckets of the key space. the bucket of a key depends only
+                   on the key, so mismatching buckets of two caches can be examined with -B
+    -B <bucket>    only process keys falling into the given bucket (requires -b) and print their entry hashes
+
+  note:
+    if neither keys nor key file are supplied, all keys in the cache are processed. key enumeration
+    isn't supported by the memcached client. hotrod client has to transfer all the entries to enumerate keys.
+
+  return:
+    (exit code 0)
+    * digest, one item per line:
+    COUNT <number of entries>
+    DIGEST <digest as 16 hex digits>
+    NOT_FOUND <number of keys not found>
+    ERRORS <number of keys that failed>
+    * with -b followed by one line per bucket:
+    BUCKET <bucket> <number of entries> <digest>
+    * with -B followed by one line per entry, sorted by key:
+    ENTRY <key> <entry hash>
+
+    (exit code 1)
+    * in case of general error, one line:
+    ERROR <msg>""",
+
+  "flush" : """writes out the puts waiting in the write-behind buffer (see config value buffer.max_entries)
+  and waits until they are stored
+
+  format:
+    flush
+
+  return:
+    (exit code 0)
+    * one line with the number of buffered puts written since the last flush:
+    FLUSHED <count>
+
+    (exit code 1)
+    * if some of the buffered puts failed, one line for each of them followed by the FLUSHED line:
+    ERROR <key> <msg>""",
+
+  "watch" : """polls the entries with the specified keys and reports when they are created, changed or removed.
+  only the versions are checked (HEAD requests on rest, multi-key gets on memcached, versioned gets
+  on hotrod), many keys per round trip where the client supports it. polling starts at the initial interval,
+  which doubles with every poll that finds no change, up to the max interval, and returns to the initial
+  interval after a change.
+
+  format:
+    watch [options] [<key>...]
+
+  options:
+    -f <filename>  read the keys from the file, one key per line, - means standard input
+    -i <seconds>   initial polling interval. Default: 0.5
+    -m <seconds>   max polling interval. Default: 30
+    -n <count>     stop after reporting <count> changes
+    -t <seconds>   stop after <seconds>
+
+  return:
+    (exit code 0)
+    * one line per change, until stopped by -n, -t or Ctrl+C:
+    CREATED <key> <version>
+    CHANGED <key> <version>
+    REMOVED <key>
+    * if the version of a key can't be checked, one line:
+    ERROR <key> <msg>
+
+    (exit code 1)
+    * in case of general error, one line:
+    ERROR <msg>"""
                     
 }
 
@@ -0,0 +1,679 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Embeddable session API
+
+The operations of the console without the console: results are returned as values and failures
+raised as CacheClientError subclasses (NotFoundError, ConflictError, SessionError), nothing is
+printed. The console is a formatter on top of this module.
+
+  from ispncon.api import Session
+  from ispncon.config import Config
+
+  config = Config()
+  config["client_type"] = "memcached"
+  config["port"] = "11211"
+  with Session(config) as session:
+    session.put("a", "1")
+    print session.incr("a", 5)
+    for key, value, error in session.get_many(["a", "b"]):
+      ...
+"""
+from collections import deque, namedtuple
+from ispncon.buffer import WriteBehindBuffer
+from ispncon.bulk import parallel_apply
+from ispncon.client import CacheClientError, ClientCache, NotFoundError, UPDATE_MAX_RETRIES
+from ispncon.codec import CodecError
+from ispncon.metrics import MetricsRegistry, MeasuredClient, MetricsServer, MetricsFileWriter
+from ispncon.ratelimit import RateLimiter, LimitedClient
+from ispncon.stats import SpaceSavingSketch, LogHistogram, SetDigest, entry_hash, key_bucket
+from ispncon.timing import ProfiledClient, NO_PHASE, PHASE_ENCODE, PHASE_DECODE
+import ispncon.bloom
+import ispncon.codec
+import socket
+import time
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+# value of get with version
+Entry = namedtuple("Entry", "key value version")
+# item yielded by the batch operations, value is what the single key operation would return
+# and error the CacheClientError it would raise (value is None then)
+Result = namedtuple("Result", "key value error")
+HotKey = namedtuple("HotKey", "key count error bytes")
+# kind is one of CREATED, CHANGED, REMOVED, ERROR (error set, version None)
+Change = namedtuple("Change", "kind key version error")
+SizeStats = namedtuple("SizeStats", "histogram not_found errors")
+# entries are (key, entry hash) sorted by key, only collected for a single bucket
+ChecksumResult = namedtuple("ChecksumResult", "digest entries not_found errors")
+# errors are (key, CacheClientError) of the keys that failed for another reason than NOT_FOUND
+TouchStats = namedtuple("TouchStats", "touched not_found errors")
+# skipped is the number of lookups of this session answered by the filter
+BloomInfo = namedtuple("BloomInfo", "keys bits hashes fill error_rate skipped")
+
+# number of keys a touch worker hands to the touch_many of its client at once
+TOUCH_BATCH_SIZE = 100
+
+CREATED = "CREATED"
+CHANGED = "CHANGED"
+REMOVED = "REMOVED"
+ERROR = "ERROR"
+
+class SessionError(CacheClientError):
+  """Invalid arguments or configuration of a session operation"""
+  def __init__(self, msg):
+    CacheClientError.__init__(self, msg)
+    Exception.__init__(self, msg)
+
+class Session(object):
+  """Cache operations configured by a Config. The client is created on first use and shared by the
+     single key operations, bulk operations (sizes, checksum) use their own pool of clients.
+     When bloom.file holds a Bloom filter of the cache, get and exists of keys it doesn't contain
+     fail without a round trip. With metrics.port or metrics.file set, the calls of the client are
+     measured and exported in OpenMetrics format. Sessions aren't thread safe. Use as a context manager
+     or call close() to write out buffered puts.
+  """
+  def __init__(self, config, profiler=None):
+    self.config = config
+    self.profiler = profiler
+    self.client = None
+    self.clients = ClientCache()
+    self.sampler = None
+    self.limiter = RateLimiter()
+    self.buffer = None
+    self.bloom = None
+    self.bloom_path = ""
+    self.bloom_added = [] # keys put since the filter was saved
+    self.bloom_skipped = 0 # lookups answered by the Bloom filter
+    self.metrics = MetricsRegistry() # kept across config changes, counters never go back
+    self.metrics_exporters = []
+    self.metrics_settings = None
+    self.default_codec = None
+    self._configure()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+    return False
+
+  def close(self):
+    """writes out buffered puts, saves the Bloom filter and closes the client, returns (written, errors)
+       of the buffer, a failed save of the filter is reported as an error of the bloom.file path"""
+    results = self._close_buffer()
+    try:
+      self._save_bloom()
+    except SessionError as e:
+      results[1].append((self.bloom_path, e))
+    self._stop_metrics()
+    self.client = None
+    self.clients.close()
+    return results
+
+  def configure(self, key, value):
+    """sets config value and applies it, switching to the client for the new config (a cached one if
+       this config was used before). returns (key, error) list of buffered puts that failed while the
+       old buffer was written out. a value the session rejects isn't kept"""
+    old_value = self.config.get(key)
+    # puts buffered so far are written with the config they were accepted under
+    errors = self._close_buffer()[1]
+    self.config[key] = value
+    try:
+      errors += self._configure()
+    except SessionError:
+      self.config[key] = old_value
+      self._configure()
+      raise
+    self.client = None
+    self._get_client() # fail early if the new config doesn't work
+    return errors
+
+  def _configure(self):
+    try:
+      self.default_codec = ispncon.codec.fromString(self.config["default_codec"])
+    except CodecError as e:
+      self._error(e.args[0])
+    self._configure_sampler()
+    self._configure_limiter()
+    self._configure_client_cache()
+    self._configure_bloom()
+    self._configure_metrics()
+    return self._configure_buffer()
+
+  def _configure_buffer(self):
+    """(re)create the write-behind buffer for the current config, buffer.max_entries 0 turns it off"""
+    try:
+      max_entries = int(self.config["buffer.max_entries"])
+      flush_interval = float(self.config["buffer.flush_interval"])
+    except ValueError:
+      self._error("buffer.max_entries must be an integer and buffer.flush_interval a number of seconds")
+    errors = self._close_buffer()[1]
+    if max_entries > 0:
+      self.buffer = WriteBehindBuffer(dict(self.config), max_entries, flush_interval, self.limiter)
+    return errors
+
+  def _close_buffer(self):
+    if self.buffer == None:
+      return 0, []
+    self.buffer.close()
+    results = self.buffer.take_results()
+    self.buffer = None
+    return results
+
+  def _configure_bloom(self):
+    """load the filter from bloom.file when it changes, the previous filter is saved first. there's no
+       filter until the file is built, a filter of just the keys put since then would miss the others"""
+    path = self.config["bloom.file"]
+    if path == self.bloom_path:
+      return
+    self._save_bloom()
+    self.bloom, self.bloom_path, self.bloom_added = None, path, []
+    if path == "":
+      return
+    try:
+      self.bloom = ispncon.bloom.load(path)
+    except IOError:
+      pass
+    except ValueError as e:
+      self._error(e.args[0])
+
+  def _save_bloom(self, replace=False):
+    """adds the keys put since the last save to the filter in bloom.file (other processes may have
+       saved their keys there meanwhile), replace writes the filter as it is"""
+    if self.bloom == None or (not replace and not self.bloom_added):
+      return
+    try:
+      self.bloom = self.bloom.save(self.bloom_path, None if replace else self.bloom_added)
+    except IOError as e:
+      self._error("while writing %s: %s" % (self.bloom_path, e.strerror))
+    self.bloom_added = []
+
+  def _bloom_target(self):
+    """identifies the cache the filter belongs to"""
+    config = self.config
+    return "%s://%s:%s/%s" % (config["client_type"], config["host"], config["port"], config["cache"])
+
+  def _bloom_filter(self):
+    """the Bloom filter if there is one for the current cache"""
+    if self.bloom != None and self.bloom.target == self._bloom_target():
+      return self.bloom
+    return None
+
+  def _absent(self, key):
+    """true if the Bloom filter says the entry doesn't exist"""
+    bloom = self._bloom_filter()
+    if bloom != None and not key in bloom:
+      self.bloom_skipped += 1
+      return True
+    return False
+
+  def _bloom_add(self, key):
+    bloom = self._bloom_filter()
+    if bloom != None:
+      bloom.add(key)
+      self.bloom_added.append(key)
+
+  def _configure_metrics(self):
+    """(re)start the metrics exporters when metrics.* config changes"""
+    config = self.config
+    try:
+      port = int(config["metrics.port"])
+      interval = float(config["metrics.interval"])
+    except ValueError:
+      self._error("metrics.port must be an integer and metrics.interval a number of seconds")
+    if interval <= 0:
+      self._error("metrics.interval must be positive")
+    settings = (config["metrics.host"], port, config["metrics.file"], interval)
+    if settings == self.metrics_settings:
+      return
+    self._stop_metrics()
+    self.metrics_settings = settings
+    try:
+      if port != 0:
+        self.metrics_exporters.append(MetricsServer(self.metrics, config["metrics.host"], port))
+      if config["metrics.file"] != "":
+        self.metrics_exporters.append(MetricsFileWriter(self.metrics, config["metrics.file"], interval))
+    except socket.error as e:
+      self._stop_metrics()
+      self._error("can't serve metrics on port %d: %s" % (port, e.args[-1]))
+    except IOError as e:
+      self._stop_metrics()
+      self._error("while writing %s: %s" % (config["metrics.file"], e.strerror))
+
+  def _stop_metrics(self):
+    exporters, self.metrics_exporters, self.metrics_settings = self.metrics_exporters, [], None
+    for exporter in exporters:
+      try:
+        exporter.stop()
+      except IOError:
+        pass # last write of the file
+
+  def _configure_client_cache(self):
+    try:
+      self.clients.max_clients = int(self.config["client_cache.max_clients"])
+      self.clients.idle_timeout = float(self.config["client_cache.idle_timeout"])
+    except ValueError:
+      self._error("client_cache.max_clients must be an integer and client_cache.idle_timeout a number of seconds")
+
+  def _configure_limiter(self):
+    """apply current limit.* config to the limiter shared by all clients of this session"""
+    try:
+      ops = float(self.config["limit.ops_per_second"])
+      nbytes = float(self.config["limit.bytes_per_second"])
+    except ValueError:
+      self._error("limit.ops_per_second and limit.bytes_per_second must be numbers")
+    if ops < 0 or nbytes < 0:
+      self._error("limit.ops_per_second and limit.bytes_per_second can't be negative")
+    self.limiter.set_limits(ops, nbytes)
+
+  def _configure_sampler(self):
+    """(re)create the hot key sampler, capacity 0 turns it off"""
+    try:
+      capacity = int(self.config["hotkeys.capacity"])
+      sample_rate = float(self.config["hotkeys.sample_rate"])
+    except ValueError:
+      self._error("hotkeys.capacity must be an integer and hotkeys.sample_rate a float")
+    if sample_rate <= 0.0 or sample_rate > 1.0:
+      self._error("hotkeys.sample_rate must be in interval (0, 1]")
+    if capacity <= 0:
+      self.sampler = None
+    elif self.sampler == None or self.sampler.capacity != capacity or self.sampler.sample_rate != sample_rate:
+      self.sampler = SpaceSavingSketch(capacity, sample_rate)
+
+  def _sample(self, key, nbytes=0):
+    if self.sampler != None:
+      self.sampler.offer(key, nbytes)
+
+  # get the client lazily
+  def _get_client(self):
+    if self.client == None:
+      try:
+        self.client = self.clients.get(self.config)
+        if self.metrics_exporters:
+          self.client = MeasuredClient(self.client, self.metrics, self.config["client_type"])
+        if self.profiler != None:
+          self.client = ProfiledClient(self.client, self.profiler)
+        if self.limiter.active():
+          self.client = LimitedClient(self.client, self.limiter)
+      except CacheClientError as e:
+        raise e
+      except Exception as e:
+        self._error("creating client: %s" % str(e.args))
+    return self.client
+
+  def _sync(self, key):
+    """read your writes: wait for the buffered put of the key"""
+    if self.buffer != None and self.buffer.contains(key):
+      self.buffer.flush()
+
+  def _sync_all(self):
+    if self.buffer != None:
+      self.buffer.flush()
+
+  def _phase(self, name):
+    if self.profiler == None:
+      return NO_PHASE
+    return self.profiler.phase(name)
+
+  def _error(self, msg):
+    raise SessionError(msg)
+
+  def codec(self, name=None):
+    """codec object for the codec name, the default codec if name is None. None means no coding"""
+    if name == None:
+      return self.default_codec
+    try:
+      return ispncon.codec.fromString(name)
+    except CodecError as e:
+      self._error(e.args[0])
+
+  def _encode(self, codec, value):
+    codec = self.codec(codec)
+    if codec == None:
+      return value
+    try:
+      with self._phase(PHASE_ENCODE):
+        return codec.encode(value)
+    except CodecError as e:
+      self._error(e.args[0])
+
+  def _decode(self, codec, value):
+    codec = self.codec(codec)
+    if codec == None:
+      return value
+    try:
+      with self._phase(PHASE_DECODE):
+        return codec.decode(value)
+    except CodecError as e:
+      self._error(e.args[0])
+
+  def _workers(self, workers):
+    if workers == None:
+      workers = self.config["bulk.workers"]
+    try:
+      workers = int(workers)
+    except ValueError:
+      self._error("Number of workers must be an integer.")
+    if workers < 1:
+      self._error("Number of workers must be positive.")
+    return workers
+
+  def _keys(self, keys):
+    """keys given or all the keys enumerated from the cache if None"""
+    if keys == None:
+      return self.keys()
+    return keys
+
+  def put(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False, codec=None):
+    """puts the value encoded by the codec (default codec if None). unconditional puts go through the
+       write-behind buffer when it's on"""
+    encoded_value = self._encode(codec, value)
+    if self.buffer != None and version == None and not put_if_absent:
+      self.buffer.put(key, encoded_value, lifespan, max_idle)
+    else:
+      self._sync(key) # conditional put has to see the buffered value
+      self._get_client().put(key, encoded_value, version, lifespan, max_idle, put_if_absent)
+    self._bloom_add(key)
+    self._sample(key, len(encoded_value))
+
+  def get(self, key, get_version=False, codec=None):
+    """returns the decoded value, Entry if get_version"""
+    if self._absent(key):
+      raise NotFoundError
+    self._sync(key)
+    if get_version:
+      version, value = self._get_client().get(key, True)
+    else:
+      value = self._get_client().get(key, False)
+    self._sample(key, len(value))
+    value = self._decode(codec, value)
+    return Entry(key, value, version) if get_version else value
+
+  def get_into(self, key, outfile, get_version=False):
+    """streams the undecoded value into the file object, returns number of bytes written,
+       Entry with the number of bytes as value if get_version"""
+    if self._absent(key):
+      raise NotFoundError
+    self._sync(key)
+    if get_version:
+      version, nbytes = self._get_client().get_into(key, outfile, True)
+    else:
+      nbytes = self._get_client().get_into(key, outfile)
+    self._sample(key, nbytes)
+    return Entry(key, nbytes, version) if get_version else nbytes
+
+  def version(self, key):
+    self._sync(key)
+    version = self._get_client().version(key)
+    self._sample(key)
+    return version
+
+  def exists(self, key):
+    """returns True if the entry exists"""
+    self._sample(key)
+    if self._absent(key):
+      return False
+    self._sync(key)
+    try:
+      self._get_client().exists(key)
+      return True
+    except NotFoundError:
+      return False
+
+  def delete(self, key, version=None):
+    self._sync(key)
+    self._get_client().delete(key, version)
+    self._sample(key)
+
+  def clear(self):
+    self._sync_all()
+    self._get_client().clear()
+    bloom = self._bloom_filter()
+    if bloom != None:
+      # other processes' keys are gone too, so the file isn't merged
+      bloom.reset()
+      self._save_bloom(True)
+
+  def incr(self, key, delta=1, max_retries=UPDATE_MAX_RETRIES):
+    """returns the new value as integer"""
+    self._sync(key)
+    value = self._get_client().incr(key, delta, max_retries)
+    self._bloom_add(key)
+    self._sample(key)
+    return value
+
+  def update(self, key, transform, max_retries=UPDATE_MAX_RETRIES):
+    """replaces the undecoded value with transform(value), returns the new value"""
+    self._sync(key)
+    new_value = self._get_client().update(key, transform, max_retries)
+    self._sample(key, len(new_value))
+    return new_value
+
+  def keys(self):
+    """iterable of all the keys in the cache"""
+    self._sync_all()
+    return self._get_client().keys()
+
+  def flush(self):
+    """waits for the buffered puts, returns (written, errors) as WriteBehindBuffer.take_results"""
+    if self.buffer == None:
+      return 0, []
+    self.buffer.flush()
+    return self.buffer.take_results()
+
+  def get_many(self, keys, get_version=False, codec=None):
+    """generator of Result, value is what get would return"""
+    self._sync_all()
+    # keys the Bloom filter rules out aren't sent, their results are put back in the order of keys
+    order = deque() # (key, absent) in the order the client takes the keys
+    def sent_keys():
+      for key in keys:
+        absent = self._absent(key)
+        order.append((key, absent))
+        if not absent:
+          yield key
+    for key, result, error in self._get_client().get_many(sent_keys(), get_version):
+      while order[0][1]:
+        yield Result(order.popleft()[0], None, NotFoundError())
+      order.popleft()
+      if error == None:
+        try:
+          if get_version:
+            result = Entry(key, self._decode(codec, result[1]), result[0])
+          else:
+            result = self._decode(codec, result)
+        except SessionError as e:
+          result, error = None, e
+      yield Result(key, result, error)
+    while order:
+      yield Result(order.popleft()[0], None, NotFoundError())
+
+  def put_many(self, entries, lifespan=None, max_idle=None, codec=None):
+    """puts iterable of (key, value) bypassing the write-behind buffer, generator of Result"""
+    self._sync_all() # buffered values mustn't overwrite these later
+    encoded = ((key, self._encode(codec, value)) for key, value in entries)
+    for key, result, error in self._get_client().put_many(encoded, lifespan, max_idle):
+      if error == None:
+        self._bloom_add(key)
+      yield Result(key, None, error)
+
+  def delete_many(self, keys):
+    """generator of Result"""
+    self._sync_all()
+    for key, result, error in self._get_client().delete_many(keys):
+      yield Result(key, None, error)
+
+  def touch_many(self, keys, lifespan=None, max_idle=None, workers=None):
+    """resets expiration of the entries under the keys, returns TouchStats. the keys are split in batches
+       touched by parallel workers, each with the touch_many of its own client (memcached pipelines
+       native touch commands, the other clients re-put the values versioned, so that concurrent writes
+       aren't lost)"""
+    workers = self._workers(workers)
+    self._sync_all()
+    counts = {"touched": 0, "not_found": 0}
+    errors = []
+    def batches():
+      batch = []
+      for key in keys:
+        batch.append(key)
+        if len(batch) == TOUCH_BATCH_SIZE:
+          yield batch
+          batch = []
+      if batch:
+        yield batch
+    def on_batch(batch, results, error):
+      if error != None:
+        # the whole batch failed, e.g. the worker lost its connection
+        results = [(key, None, error) for key in batch]
+      for key, result, error in results:
+        if error == None:
+          counts["touched"] += 1
+        elif isinstance(error, NotFoundError):
+          counts["not_found"] += 1
+        else:
+          errors.append((key, error))
+    touch = lambda client, batch: list(client.touch_many(batch, lifespan, max_idle))
+    parallel_apply(self.config, batches(), touch, on_batch, workers, limiter=self.limiter)
+    return TouchStats(counts["touched"], counts["not_found"], errors)
+
+  def versions(self, keys):
+    """generator of Result, value is the version or None if the entry doesn't exist"""
+    self._sync_all()
+    for key, version, error in self._get_client().versions(keys):
+      yield Result(key, version, error)
+
+  def build_bloom(self, keys=None, capacity=None, error_rate=None):
+    """builds the Bloom filter of the keys (all the keys if None) sized by capacity and error_rate
+       (config values bloom.capacity and bloom.error_rate if None) and saves it to bloom.file,
+       replacing the previous filter. returns BloomInfo of the new filter"""
+    if self.bloom_path == "":
+      self._error("Set bloom.file to build a Bloom filter.")
+    try:
+      capacity = int(capacity if capacity != None else self.config["bloom.capacity"])
+      error_rate = float(error_rate if error_rate != None else self.config["bloom.error_rate"])
+    except ValueError:
+      self._error("bloom.capacity must be an integer and bloom.error_rate a float")
+    try:
+      bloom = ispncon.bloom.for_capacity(capacity, error_rate, self._bloom_target())
+    except ValueError as e:
+      self._error(e.args[0])
+    self._sync_all()
+    for key in self._keys(keys):
+      bloom.add(key)
+    self.bloom, self.bloom_added, self.bloom_skipped = bloom, [], 0
+    self._save_bloom(True)
+    return self.bloom_info()
+
+  def reload_bloom(self):
+    """loads the filter from bloom.file again after another process rebuilt or reset it. keys put since
+       the last save aren't merged, the new filter was made after their puts"""
+    self.bloom, self.bloom_added = None, []
+    self.bloom_path = None # forces the load
+    self._configure_bloom()
+
+  def bloom_info(self):
+    """BloomInfo of the Bloom filter of the current cache"""
+    bloom = self._bloom_filter()
+    if bloom == None:
+      self._error("No Bloom filter for this cache.")
+    return BloomInfo(bloom.count, bloom.bits, bloom.hashes, bloom.fill_ratio(), bloom.error_rate(), self.bloom_skipped)
+
+  def hotkeys(self, count=10, reset=False):
+    """list of HotKey, the most frequently used keys first"""
+    if self.sampler == None:
+      self._error("Hot key sampling is off. Set hotkeys.capacity to turn it on.")
+    top = [HotKey(*item) for item in self.sampler.top(count)]
+    if reset:
+      self.sampler.reset()
+    return top
+
+  def sizes(self, keys=None, workers=None):
+    """SizeStats of the values under the keys (all the keys if None), read by parallel workers"""
+    workers = self._workers(workers)
+    keys = self._keys(keys)
+    histogram = LogHistogram()
+    failures = {"not_found": 0, "errors": 0}
+    def on_result(key, size, error):
+      if error == None:
+        histogram.add(size)
+      elif isinstance(error, NotFoundError):
+        failures["not_found"] += 1 # removed since the enumeration or wrong key
+      else:
+        failures["errors"] += 1
+    parallel_apply(self.config, keys, lambda client, key: client.size(key), on_result, workers, limiter=self.limiter)
+    return SizeStats(histogram, failures["not_found"], failures["errors"])
+
+  def checksum(self, keys=None, workers=None, buckets=0, only_bucket=None):
+    """ChecksumResult of the entries under the keys (all the keys if None), with per bucket digests
+       if buckets > 0, only_bucket restricts it to the entries of one bucket"""
+    if buckets < 0:
+      self._error("Number of buckets can't be negative.")
+    if only_bucket != None and (only_bucket < 0 or only_bucket >= buckets):
+      self._error("Bucket must be between 0 and number of buckets - 1.")
+    workers = self._workers(workers)
+    keys = self._keys(keys)
+    if only_bucket != None:
+      keys = (key for key in keys if key_bucket(key, buckets) == only_bucket)
+    digest = SetDigest(buckets)
+    entries = []
+    failures = {"not_found": 0, "errors": 0}
+    def on_result(key, ehash, error):
+      if error == None:
+        digest.add(key, ehash)
+        if only_bucket != None:
+          entries.append((key, ehash))
+      elif isinstance(error, NotFoundError):
+        failures["not_found"] += 1
+      else:
+        failures["errors"] += 1
+    # hashing is done by the workers, only the 64-bit hashes travel back
+    parallel_apply(self.config, keys, lambda client, key: entry_hash(key, client.get(key)), on_result, workers, limiter=self.limiter)
+    return ChecksumResult(digest, sorted(entries), failures["not_found"], failures["errors"])
+
+  def watch(self, keys, interval=0.5, max_interval=30.0, count=None, timeout=None):
+    """generator of Change, polls versions of the keys until count changes were seen or timeout
+       seconds passed (forever if both are None). The first poll establishes the baseline."""
+    if interval <= 0 or max_interval < interval:
+      self._error("Interval must be positive and not greater than max interval.")
+    keys = list(keys)
+    self._sync_all()
+    client = self._get_client()
+    deadline = time.time() + timeout if timeout != None else None
+    known = None
+    events = 0
+    wait = interval
+    while True:
+      current = {}
+      changed = False
+      for key, version, error in client.versions(keys):
+        if error != None:
+          yield Change(ERROR, key, None, error)
+          continue
+        current[key] = version
+        if known == None or not key in known:
+          continue
+        old = known[key]
+        if old == version:
+          continue
+        if old == None:
+          yield Change(CREATED, key, version, None)
+        elif version == None:
+          yield Change(REMOVED, key, None, None)
+        else:
+          yield Change(CHANGED, key, version, None)
+        changed = True
+        events += 1
+        if count != None and events >= count:
+          return
+      known = current
+      # poll quickly while entries change, back off exponentially while they don't
+      wait = interval if changed else min(wait * 2, max_interval)
+      if deadline != None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return
+        wait = min(wait, remaining)
+      time.sleep(wait)
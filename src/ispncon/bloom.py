@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Client side Bloom filter of the keys in a cache
+
+Lets lookups of absent keys be answered without a round trip. The filter only knows the keys it was
+built from and the keys added by the puts of this client, writes of other clients after the build
+aren't seen, so it has to be rebuilt when other clients add entries.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import os
+import struct
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+BLOOM_FILE_FORMAT = "ispncon-bloom-1"
+
+class BloomFilter(object):
+  """Set of keys that may answer that it contains a key it doesn't (false positive), but never that
+     it doesn't contain a key that was added. target identifies the cache the keys belong to.
+  """
+  def __init__(self, bits, hashes, target=""):
+    if bits < 8 or hashes < 1:
+      raise ValueError("Bloom filter needs at least 8 bits and 1 hash function")
+    self.bits = bits - bits % 8
+    self.hashes = hashes
+    self.target = target
+    self.count = 0 # keys added, repeated adds of a key included
+    self.data = bytearray(self.bits / 8)
+
+  def _positions(self, key):
+    # double hashing: h1 + i * h2 gives hash functions as good as independent ones (Kirsch, Mitzenmacher)
+    h1, h2 = struct.unpack_from(">QQ", hashlib.md5(key).digest())
+    h2 |= 1
+    return [(h1 + i * h2) % self.bits for i in xrange(self.hashes)]
+
+  def add(self, key):
+    data = self.data
+    for pos in self._positions(key):
+      data[pos >> 3] |= 1 << (pos & 7)
+    self.count += 1
+
+  def __contains__(self, key):
+    data = self.data
+    for pos in self._positions(key):
+      if not data[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+  def reset(self):
+    self.data = bytearray(len(self.data))
+    self.count = 0
+
+  def fill_ratio(self):
+    """fraction of the bits set"""
+    ones = sum(bin(byte).count("1") for byte in self.data)
+    return float(ones) / self.bits
+
+  def error_rate(self):
+    """probability of a false positive estimated from the bits set"""
+    return self.fill_ratio() ** self.hashes
+
+  def save(self, path, added=None):
+    """writes the filter to the file, returns the filter written. if added (keys added since the
+       filter was loaded) is given and the file holds a filter of the same target, the keys are added
+       to that one instead, so that keys saved by other processes using the file (or a rebuilt filter)
+       aren't lost"""
+    lock = open(path + ".lock", "a")
+    try:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      bloom = self
+      if added != None:
+        try:
+          saved = load(path)
+        except (IOError, ValueError):
+          saved = None
+        if saved != None and saved.target == self.target:
+          for key in added:
+            saved.add(key)
+          bloom = saved
+      tmp_path = "%s.%d.tmp" % (path, os.getpid())
+      f = open(tmp_path, "wb")
+      try:
+        header = {"format": BLOOM_FILE_FORMAT, "bits": bloom.bits, "hashes": bloom.hashes,
+                  "target": bloom.target, "count": bloom.count}
+        f.write(json.dumps(header) + "\n")
+        f.write(bloom.data)
+      finally:
+        f.close()
+      os.rename(tmp_path, path)
+      return bloom
+    finally:
+      lock.close()
+
+def for_capacity(capacity, error_rate, target=""):
+  """empty filter sized so that it has the error rate when it holds capacity keys"""
+  if capacity < 1 or error_rate <= 0.0 or error_rate >= 1.0:
+    raise ValueError("Bloom filter capacity must be positive and error rate in interval (0, 1)")
+  bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+  hashes = int(round(float(bits) / capacity * math.log(2)))
+  return BloomFilter(max(bits, 64), max(hashes, 1), target)
+
+def load(path):
+  """filter saved in the file. raises IOError if it can't be read, ValueError if it isn't a filter"""
+  f = open(path, "rb")
+  try:
+    try:
+      header = json.loads(f.readline())
+      if header.get("format") != BLOOM_FILE_FORMAT:
+        raise ValueError
+      bloom = BloomFilter(int(header["bits"]), int(header["hashes"]), header["target"].encode("utf-8"))
+      bloom.count = int(header["count"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+      raise ValueError("%s isn't a Bloom filter file" % path)
+    data = f.read()
+    if len(data) != len(bloom.data):
+      raise ValueError("%s is truncated" % path)
+    bloom.data = bytearray(data)
+    return bloom
+  finally:
+    f.close()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind buffering of puts
+"""
+from collections import OrderedDict
+from ispncon.ratelimit import LimitedClient
+import ispncon.client
+import threading
+import time
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+class WriteBehindBuffer(object):
+  """Collects puts and writes them on a background thread with its own client, in bulk (pipelined
+     where the client supports it). A put of a key that is still waiting in the buffer replaces the
+     buffered value, so only the last value gets written. The buffer is written out when it holds
+     max_entries entries, flush_interval seconds after the first entry was buffered, or on flush().
+     Results of the background writes are kept until taken by take_results(). The config must not
+     change while the buffer is in use, pass a copy.
+  """
+  def __init__(self, config, max_entries, flush_interval, limiter=None):
+    self.config = config
+    self.max_entries = max_entries
+    self.flush_interval = flush_interval
+    self.limiter = limiter
+    self.cond = threading.Condition()
+    self.entries = OrderedDict() # key -> (value, lifespan, max_idle)
+    self.inflight = {}
+    self.first_buffered = None
+    self.flush_requested = False
+    self.closed = False
+    self.written = 0
+    self.errors = [] # (key, CacheClientError)
+    self.client = None
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def put(self, key, value, lifespan=None, max_idle=None):
+    with self.cond:
+      if key in self.entries:
+        del self.entries[key] # keep the order of the last writes
+      self.entries[key] = (value, lifespan, max_idle)
+      if self.first_buffered == None:
+        self.first_buffered = time.time()
+      self.cond.notify_all()
+      # don't let the buffer grow without bounds when the writer can't keep up
+      while len(self.entries) > 2 * self.max_entries and self.thread.is_alive():
+        self.cond.wait(0.1)
+
+  def contains(self, key):
+    """true if the key has a write that didn't reach the cache yet"""
+    with self.cond:
+      return key in self.entries or key in self.inflight
+
+  def flush(self):
+    """waits until everything buffered so far is written"""
+    with self.cond:
+      self.flush_requested = True
+      self.cond.notify_all()
+      while (self.entries or self.inflight) and self.thread.is_alive():
+        self.cond.wait(0.1)
+
+  def take_results(self):
+    """returns (number of entries written, list of (key, error) of the entries that failed) since the
+       last call"""
+    with self.cond:
+      written, errors = self.written, self.errors
+      self.written, self.errors = 0, []
+      return written, errors
+
+  def close(self):
+    """flushes the buffer and stops the writer thread"""
+    self.flush()
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+    self.thread.join()
+
+  def _take_batch(self):
+    with self.cond:
+      while True:
+        if self.entries:
+          if self.flush_requested or self.closed or len(self.entries) >= self.max_entries:
+            break
+          remaining = self.first_buffered + self.flush_interval - time.time()
+          if remaining <= 0:
+            break
+          self.cond.wait(remaining)
+        elif self.closed:
+          return None
+        else:
+          self.flush_requested = False
+          self.cond.wait()
+      self.inflight, self.entries = self.entries, OrderedDict()
+      self.first_buffered = None
+      return self.inflight
+
+  def _run(self):
+    CacheClientError = ispncon.client.CacheClientError
+    while True:
+      batch = self._take_batch()
+      if batch == None:
+        break
+      errors = []
+      try:
+        if self.client == None:
+          self.client = ispncon.client.fromString(self.config)
+          if self.limiter != None and self.limiter.active():
+            self.client = LimitedClient(self.client, self.limiter)
+        # put_many takes one lifespan and max idle for all the entries
+        groups = OrderedDict()
+        for key, (value, lifespan, max_idle) in batch.iteritems():
+          groups.setdefault((lifespan, max_idle), []).append((key, value))
+        for (lifespan, max_idle), entries in groups.iteritems():
+          for key, result, error in self.client.put_many(entries, lifespan, max_idle):
+            if error != None:
+              errors.append((key, error))
+      except Exception as e:
+        error = e if isinstance(e, CacheClientError) else CacheClientError(str(e))
+        errors = [(key, error) for key in batch]
+        if self.client != None:
+          self.client.close()
+          self.client = None
+      with self.cond:
+        self.written += len(batch) - len(errors)
+        self.errors.extend(errors)
+        self.inflight = {}
+        self.cond.notify_all()
+    if self.client != None:
+      self.client.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parallel execution of bulk operations
+"""
+from Queue import Queue
+from ispncon.ratelimit import LimitedClient
+import ispncon.client
+import threading
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+_END = object()
+
+def parallel_apply(config, items, operation, on_result, workers=4, clients=None, limiter=None):
+  """Applies operation(client, item) to every item using a pool of worker threads.
+     Cache clients aren't thread safe so each worker gets its own client created from config,
+     unless a list of clients is supplied, in which case there's one worker per client and the clients
+     are left open.
+     on_result(item, result, error) is called in the calling thread as results arrive (in no
+     particular order), error is the CacheClientError raised by the operation or None.
+     The queues are bounded, so the memory used doesn't depend on the number of items.
+     If a RateLimiter is given, the workers share it and their total throughput stays within its limits.
+  """
+  CacheClientError = ispncon.client.CacheClientError
+  own_clients = clients == None
+  if own_clients:
+    if workers < 1:
+      raise CacheClientError("number of workers must be positive")
+    # create clients up front so that connection problems are reported before any work starts
+    clients = []
+    try:
+      for i in range(workers):
+        clients.append(ispncon.client.fromString(config))
+    except Exception:
+      for client in clients:
+        client.close()
+      raise
+  workers = len(clients)
+  inqueue = Queue(workers * 16)
+  outqueue = Queue(workers * 16)
+
+  def work(client):
+    if limiter != None and limiter.active():
+      client = LimitedClient(client, limiter)
+    try:
+      while True:
+        item = inqueue.get()
+        if item is _END:
+          break
+        try:
+          outqueue.put((item, operation(client, item), None))
+        except CacheClientError as e:
+          outqueue.put((item, None, e))
+        except Exception as e:
+          outqueue.put((item, None, CacheClientError(str(e))))
+    finally:
+      if own_clients:
+        client.close()
+      outqueue.put(_END)
+
+  feed_errors = []
+  def feed():
+    try:
+      for item in items:
+        inqueue.put(item)
+    except Exception as e:
+      feed_errors.append(e)
+    finally:
+      for i in range(workers):
+        inqueue.put(_END)
+
+  threads = [threading.Thread(target=work, args=(client,)) for client in clients]
+  threads.append(threading.Thread(target=feed))
+  for t in threads:
+    t.daemon = True
+    t.start()
+  running = workers
+  while running > 0:
+    res = outqueue.get()
+    if res is _END:
+      running -= 1
+    else:
+      on_result(*res)
+  if feed_errors:
+    raise feed_errors[0]
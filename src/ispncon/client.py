@@ -8,13 +8,22 @@ HotRodCacheClient
 RestCacheClient
 MemcachedCacheClient
 """
-from httplib import HTTPConnection, CONFLICT, OK, NOT_FOUND, NO_CONTENT
-from infinispan.remotecache import RemoteCache, RemoteCacheError
+from collections import deque, OrderedDict
+from httplib import HTTPConnection, HTTPResponse, CONFLICT, OK, NOT_FOUND, NO_CONTENT
+from infinispan import REMOVE
+from infinispan.remotecache import RemoteCache, RemoteCacheError, ServerError
 from ispncon import DEFAULT_CACHE_NAME, TRUE_STR_VALUES
-from ispncon.codec import RiverStringCodec
-from memcache import Client
-##from memcache import __ersion__ as memcache_version
-#import socket # because of MyMemcachedClient
+from ispncon.codec import CodecError
+from ispncon.memcached import MemcachedConnection, MemcachedProtocolError
+from ispncon.transport import TransportError, host_header, is_unix
+import ispncon.bulk
+import ispncon.codec
+import ispncon.transport
+import socket
+import threading
+import time
+import uuid
+import zlib
 
 __author__ = "Michal Linhard"
 __copyright__ = "(C) 2011 Red Hat Inc."
@@ -33,8 +42,12 @@ class NotFoundError(CacheClientError):
   def __init__(self):
     self.msg = "NOT_FOUND"
 
+UPDATE_MAX_RETRIES = 10
+
 class CacheClient(object):
   """Base class for all cache Clients, lists methods they should support"""
+  retries = 0 # operations started over after a version conflict or a failed server
+
   def __init__(self, host, port, cache_name):
     self.host = host
     self.port = port
@@ -72,6 +85,21 @@ class CacheClient(object):
     # default inefficient implementation
     self.get(key) #this throws NotFoundError if not found
 
+  def versions(self, keys):
+    """Poll versions of several entries, transferring as little as the protocol allows
+      keys - iterable of keys
+      returns generator of (key, version or None if the entry doesn't exist, error) in the order of keys,
+      error is the CacheClientError version would raise (other than NotFoundError) or None
+    """
+    # default implementation does one round trip per key
+    for key in keys:
+      try:
+        yield key, self.version(key), None
+      except NotFoundError:
+        yield key, None, None
+      except CacheClientError as e:
+        yield key, None, e
+
   def delete(self, key):
     """Delete the entry under the given key
       key - key
@@ -79,16 +107,179 @@ class CacheClient(object):
     """
     pass
 
+  def delete_many(self, keys):
+    """Delete the entries under the given keys
+      keys - iterable of keys
+      returns generator of (key, None, error) in the order of keys, error is the CacheClientError
+      delete would raise (NotFoundError for missing entries) or None
+    """
+    # default implementation does one round trip per key
+    for key in keys:
+      try:
+        yield key, self.delete(key), None
+      except CacheClientError as e:
+        yield key, None, e
+
+  def touch(self, key, lifespan=None, max_idle=None):
+    """Reset expiration of the entry under the given key
+      key - key
+      lifespan, max_idle - same as in put, None means the entry doesn't expire
+      returns nothing, raises NotFoundError if the entry doesn't exist
+    """
+    # default implementation re-puts the value, the versioned put doesn't overwrite a concurrent write
+    if lifespan == None and max_idle == None and self._expires(key) == False:
+      return # nothing to remove, the entry doesn't expire
+    for attempt in xrange(UPDATE_MAX_RETRIES + 1):
+      version, value = self.get(key, True)
+      try:
+        self.put(key, value, version, lifespan, max_idle)
+        return
+      except ConflictError:
+        if attempt < UPDATE_MAX_RETRIES:
+          self.retries += 1
+    raise ConflictError
+
+  def _expires(self, key):
+    """True if the entry has lifespan or max idle time, False if it doesn't, None if the client can't
+       tell without transferring the value. raises NotFoundError"""
+    return None
+
+  def touch_many(self, keys, lifespan=None, max_idle=None):
+    """Reset expiration of the entries under the given keys
+      keys - iterable of keys
+      lifespan, max_idle - same as in touch
+      returns generator of (key, None, error) in the order of keys, error is the CacheClientError
+      touch would raise or None
+    """
+    # default implementation does one round trip (or two) per key
+    for key in keys:
+      try:
+        yield key, self.touch(key, lifespan, max_idle), None
+      except CacheClientError as e:
+        yield key, None, e
+
   def clear(self):
     """Clears the whole cache
       returns nothing
     """
     pass
 
+  def get_many(self, keys, get_version=False):
+    """Get entries under the given keys
+      keys - iterable of keys
+      get_version - get version flag
+      returns generator of (key, result, error) in the order of keys. result is what get would return,
+      error is the CacheClientError get would raise (result is None in that case) or None
+    """
+    # default implementation does one round trip per key
+    for key in keys:
+      try:
+        yield key, self.get(key, get_version), None
+      except CacheClientError as e:
+        yield key, None, e
+
+  def put_many(self, entries, lifespan=None, max_idle=None):
+    """Put several entries
+      entries - iterable of (key, value)
+      lifespan, max_idle - same as in put, apply to all the entries
+      returns generator of (key, None, error) in the order of entries, error is the CacheClientError
+      put would raise or None
+    """
+    # default implementation does one round trip per entry
+    for key, value in entries:
+      try:
+        yield key, self.put(key, value, None, lifespan, max_idle), None
+      except CacheClientError as e:
+        yield key, None, e
+
+  def get_into(self, key, outfile, get_version=False):
+    """Get entry under the given key and write the value into a file
+      key - key
+      outfile - file object to write the value to
+      get_version - get version flag
+      returns (version, number of bytes written) if get_version otherwise returns just number of bytes written
+    """
+    # default implementation holds the whole value in memory
+    if get_version:
+      version, value = self.get(key, True)
+    else:
+      value = self.get(key)
+    outfile.write(value)
+    return (version, len(value)) if get_version else len(value)
+
+  def update(self, key, transform, max_retries=UPDATE_MAX_RETRIES):
+    """Replace the value under the given key with transform(value) without losing concurrent updates
+      key - key
+      transform - function taking the current value and returning the new one
+      max_retries - how many times to start over if somebody else changed the entry in the meantime
+      returns the new value
+    """
+    # optimistic read-modify-write, the versioned put fails if the entry changed since the read
+    for attempt in xrange(max_retries + 1):
+      version, value = self.get(key, True)
+      new_value = transform(value)
+      try:
+        self.put(key, new_value, version)
+        return new_value
+      except ConflictError:
+        if attempt < max_retries:
+          self.retries += 1
+    raise ConflictError
+
+  def incr(self, key, delta=1, max_retries=UPDATE_MAX_RETRIES):
+    """Add delta to the integer stored as decimal string under the given key
+      key - key
+      delta - integer to add, can be negative
+      max_retries - same as in update
+      returns the new value as integer
+    """
+    def add(value):
+      try:
+        return str(int(value) + delta)
+      except ValueError:
+        self._error("Value of %s is not an integer." % key)
+    return int(self.update(key, add, max_retries))
+
+  def size(self, key):
+    """Get size of the value stored under the given key
+      key - key
+      returns number of bytes of the value
+    """
+    # default implementation transfers the value just to throw it away
+    return len(self.get(key))
+
+  def keys(self):
+    """Enumerate keys stored in the cache
+      returns iterable of keys
+    """
+    self._error("key enumeration is not supported by this client")
+
+  def close(self):
+    """Closes the connection to the server
+      returns nothing
+    """
+    pass
+
   def _error(self, msg):
     raise CacheClientError(msg)
+
+  def _transport(self, config):
+    try:
+      return ispncon.transport.fromConfig(config)
+    except TransportError as e:
+      self._error(e.msg)
   
 def fromString(config):
+  client = _createClient(config)
+  try:
+    threshold = int(config["chunking.threshold"])
+  except ValueError:
+    raise CacheClientError("chunking.threshold must be an integer")
+  if threshold > 0:
+    return ChunkedCacheClient(client, config)
+  return client
+
+def _createClient(config):
   client_str = config["client_type"]
   if client_str == "hotrod":
     return HotRodCacheClient(config)
@@ -98,6 +289,63 @@ def fromString(config):
     return RestCacheClient(config)
   else:
     raise CacheClientError("unknown client type")
+
+# config keys that don't change how clients connect or behave
+_SESSION_CONFIG_KEYS = ["exit_on_error", "default_codec"]
+_SESSION_CONFIG_SECTIONS = ["hotkeys.", "limit.", "buffer.", "client_cache.", "bloom.", "metrics."]
+
+def client_key(config):
+  """tuple of the config values a client created by fromString(config) depends on"""
+  return tuple(sorted((key, value) for key, value in config.iteritems()
+                      if not key in _SESSION_CONFIG_KEYS and not key[:key.find(".") + 1] in _SESSION_CONFIG_SECTIONS))
+
+class ClientCache(object):
+  """Keeps up to max_clients live clients keyed by client_key(config) so that switching the config
+     back and forth (another cache, another host) reuses the connections. The least recently used
+     clients are closed when there are too many of them, clients not used for idle_timeout seconds
+     (0 means never) are closed on the next get. The client returned last is the
+     current one and is never closed by eviction. max_clients 0 turns caching off.
+  """
+  def __init__(self, max_clients=8, idle_timeout=300):
+    self.max_clients = max_clients
+    self.idle_timeout = idle_timeout
+    self.clients = OrderedDict() # client key -> [client, time it stopped being current]
+    self.current = None
+
+  def get(self, config):
+    """client for the config, created by fromString from a snapshot of config"""
+    key = client_key(config)
+    now = time.time()
+    if self.current != None and self.current != key and self.current in self.clients:
+      self.clients[self.current][1] = now
+    entry = self.clients.pop(key, None)
+    if entry != None and key != self.current and self._idle(entry, now):
+      entry[0].close() # the server may have dropped the connection meanwhile
+      entry = None
+    if entry == None:
+      # the client keeps reading the config it was given, later changes must not leak into it
+      entry = [fromString(dict(config)), now]
+    self.clients[key] = entry # most recently used last
+    self.current = key
+    self._evict(now)
+    return entry[0]
+
+  def _evict(self, now):
+    for key, (client, last_used) in self.clients.items():
+      if key == self.current:
+        continue
+      if len(self.clients) > max(self.max_clients, 1) or self._idle((client, last_used), now):
+        del self.clients[key]
+        client.close()
+
+  def _idle(self, entry, now):
+    return self.idle_timeout > 0 and now - entry[1] > self.idle_timeout
+
+  def close(self):
+    for client, last_used in self.clients.itervalues():
+      client.close()
+    self.clients.clear()
+    self.current = None
     
 
 class HotRodCacheClient(CacheClient):
@@ -107,14 +355,31 @@ class HotRodCacheClient(CacheClient):
     super(HotRodCacheClient, self).__init__(config["host"], config["port"], config["cache"])
     self.config = config
     if config["hotrod.use_river_string_keys"] in TRUE_STR_VALUES:
-      self.river_keys = RiverStringCodec()
+      try:
+        self.river_keys = ispncon.codec.fromString(config["hotrod.key_codec"])
+      except CodecError as e:
+        raise CacheClientError("hotrod.key_codec: %s" % e.args[0])
     else:
       self.river_keys = None
     if self.cache_name == DEFAULT_CACHE_NAME: 
       self.cache_name = "";
-    self.remote_cache = RemoteCache(self.host, int(self.port), self.cache_name)
+    try:
+      servers = parse_servers(config["hotrod.servers"], self.port)
+      pool_size = int(config["hotrod.pool_size"])
+      retry_interval = float(config["hotrod.retry_interval"])
+      self.pipeline_window = max(int(config["hotrod.pipeline_window"]), 1)
+    except ValueError:
+      self._error("hotrod.servers must be a list of host:port, hotrod.pool_size and hotrod.pipeline_window integers and hotrod.retry_interval a number of seconds")
+    if not servers:
+      servers = [(self.host, self.port)]
+    if pool_size < 1:
+      self._error("hotrod.pool_size must be positive")
+    self.remote_cache = _RemoteCachePool(self._transport(config), servers, self.cache_name, pool_size, retry_interval, self._retried)
     return
 
+  def _retried(self):
+    self.retries += 1
+
   def _optionally_encode_key(self, key_unmarshalled):
       if self.river_keys == None:
         return key_unmarshalled;
@@ -201,6 +466,27 @@ class HotRodCacheClient(CacheClient):
     except RemoteCacheError as e:
       self._error(e.args)
     
+  def delete_many(self, keys):
+    # removes are written a window at a time before the responses are read
+    keys = iter(keys)
+    while True:
+      batch = [key for i, key in zip(xrange(self.pipeline_window), keys)]
+      if not batch:
+        return
+      try:
+        results = self.remote_cache.pipeline(REMOVE[0], [self._optionally_encode_key(key) for key in batch])
+      except RemoteCacheError as e:
+        for key in batch:
+          yield key, None, CacheClientError(str(e.args))
+        continue
+      for key, result in zip(batch, results):
+        if isinstance(result, RemoteCacheError):
+          yield key, None, CacheClientError(str(result.args))
+        elif result:
+          yield key, None, None
+        else:
+          yield key, None, NotFoundError()
+
   def clear(self):
     self.remote_cache.clear()
     
@@ -212,13 +498,186 @@ class HotRodCacheClient(CacheClient):
     except RemoteCacheError as e:
       self._error(e.args) 
 
+  def keys(self):
+    # hotrod protocol can't list keys only, bulk get transfers the values as well
+    try:
+      entries = self.remote_cache.bulk_get()
+    except RemoteCacheError as e:
+      self._error(e.args)
+    if self.river_keys == None:
+      return entries.keys()
+    keys = []
+    for key in entries.iterkeys():
+      try:
+        key = self.river_keys.decode(key)
+      except CodecError:
+        continue # not a key of our type, we wouldn't be able to address it anyway
+      keys.append(key.encode("utf-8") if isinstance(key, unicode) else str(key))
+    return keys
+
+  def close(self):
+    self.remote_cache.stop()
+
+def parse_servers(spec, default_port):
+  """list of (host, port) from comma separated host[:port] list, raises ValueError"""
+  servers = []
+  for server in spec.split(","):
+    server = server.strip()
+    if server == "":
+      continue
+    host, sep, port = server.rpartition(":")
+    if sep == "" or not port.isdigit():
+      host, port = server, default_port # unix:<path> or host without port
+    servers.append((host, int(port)))
+  return servers
+
+class _ServerPool(object):
+  """idle connections to one server and the time until which the server is considered dead"""
+  def __init__(self, host, port):
+    self.host = host
+    self.port = port
+    self.idle = []
+    self.open = 0
+    self.dead_until = 0
+
+class _RemoteCachePool(object):
+  """Stands in for RemoteCache with several servers. Every operation goes to the next live server
+     (round robin) over a pooled connection, at most pool_size connections per server. When a
+     connection fails (dead or restarted node) the server's connections are dropped, the server is
+     skipped for retry_interval seconds and the operation is retried on the next server. Errors
+     reported by a server (RemoteCacheError) are not retried.
+  """
+  def __init__(self, transport, servers, cache_name, pool_size=1, retry_interval=10, on_retry=None):
+    self.transport = transport
+    self.servers = [_ServerPool(host, port) for host, port in servers]
+    self.cache_name = cache_name
+    self.pool_size = pool_size
+    self.retry_interval = retry_interval
+    self.on_retry = on_retry # called when an operation is retried on the next server
+    self.next = 0
+    self.cond = threading.Condition()
+
+  def _candidates(self):
+    """servers in the order to try them: live ones round robin, then the dead ones"""
+    with self.cond:
+      start = self.next
+      self.next = (self.next + 1) % len(self.servers)
+    ordered = self.servers[start:] + self.servers[:start]
+    now = time.time()
+    return [s for s in ordered if s.dead_until <= now] + sorted([s for s in ordered if s.dead_until > now], key=lambda s: s.dead_until)
+
+  def _acquire(self, server):
+    with self.cond:
+      while not server.idle and server.open >= self.pool_size:
+        self.cond.wait()
+      if server.idle:
+        return server.idle.pop()
+      server.open += 1
+    try:
+      return _TunedRemoteCache(self.transport, server.host, server.port, self.cache_name)
+    except:
+      self._discard(server)
+      raise
+
+  def _release(self, server, conn):
+    with self.cond:
+      server.idle.append(conn)
+      self.cond.notify()
+
+  def _discard(self, server, conn=None):
+    with self.cond:
+      server.open -= 1
+      self.cond.notify()
+    if conn != None:
+      conn.stop()
+
+  def _fail(self, server):
+    """drops idle connections of a server that stopped responding"""
+    with self.cond:
+      server.dead_until = time.time() + self.retry_interval
+      idle, server.idle = server.idle, []
+      server.open -= len(idle)
+      self.cond.notify_all()
+    for conn in idle:
+      conn.stop()
+
+  def _call(self, method, *args):
+    error = None
+    for server in self._candidates():
+      if error != None and self.on_retry != None:
+        self.on_retry()
+      try:
+        conn = self._acquire(server)
+      except socket.error as e:
+        error = e
+        self._fail(server)
+        continue
+      try:
+        result = getattr(conn, method)(*args)
+      except (socket.error, EOFError) as e:
+        error = e
+        self._discard(server, conn)
+        self._fail(server)
+        continue
+      except:
+        self._discard(server, conn) # the connection state is unknown
+        raise
+      self._release(server, conn)
+      return result
+    raise CacheClientError("no hotrod server available: %s" % error)
+
+  def __getattr__(self, name):
+    if name.startswith("_"):
+      raise AttributeError(name)
+    return lambda *args: self._call(name, *args)
+
+  def pipeline(self, op, keys):
+    """sends key only operation op (opcode, e.g. REMOVE[0]) for all the keys over one connection
+       before reading the responses, returns list of results, RemoteCacheError for failed ones"""
+    return self._call("_pipeline", op, keys)
+
+  def stop(self):
+    with self.cond:
+      conns = [conn for server in self.servers for conn in server.idle]
+      for server in self.servers:
+        server.open -= len(server.idle)
+        server.idle = []
+    for conn in conns:
+      conn.stop()
+
+class _TunedRemoteCache(RemoteCache):
+  """RemoteCache connected through our transport (RemoteCache.__init__ only sets the timeout)"""
+  def __init__(self, transport, host, port, cache_name):
+    self.s = transport.connect(host, port)
+    self.cache_name = cache_name
+    self.counter = 0
+    self._assert_vint_len(len(cache_name), "Cache name", cache_name)
+
+  def _pipeline(self, op, keys):
+    for key in keys:
+      self._assert_vint_len(len(key), "Key", key)
+      self._send_op(op, key, '', 0, 0, False, -1, 0)
+    results = []
+    for key in keys:
+      try:
+        results.append(self._get_resp(False))
+      except ServerError as e:
+        results.append(e) # the error response was read whole, the following ones are still in order
+    return results
+
 class RestCacheClient(CacheClient):
   """REST cache client implementation."""
     
   def __init__(self, config):
     super(RestCacheClient, self).__init__(config["host"], config["port"], config["cache"])
     self.config = config
-    self.http_conn = HTTPConnection(self.host, self.port)
+    self.http_conn = _TunedHTTPConnection(self._transport(config), self.host, self.port)
+    try:
+      self.pipeline_window = int(config["rest.pipeline_window"])
+      self.compress_threshold = int(config["rest.compress_threshold"])
+    except ValueError:
+      self._error("rest.pipeline_window and rest.compress_threshold must be integers")
+    self.accept_encoding = config["rest.accept_encoding"]
     return
   
   def _makeurl(self, key):
@@ -227,7 +686,7 @@ class RestCacheClient(CacheClient):
       suffix = "/" + key               
     return self.config["rest.server_url"] + "/" + self.cache_name + suffix
   
-  def put(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False):
+  def _put_request(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False):
     url = self._makeurl(key)
     method = "PUT"
     if (put_if_absent):
@@ -239,38 +698,186 @@ class RestCacheClient(CacheClient):
       headers["maxIdleTimeSeconds"] = max_idle
     if version != None:
       headers["If-Match"] = version
-    self.http_conn.request(method, url, value, headers)
-    resp = self.http_conn.getresponse()
+    if self.compress_threshold > 0 and len(value) >= self.compress_threshold:
+      compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip format
+      value = compressor.compress(value) + compressor.flush()
+      headers["Content-Encoding"] = "gzip"
+    return method, url, value, headers
+
+  def _put_result(self, resp, body):
     if resp.status == OK:
       return
     elif resp.status == CONFLICT:
       raise ConflictError
     else:
       self._error("Unexpected HTTP Status: %s" % resp.status)
-    
-  def get(self, key, get_version=False):
-    url = self._makeurl(key)
-    headers =  {"Content-Type": self.config["rest.content_type"]}
-    
-    self.http_conn.request("GET", url, None, headers)
-    resp = self.http_conn.getresponse()
+
+  def _get_request(self, key):
+    return "GET", self._makeurl(key), None, {"Content-Type": self.config["rest.content_type"],
+                                             "Accept-Encoding": self.accept_encoding}
+
+  def _decode_body(self, resp, body):
+    """undo the Content-Encoding of the response body"""
+    decoder = self._decoder(resp)
+    if decoder == None:
+      return body
+    return decoder.decompress(body) + decoder.flush()
+
+  def _decoder(self, resp):
+    encoding = resp.getheader("Content-Encoding", "identity").strip().lower()
+    if encoding in ("", "identity"):
+      return None
+    elif encoding in ("gzip", "x-gzip", "deflate"):
+      return _ContentDecoder(encoding)
+    self._error("Unsupported Content-Encoding: %s" % encoding)
+
+  def _get_result(self, resp, body, get_version):
     if resp.status == OK:
-      value = resp.read()
       version = resp.getheader("ETag", None)
-      return (version, value) if get_version else value
+      body = self._decode_body(resp, body)
+      return (version, body) if get_version else body
     elif resp.status == NOT_FOUND:
       raise NotFoundError
     else:
       self._error("Unexpected HTTP Status: %s" % resp.status)
 
+  def put(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False):
+    self.http_conn.request(*self._put_request(key, value, version, lifespan, max_idle, put_if_absent))
+    resp = self.http_conn.getresponse()
+    body = resp.read() # the connection is reused, so the response has to be consumed
+    self._put_result(resp, body)
+    
+  def get(self, key, get_version=False):
+    self.http_conn.request(*self._get_request(key))
+    resp = self.http_conn.getresponse()
+    return self._get_result(resp, resp.read(), get_version)
+
+  def get_into(self, key, outfile, get_version=False):
+    # streams the response, decompressing it on the fly
+    self.http_conn.request(*self._get_request(key))
+    resp = self.http_conn.getresponse()
+    if resp.status != OK:
+      self._get_result(resp, resp.read(), get_version) # raises
+    decoder = self._decoder(resp)
+    nbytes = 0
+    while True:
+      data = resp.read(REST_READ_CHUNK)
+      if not data:
+        break
+      if decoder != None:
+        data = decoder.decompress(data)
+      outfile.write(data)
+      nbytes += len(data)
+    if decoder != None:
+      data = decoder.flush()
+      outfile.write(data)
+      nbytes += len(data)
+    return (resp.getheader("ETag", None), nbytes) if get_version else nbytes
+
+  def _pipelined(self, requests):
+    """Writes the requests (method, url, body, headers) back to back without waiting for the responses,
+       keeping at most rest.pipeline_window of them in flight, and yields (response, body) in request order.
+       If the server closes the connection, the unanswered requests are sent again over a new one.
+    """
+    pending = deque()
+    requests = iter(requests)
+    exhausted = False
+    reader = None
+    try:
+      while True:
+        while not exhausted and len(pending) < self.pipeline_window:
+          try:
+            request = requests.next()
+          except StopIteration:
+            exhausted = True
+            break
+          if reader == None:
+            reader = self._pipeline_reader()
+          self.http_conn.sock.sendall(self._format_request(*request))
+          pending.append(request)
+        if not pending:
+          return
+        request = pending.popleft()
+        resp = HTTPResponse(reader, method=request[0])
+        resp.begin()
+        body = resp.read()
+        if resp.will_close:
+          self.http_conn.close()
+          reader = None
+          if pending:
+            reader = self._pipeline_reader()
+            for unanswered in pending:
+              self.http_conn.sock.sendall(self._format_request(*unanswered))
+        yield resp, body
+    finally:
+      if pending:
+        # responses left unread would be taken as responses to the following requests
+        self.http_conn.close()
+
+  def _pipeline_reader(self):
+    if self.http_conn.sock == None:
+      self.http_conn.connect()
+    return _PipelineReader(self.http_conn.sock)
+
+  def _format_request(self, method, url, body, headers):
+    lines = ["%s %s HTTP/1.1" % (method, url), "Host: %s" % host_header(self.host, self.port)]
+    if not "Accept-Encoding" in headers:
+      lines.append("Accept-Encoding: identity")
+    for name, value in headers.iteritems():
+      lines.append("%s: %s" % (name, value))
+    if body != None:
+      lines.append("Content-Length: %d" % len(body))
+    elif method in ("PUT", "POST"):
+      lines.append("Content-Length: 0")
+    return "\r\n".join(lines) + "\r\n\r\n" + (body if body != None else "")
+
+  def get_many(self, keys, get_version=False):
+    if self.pipeline_window <= 1:
+      for res in super(RestCacheClient, self).get_many(keys, get_version):
+        yield res
+      return
+    sent = deque()
+    def requests():
+      for key in keys:
+        sent.append(key)
+        yield self._get_request(key)
+    for resp, body in self._pipelined(requests()):
+      key = sent.popleft()
+      try:
+        yield key, self._get_result(resp, body, get_version), None
+      except CacheClientError as e:
+        yield key, None, e
+
+  def put_many(self, entries, lifespan=None, max_idle=None):
+    if self.pipeline_window <= 1:
+      for res in super(RestCacheClient, self).put_many(entries, lifespan, max_idle):
+        yield res
+      return
+    sent = deque()
+    def requests():
+      for key, value in entries:
+        sent.append(key)
+        yield self._put_request(key, value, None, lifespan, max_idle)
+    for resp, body in self._pipelined(requests()):
+      key = sent.popleft()
+      try:
+        yield key, self._put_result(resp, body), None
+      except CacheClientError as e:
+        yield key, None, e
+
   def delete(self, key, version=None):
-    url = self._makeurl(key)
+    self.http_conn.request(*self._delete_request(key, version))
+    resp = self.http_conn.getresponse()
+    resp.read()
+    self._delete_result(resp)
+
+  def _delete_request(self, key, version=None):
     headers =  {}
     if version != None:
       headers["If-Match"] = version
-      
-    self.http_conn.request("DELETE", url, None, headers)
-    resp = self.http_conn.getresponse()
+    return "DELETE", self._makeurl(key), None, headers
+
+  def _delete_result(self, resp):
     if resp.status == OK:
       return
     elif resp.status == NO_CONTENT:
@@ -279,12 +886,30 @@ class RestCacheClient(CacheClient):
       raise ConflictError
     else:
       self._error("Unexpected HTTP Status: %s" % resp.status)
+
+  def delete_many(self, keys):
+    if self.pipeline_window <= 1:
+      for res in super(RestCacheClient, self).delete_many(keys):
+        yield res
+      return
+    sent = deque()
+    def requests():
+      for key in keys:
+        sent.append(key)
+        yield self._delete_request(key)
+    for resp, body in self._pipelined(requests()):
+      key = sent.popleft()
+      try:
+        yield key, self._delete_result(resp), None
+      except CacheClientError as e:
+        yield key, None, e
     
   def clear(self):
     url = self._makeurl(None)
       
     self.http_conn.request("DELETE", url, None, {})
     resp = self.http_conn.getresponse()
+    resp.read()
     if resp.status == NO_CONTENT:
       return
     else:
@@ -296,6 +921,7 @@ class RestCacheClient(CacheClient):
     
     self.http_conn.request("HEAD", url, None, headers)
     resp = self.http_conn.getresponse()
+    resp.read()
     if resp.status == OK:
       return
     elif resp.status == NOT_FOUND:
@@ -303,12 +929,60 @@ class RestCacheClient(CacheClient):
     else:
       self._error("Unexpected HTTP Status: %s" % resp.status)
 
-  def version(self, key):
+  def size(self, key):
     url = self._makeurl(key)
     headers =  {"Content-Type": self.config["rest.content_type"]}
 
     self.http_conn.request("HEAD", url, None, headers)
     resp = self.http_conn.getresponse()
+    resp.read()
+    if resp.status == OK:
+      length = resp.getheader("Content-Length", None)
+      if (length == None):
+        return super(RestCacheClient, self).size(key)
+      return int(length)
+    elif resp.status == NOT_FOUND:
+      raise NotFoundError
+    else:
+      self._error("Unexpected HTTP Status: %s" % resp.status)
+
+  def _expires(self, key):
+    # the server sends Expires for entries with lifespan or max idle time
+    self.http_conn.request(*self._version_request(key))
+    resp = self.http_conn.getresponse()
+    resp.read()
+    if resp.status == OK:
+      return resp.getheader("Expires", None) != None
+    elif resp.status == NOT_FOUND:
+      raise NotFoundError
+    else:
+      self._error("Unexpected HTTP Status: %s" % resp.status)
+
+  def keys(self):
+    url = self._makeurl(None)
+    headers =  {"Accept": "text/plain", "Accept-Encoding": self.accept_encoding}
+
+    self.http_conn.request("GET", url, None, headers)
+    resp = self.http_conn.getresponse()
+    body = resp.read()
+    if resp.status == OK:
+      return [key for key in self._decode_body(resp, body).splitlines() if key != ""]
+    else:
+      self._error("Unexpected HTTP Status: %s" % resp.status)
+
+  def close(self):
+    self.http_conn.close()
+
+  def version(self, key):
+    self.http_conn.request(*self._version_request(key))
+    resp = self.http_conn.getresponse()
+    resp.read()
+    return self._version_result(resp)
+
+  def _version_request(self, key):
+    return "HEAD", self._makeurl(key), None, {"Content-Type": self.config["rest.content_type"]}
+
+  def _version_result(self, resp):
     if resp.status == OK:
       version = resp.getheader("ETag", None)
       if (version == None):
@@ -318,81 +992,97 @@ class RestCacheClient(CacheClient):
       raise NotFoundError
     else:
       self._error("Unexpected HTTP Status: %s" % resp.status)
+
+  def versions(self, keys):
+    if self.pipeline_window <= 1:
+      for res in super(RestCacheClient, self).versions(keys):
+        yield res
+      return
+    sent = deque()
+    def requests():
+      for key in keys:
+        sent.append(key)
+        yield self._version_request(key)
+    for resp, body in self._pipelined(requests()):
+      key = sent.popleft()
+      try:
+        yield key, self._version_result(resp), None
+      except NotFoundError:
+        yield key, None, None
+      except CacheClientError as e:
+        yield key, None, e
     
-MEMCACHED_LIFESPAN_MAX_SECONDS = 60*60*24*30
+class _TunedHTTPConnection(HTTPConnection):
+  """HTTPConnection connected through our transport"""
+  def __init__(self, transport, host, port):
+    HTTPConnection.__init__(self, host, port)
+    self.transport = transport
+
+  def connect(self):
+    self.sock = self.transport.connect(self.host, self.port)
+
+  def putrequest(self, method, url, skip_host=0, skip_accept_encoding=0):
+    if is_unix(self.host) and not skip_host:
+      HTTPConnection.putrequest(self, method, url, 1, skip_accept_encoding)
+      self.putheader("Host", host_header(self.host, self.port))
+    else:
+      HTTPConnection.putrequest(self, method, url, skip_host, skip_accept_encoding)
+
+REST_READ_CHUNK = 65536
+
+class _ContentDecoder(object):
+  """Incremental decompression of gzip or deflate content encoding. deflate should be zlib format,
+     but some servers send raw deflate data, so the format is guessed from the first bytes."""
+  def __init__(self, encoding):
+    self.encoding = encoding
+    self.decompressor = None
+    self.head = ""
+
+  def decompress(self, data):
+    if self.decompressor == None:
+      if self.encoding != "deflate":
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+      else:
+        self.head += data
+        if len(self.head) < 2:
+          return ""
+        data, self.head = self.head, ""
+        cmf, flg = ord(data[0]), ord(data[1])
+        is_zlib = cmf & 0x0f == 8 and (cmf * 256 + flg) % 31 == 0
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS if is_zlib else -zlib.MAX_WBITS)
+    try:
+      return self.decompressor.decompress(data)
+    except zlib.error as e:
+      raise CacheClientError("Error decompressing response: %s" % e)
+
+  def flush(self):
+    if self.decompressor == None:
+      if self.head:
+        raise CacheClientError("Error decompressing response: truncated data")
+      return ""
+    try:
+      return self.decompressor.flush()
+    except zlib.error as e:
+      raise CacheClientError("Error decompressing response: %s" % e)
+
+class _PipelineReader(object):
+  """Lets consecutive httplib.HTTPResponse objects parse responses from one shared buffered stream"""
+  def __init__(self, sock):
+    self.fp = sock.makefile("rb")
+
+  def makefile(self, mode, bufsize=0):
+    return self
+
+  def read(self, *args):
+    return self.fp.read(*args)
 
-# extension of python-memcached client that can distinguish some more return states of the set operation
-# it needs to exist because of following issues in the python-memcache library:
-# https://bugs.launchpad.net/python-memcached/+bug/684689
-# https://bugs.launchpad.net/python-memcached/+bug/684690
-# as soon as these are solved we can return to the original Client
-# so far to prevent mysterious bugs we'll require fixed memcache version 1.47
-
-# other possibility is that we'll document limitations of memcached client.
-
-#class MyMemcachedClient(Client):
-#  def __init__(self, *args, **kw):
-#    super(MyMemcachedClient, self).__init__(*args, **kw)
-#    if memcache_version != "1.47":
-#      raise CacheClientError("Unsupported python-memcached library version")
-#    self.last_set_status = None
-#    
-#  def _set(self, cmd, key, val, time, min_compress_len = 0):
-#    self.check_key(key)
-#    server, key = self._get_server(key)
-#    if not server:
-#      return 0
-#    
-#    self._statlog(cmd)
-#    
-#    store_info = self._val_to_store_info(val, min_compress_len)
-#    if not store_info: return(0)
-#    
-#    if cmd == 'cas':
-#      if key not in self.cas_ids:
-#        return self._set('set', key, val, time, min_compress_len)
-#      fullcmd = "%s %s %d %d %d %d\r\n%s" % (
-#          cmd, key, store_info[0], time, store_info[1],
-#          self.cas_ids[key], store_info[2])
-#    else:
-#      fullcmd = "%s %s %d %d %d\r\n%s" % (
-#          cmd, key, store_info[0], time, store_info[1], store_info[2])
-#    
-#    try:
-#      server.send_cmd(fullcmd)
-#      self.last_set_status = server.expect("STORED") 
-#      return(self.last_set_status == "STORED")
-#    except socket.error, msg:
-#      if isinstance(msg, tuple): msg = msg[1]
-#      server.mark_dead(msg)
-#      self.last_set_status = "ERROR socket error"
-#    return 0
-#  
-#  def delete(self, key, time=0):
-#    self.check_key(key)
-#    server, key = self._get_server(key)
-#    if not server:
-#        return 0
-#    self._statlog('delete')
-#    if time != None:
-#        cmd = "delete %s %d" % (key, time)
-#    else:
-#        cmd = "delete %s" % key
-#    
-#    try:
-#        server.send_cmd(cmd)
-#        line = server.readline()
-#        if line:
-#          self.last_set_status = line.strip() 
-#          if self.last_set_status in ['DELETED', 'NOT_FOUND']: return 1
-#        self.debuglog('Delete expected DELETED or NOT_FOUND, got: %s'
-#                % repr(line))
-#    except socket.error, msg:
-#        if isinstance(msg, tuple): msg = msg[1]
-#        server.mark_dead(msg)
-#        self.last_set_status = "ERROR socket error"
-#    return 0
+  def readline(self, *args):
+    return self.fp.readline(*args)
 
+  def close(self):
+    pass # HTTPResponse closes its file when done, but the stream continues with the next response
+
+MEMCACHED_LIFESPAN_MAX_SECONDS = 60*60*24*30
 
 class MemcachedCacheClient(CacheClient):
   """Memcached cache client implementation."""
@@ -402,87 +1092,611 @@ class MemcachedCacheClient(CacheClient):
     self.config = config
     if self.cache_name != DEFAULT_CACHE_NAME:
       print "WARNING: memcached client doesn't support named caches. cache_name config value will be ignored and default cache will be used instead."
-    self.memcached_client = Client([self.host + ':' + self.port], debug=0)
+    try:
+      window = int(config["memcached.pipeline_window"])
+    except ValueError:
+      self._error("memcached.pipeline_window must be an integer")
+    self.noreply_bulk = config["memcached.noreply_bulk"] in TRUE_STR_VALUES
+    self.conn = MemcachedConnection(self.host, self.port, max(window, 1), self._transport(config))
+    meta = config["memcached.meta_commands"]
+    if meta == "auto":
+      self.meta_commands = None # find out on first use
+    else:
+      self.meta_commands = meta in TRUE_STR_VALUES
     return
-  
-  def put(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False):
-    time = 0
-    if lifespan != None:
-      if lifespan > MEMCACHED_LIFESPAN_MAX_SECONDS:
-        self._error("Memcached cache client supports lifespan values only up to %s seconds (30 days)." % MEMCACHED_LIFESPAN_MAX_SECONDS)
-      time = lifespan
+
+  def _use_meta(self):
+    """true if version/exists/size can use meta commands, which don't transfer the value"""
+    if self.meta_commands == None:
+      try:
+        self.meta_commands = self.conn.meta_noop() == "MN"
+      except MemcachedProtocolError as e:
+        self._error(e.msg)
+    return self.meta_commands
+
+  def _meta(self, key, flags):
+    """returns dict flag -> value of the entry's metadata, raises NotFoundError"""
+    try:
+      reply = self.conn.meta_get(key, flags)
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    return self._meta_result(reply)
+
+  def _meta_result(self, reply):
+    tokens = reply.split(" ")
+    if tokens[0] == "EN":
+      raise NotFoundError
+    elif tokens[0] != "HD":
+      self._error("Operation unsuccessful. " + reply)
+    return dict((token[0], token[1:]) for token in tokens[1:] if token)
+
+  def version(self, key):
+    if not self._use_meta():
+      return super(MemcachedCacheClient, self).version(key)
+    meta = self._meta(key, ["c"])
+    if not "c" in meta:
+      self._error("Couldn't obtain version info from memcached server.")
+    return long(meta["c"])
+
+  def exists(self, key):
+    if not self._use_meta():
+      return super(MemcachedCacheClient, self).exists(key)
+    self._meta(key, [])
+
+  def size(self, key):
+    if not self._use_meta():
+      return super(MemcachedCacheClient, self).size(key)
+    meta = self._meta(key, ["s"])
+    if not "s" in meta:
+      self._error("Couldn't obtain value size from memcached server.")
+    return int(meta["s"])
+
+  def _exptime(self, lifespan, max_idle):
     if max_idle != None:
       self._error("Memcached cache client doesn't support max idle time setting.")
+    if lifespan == None:
+      return 0
+    if lifespan > MEMCACHED_LIFESPAN_MAX_SECONDS:
+      self._error("Memcached cache client supports lifespan values only up to %s seconds (30 days)." % MEMCACHED_LIFESPAN_MAX_SECONDS)
+    return lifespan
+
+  def _store_result(self, status):
+    if status == "STORED":
+      return
+    elif status in ("NOT_STORED", "EXISTS"):
+      raise ConflictError
+    elif status == "NOT_FOUND":
+      raise NotFoundError
+    else:
+      self._error("Operation unsuccessful. " + status)
+
+  def put(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False):
+    time = self._exptime(lifespan, max_idle)
     try:
       if (version == None):
         if (put_if_absent):
-          if not self.memcached_client.add(key, value, time, 0):
-          # current python-memcached doesn't recoginze these states
-          # if self.memcached_client.last_set_status == "NOT_STORED":
-          #   raise ConflictError
-          # else:
-          #   self._error("Operation unsuccessful. " + self.memcached_client.last_set_status)
-            self._error("Operation unsuccessful. Possibly CONFLICT.")
+          status = self.conn.store("add", key, value, time)
         else:
-          if not self.memcached_client.set(key, value, time, 0):
-          # self._error("Operation unsuccessful. " + self.memcached_client.last_set_status)
-            self._error("Operation unsuccessful.")
+          status = self.conn.store("set", key, value, time)
       else:
         try:
-          self.memcached_client.cas_ids[key] = int(version)
+          cas = long(version)
         except ValueError:
           self._error("Please provide an integer version.")
-        if not self.memcached_client.cas(key, value, time, 0):
-#         if self.memcached_client.last_set_status == "EXISTS":
-#           raise ConflictError
-#         if self.memcached_client.last_set_status == "NOT_FOUND":
-#           raise NotFoundError
-#         else:
-#           self._error("Operation unsuccessful. " + self.memcached_client.last_set_status)
-          self._error("Operation unsuccessful. Possibly CONFLICT, NOT_FOUND.")
-    except CacheClientError as e:
-      raise e #rethrow
-    except Exception as e:
-      self._error(e)
+        status = self.conn.store("cas", key, value, time, 0, cas)
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    self._store_result(status)
     
   def get(self, key, get_version=False):
     try:
-      if get_version:
-        val = self.memcached_client.gets(key)
-        if val == None:
-          raise NotFoundError
-        version = self.memcached_client.cas_ids[key]
-        if version == None:
-          self._error("Couldn't obtain version info from memcached server.")
-        return version, val
+      values = self.conn.retrieve("gets" if get_version else "get", [key])
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    if not key in values:
+      raise NotFoundError
+    flags, value, cas = values[key]
+    if get_version:
+      if cas == None:
+        self._error("Couldn't obtain version info from memcached server.")
+      return cas, value
+    return value
+
+  def get_many(self, keys, get_version=False):
+    # one multi-key get per window of keys
+    cmd = "gets" if get_version else "get"
+    keys = iter(keys)
+    while True:
+      batch = [key for i, key in zip(xrange(self.conn.window), keys)]
+      if not batch:
+        return
+      try:
+        values = self.conn.retrieve(cmd, batch)
+      except MemcachedProtocolError as e:
+        for key in batch:
+          yield key, None, CacheClientError(e.msg)
+        continue
+      for key in batch:
+        if key in values:
+          flags, value, cas = values[key]
+          yield key, (cas, value) if get_version else value, None
+        else:
+          yield key, None, NotFoundError()
+
+  def versions(self, keys):
+    if self._use_meta():
+      # pipelined meta gets, one small reply per key
+      sent = deque()
+      def requests():
+        for key in keys:
+          sent.append(key)
+          yield self.conn.format_meta_get(key, ["c"])
+      try:
+        for reply in self.conn.pipeline(requests(), self.conn.read_status):
+          key = sent.popleft()
+          try:
+            yield key, long(self._meta_result(reply)["c"]), None
+          except NotFoundError:
+            yield key, None, None
+          except KeyError:
+            yield key, None, CacheClientError("Couldn't obtain version info from memcached server.")
+          except CacheClientError as e:
+            yield key, None, e
+      except MemcachedProtocolError as e:
+        self._error(e.msg)
+      return
+    # gets returns the values as well, but checks a whole window of keys in one round trip
+    keys = iter(keys)
+    while True:
+      batch = [key for i, key in zip(xrange(self.conn.window), keys)]
+      if not batch:
+        return
+      try:
+        values = self.conn.retrieve("gets", batch)
+      except MemcachedProtocolError as e:
+        for key in batch:
+          yield key, None, CacheClientError(e.msg)
+        continue
+      for key in batch:
+        if key in values:
+          yield key, values[key][2], None
+        else:
+          yield key, None, None
+
+  def put_many(self, entries, lifespan=None, max_idle=None):
+    time = self._exptime(lifespan, max_idle)
+    sent = deque()
+    def requests():
+      for key, value in entries:
+        sent.append(key)
+        yield self.conn.format_store("set", key, value, time, 0, None, self.noreply_bulk)
+    try:
+      if self.noreply_bulk:
+        # only errors come back and it's unknown which entry they belong to, so the whole batch fails
+        for count, errors in self.conn.pipeline_noreply(requests()):
+          error = None
+          if errors:
+            error = CacheClientError("Operation unsuccessful. %s (%d of %d noreply puts of the batch failed)" % (errors[0], len(errors), count))
+          for i in xrange(count):
+            yield sent.popleft(), None, error
+        return
+      for status in self.conn.pipeline(requests(), self.conn.read_status):
+        key = sent.popleft()
+        try:
+          yield key, self._store_result(status), None
+        except CacheClientError as e:
+          yield key, None, e
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+
+  def incr(self, key, delta=1, max_retries=UPDATE_MAX_RETRIES):
+    # native incr/decr is atomic on the server, no retries needed. note that memcached doesn't go below 0
+    try:
+      if delta >= 0:
+        reply = self.conn.incr("incr", key, delta)
       else:
-        val = self.memcached_client.get(key)
-        if val == None:
-          raise NotFoundError
-        return val 
-    except CacheClientError as e:
-      raise e #rethrow
-    except Exception as e:
-      self._error(e.args)
+        reply = self.conn.incr("decr", key, -delta)
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    if reply == "NOT_FOUND":
+      raise NotFoundError
+    try:
+      return long(reply)
+    except ValueError:
+      self._error("Operation unsuccessful. " + reply)
 
   def delete(self, key, version=None):
+    if version:
+      self._error("versioned delete operation not available for memcached client")
     try:
-      if version:
-        self._error("versioned delete operation not available for memcached client")
-      if self.memcached_client.delete(key, 0):
-        if self.memcached_client.last_set_status == "NOT_FOUND":
-          raise NotFoundError
-      else:
-        self._error("Operation unsuccessful. " + self.memcached_client.last_set_status)
-    except CacheClientError as e:
-      raise e #rethrow
-    except Exception as e:
-      self._error(e.args)
+      status = self.conn.delete(key)
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    self._delete_result(status)
+
+  def _delete_result(self, status):
+    if status == "DELETED":
+      return
+    elif status == "NOT_FOUND":
+      raise NotFoundError
+    else:
+      self._error("Operation unsuccessful. " + status)
+
+  def delete_many(self, keys):
+    # replies are read even with noreply_bulk, they tell deleted entries from missing ones
+    sent = deque()
+    def requests():
+      for key in keys:
+        sent.append(key)
+        yield self.conn.format_delete(key)
+    try:
+      for status in self.conn.pipeline(requests(), self.conn.read_status):
+        key = sent.popleft()
+        try:
+          yield key, self._delete_result(status), None
+        except CacheClientError as e:
+          yield key, None, e
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+
+  def touch(self, key, lifespan=None, max_idle=None):
+    time = self._exptime(lifespan, max_idle)
+    try:
+      status = self.conn.touch(key, time)
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    self._touch_result(status)
+
+  def _touch_result(self, status):
+    if status == "TOUCHED":
+      return
+    elif status == "NOT_FOUND":
+      raise NotFoundError
+    else:
+      self._error("Operation unsuccessful. " + status)
+
+  def touch_many(self, keys, lifespan=None, max_idle=None):
+    time = self._exptime(lifespan, max_idle)
+    # replies are read even with noreply_bulk, they tell touched entries from missing ones
+    sent = deque()
+    def requests():
+      for key in keys:
+        sent.append(key)
+        yield self.conn.format_touch(key, time)
+    try:
+      for status in self.conn.pipeline(requests(), self.conn.read_status):
+        key = sent.popleft()
+        try:
+          yield key, self._touch_result(status), None
+        except CacheClientError as e:
+          yield key, None, e
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
     
   def clear(self):
     try:
-      self.memcached_client.flush_all()
-    except CacheClientError as e:
-      raise e #rethrow
-    except Exception as e:
-      self._error(e.args)
+      status = self.conn.flush_all()
+    except MemcachedProtocolError as e:
+      self._error(e.msg)
+    if status != "OK":
+      self._error("Operation unsuccessful. " + status)
+
+  def keys(self):
+    self._error("memcached protocol doesn't support key enumeration")
+
+  def close(self):
+    self.conn.close()
+
+CHUNK_MANIFEST_MAGIC = "ISPNCON_CHUNKED_VALUE"
+CHUNK_MANIFEST_MAX_LEN = 256
+
+class ChunkedCacheClient(CacheClient):
+  """Wraps another cache client and stores values longer than chunking.threshold as several chunk entries.
+     The original key holds a small manifest and a marker entry tells that the key may hold one. Chunk keys
+     contain a token unique for each put, so readers never mix chunks of two different values. Chunks are transferred in parallel, each worker with its own connection.
+  """
+
+  def __init__(self, client, config):
+    super(ChunkedCacheClient, self).__init__(client.host, client.port, client.cache_name)
+    self.client = client
+    self.config = config
+    try:
+      self.threshold = int(config["chunking.threshold"])
+      self.chunk_size = int(config["chunking.chunk_size"])
+      self.workers = int(config["bulk.workers"])
+    except ValueError:
+      self._error("chunking.threshold, chunking.chunk_size and bulk.workers must be integers")
+    if self.chunk_size < 1 or self.workers < 1:
+      self._error("chunking.chunk_size and bulk.workers must be positive")
+    self.worker_clients = None
+
+  def _parallel(self, items, operation, on_result):
+    if self.worker_clients == None:
+      self.worker_clients = []
+      for i in range(self.workers):
+        self.worker_clients.append(_createClient(self.config))
+    errors = []
+    def collect(item, result, error):
+      if error != None:
+        errors.append(error)
+      else:
+        on_result(item, result)
+    ispncon.bulk.parallel_apply(self.config, items, operation, collect, clients=self.worker_clients)
+    if errors:
+      raise errors[0]
+
+  def _chunk_key(self, key, token, idx):
+    return "%s.__chunk.%s.%d" % (key, token, idx)
+
+  def _parse_manifest(self, value):
+    """returns (token, total length, chunk size, chunk count) or None if the value isn't a manifest"""
+    if len(value) > CHUNK_MANIFEST_MAX_LEN or not value.startswith(CHUNK_MANIFEST_MAGIC):
+      return None
+    try:
+      magic, token, total, chunk_size, count = value.split(" ")
+      return token, int(total), int(chunk_size), int(count)
+    except ValueError:
+      return None
+
+  def _delete_chunks(self, key, manifest):
+    """best effort removal of the chunks, leftovers don't affect readers since the manifest doesn't point to them"""
+    token, total, chunk_size, count = manifest
+    def delete_chunk(client, idx):
+      try:
+        client.delete(self._chunk_key(key, token, idx))
+      except CacheClientError:
+        pass
+    self._parallel(xrange(count), delete_chunk, lambda idx, result: None)
+
+  def _marker_key(self, key):
+    # marks keys that may hold a manifest, so that writes of other keys don't fetch the old value
+    return "%s.__chunk.marker" % key
+
+  def _marked(self, client, key):
+    try:
+      client.exists(self._marker_key(key))
+      return True
+    except NotFoundError:
+      return False
+
+  def _put_marker(self, key, lifespan):
+    # no max idle time, reads of the value don't reach the marker. a marker outliving its manifest only
+    # costs a get at the next write of the key, which removes it
+    self.client.put(self._marker_key(key), "1", None, lifespan, None)
+
+  def _drop_chunked(self, key, manifest):
+    """best effort removal of the chunks (if manifest isn't None) and the marker of a value that was
+       overwritten or deleted"""
+    if manifest != None:
+      self._delete_chunks(key, manifest)
+    try:
+      self.client.delete(self._marker_key(key))
+    except CacheClientError:
+      pass
+
+  def _old_manifest(self, key):
+    """returns (True if the key is marked, manifest of its chunked value or None), the value is only
+       fetched for marked keys"""
+    if not self._marked(self.client, key):
+      return False, None
+    try:
+      return True, self._parse_manifest(self.client.get(key))
+    except NotFoundError:
+      return True, None
+
+  def put(self, key, value, version=None, lifespan=None, max_idle=None, put_if_absent=False):
+    # chunks of a chunked value being overwritten are deleted once the new value is stored
+    marked, old_manifest = self._old_manifest(key)
+    if len(value) <= self.threshold:
+      self.client.put(key, value, version, lifespan, max_idle, put_if_absent)
+      if marked:
+        self._drop_chunked(key, old_manifest)
+      return
+    self._put_marker(key, lifespan)
+    token = uuid.uuid4().hex
+    count = (len(value) + self.chunk_size - 1) / self.chunk_size
+    def put_chunk(client, idx):
+      offset = idx * self.chunk_size
+      client.put(self._chunk_key(key, token, idx), value[offset:offset + self.chunk_size], None, lifespan, max_idle)
+    self._parallel(xrange(count), put_chunk, lambda idx, result: None)
+    manifest = (token, len(value), self.chunk_size, count)
+    try:
+      self.client.put(key, "%s %s %d %d %d" % ((CHUNK_MANIFEST_MAGIC,) + manifest), version, lifespan, max_idle, put_if_absent)
+    except CacheClientError:
+      self._delete_chunks(key, manifest)
+      raise
+    if old_manifest != None:
+      self._delete_chunks(key, old_manifest)
+
+  def _fetch_chunks(self, key, manifest, write):
+    token, total, chunk_size, count = manifest
+    def get_chunk(client, idx):
+      try:
+        return client.get(self._chunk_key(key, token, idx))
+      except NotFoundError:
+        self._error("chunk %d of %s is missing" % (idx, key))
+    self._parallel(xrange(count), get_chunk, lambda idx, chunk: write(idx * chunk_size, chunk))
+
+  def get(self, key, get_version=False):
+    if get_version:
+      version, value = self.client.get(key, True)
+    else:
+      value = self.client.get(key)
+    manifest = self._parse_manifest(value)
+    if manifest != None:
+      value = self._assemble(key, manifest)
+    return (version, value) if get_version else value
+
+  def _assemble(self, key, manifest):
+    buf = bytearray(manifest[1])
+    def write(offset, chunk):
+      buf[offset:offset + len(chunk)] = chunk
+    self._fetch_chunks(key, manifest, write)
+    return str(buf)
+
+  def get_many(self, keys, get_version=False):
+    for key, result, error in self.client.get_many(keys, get_version):
+      if error == None:
+        manifest = self._parse_manifest(result[1] if get_version else result)
+        if manifest != None:
+          try:
+            value = self._assemble(key, manifest)
+          except CacheClientError as e:
+            yield key, None, e
+            continue
+          result = (result[0], value) if get_version else value
+      yield key, result, error
+
+  def put_many(self, entries, lifespan=None, max_idle=None):
+    # short values go through the wrapped client in batches, chunked ones are stored one by one
+    batch = []
+    for key, value in entries:
+      if len(value) <= self.threshold:
+        batch.append((key, value))
+        if len(batch) < 1024:
+          continue
+      for res in self._put_batch(batch, lifespan, max_idle):
+        yield res
+      batch = []
+      if len(value) > self.threshold:
+        try:
+          yield key, self.put(key, value, None, lifespan, max_idle), None
+        except CacheClientError as e:
+          yield key, None, e
+    for res in self._put_batch(batch, lifespan, max_idle):
+      yield res
+
+  def _put_batch(self, batch, lifespan, max_idle):
+    if not batch:
+      return
+    old_manifests = self._manifests([key for key, value in batch])
+    for key, result, error in self.client.put_many(batch, lifespan, max_idle):
+      if error == None and key in old_manifests:
+        self._drop_chunked(key, old_manifests[key])
+      yield key, result, error
+
+  def get_into(self, key, outfile, get_version=False):
+    if get_version:
+      version, value = self.client.get(key, True)
+    else:
+      value = self.client.get(key)
+    manifest = self._parse_manifest(value)
+    if manifest == None:
+      outfile.write(value)
+      nbytes = len(value)
+    else:
+      start = outfile.tell()
+      def write(offset, chunk):
+        # chunks arrive in any order, write each one directly at its position
+        outfile.seek(start + offset)
+        outfile.write(chunk)
+      self._fetch_chunks(key, manifest, write)
+      outfile.seek(start + manifest[1])
+      nbytes = manifest[1]
+    return (version, nbytes) if get_version else nbytes
+
+  def version(self, key):
+    return self.client.version(key)
+
+  def versions(self, keys):
+    # a chunked put always writes a new manifest, so its version reflects changes of the chunks
+    return self.client.versions(keys)
+
+  def incr(self, key, delta=1, max_retries=UPDATE_MAX_RETRIES):
+    return self.client.incr(key, delta, max_retries)
+
+  def exists(self, key):
+    self.client.exists(key)
+
+  def delete(self, key, version=None):
+    marked, old_manifest = self._old_manifest(key)
+    self.client.delete(key, version)
+    if marked:
+      self._drop_chunked(key, old_manifest)
+
+  def _batches(self, keys):
+    keys = iter(keys)
+    while True:
+      batch = [key for i, key in zip(xrange(1024), keys)]
+      if not batch:
+        return
+      yield batch
+
+  def _manifests(self, keys):
+    """dict key -> manifest (None if it doesn't hold a chunked value) of the marked keys"""
+    marked = []
+    def check(client, key):
+      try:
+        return self._marked(client, key)
+      except CacheClientError:
+        return False # reported by the bulk operation
+    def collect(key, is_marked):
+      if is_marked:
+        marked.append(key)
+    self._parallel(keys, check, collect)
+    manifests = dict((key, None) for key in marked)
+    for key, value, error in self.client.get_many(marked):
+      if error == None:
+        manifests[key] = self._parse_manifest(value)
+    return manifests
+
+  def _touch_chunks(self, key, manifest, lifespan, max_idle):
+    token, total, chunk_size, count = manifest
+    def touch_chunk(client, idx):
+      client.touch(self._chunk_key(key, token, idx), lifespan, max_idle)
+    self._parallel(xrange(count), touch_chunk, lambda idx, result: None)
+    try:
+      self.client.touch(self._marker_key(key), lifespan, None)
+    except NotFoundError:
+      pass
+
+  def touch(self, key, lifespan=None, max_idle=None):
+    # chunks have to live at least as long as their manifest
+    marked, manifest = self._old_manifest(key)
+    if manifest != None:
+      self._touch_chunks(key, manifest, lifespan, max_idle)
+    self.client.touch(key, lifespan, max_idle)
+
+  def touch_many(self, keys, lifespan=None, max_idle=None):
+    for batch in self._batches(keys):
+      results = {}
+      for key, manifest in self._manifests(batch).iteritems():
+        if manifest == None:
+          continue
+        try:
+          self._touch_chunks(key, manifest, lifespan, max_idle)
+        except CacheClientError as e:
+          results[key] = (None, e) # the manifest isn't touched, it would outlive its chunks
+      touched = [key for key in batch if not key in results]
+      for key, result, error in self.client.touch_many(touched, lifespan, max_idle):
+        results[key] = (result, error)
+      for key in batch:
+        yield (key,) + results[key]
+
+  def delete_many(self, keys):
+    for batch in self._batches(keys):
+      manifests = self._manifests(batch)
+      for key, result, error in self.client.delete_many(batch):
+        if error == None and key in manifests:
+          self._drop_chunked(key, manifests[key])
+        yield key, result, error
+
+  def clear(self):
+    self.client.clear()
+
+  def size(self, key):
+    size = self.client.size(key)
+    if size > CHUNK_MANIFEST_MAX_LEN:
+      return size
+    manifest = self._parse_manifest(self.client.get(key))
+    return size if manifest == None else manifest[1]
+
+  def keys(self):
+    return [key for key in self.client.keys() if key.find(".__chunk.") == -1]
+
+  def close(self):
+    self.client.close()
+    if self.worker_clients != None:
+      for client in self.worker_clients:
+        client.close()
+      self.worker_clients = None
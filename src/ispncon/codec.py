@@ -4,13 +4,20 @@
 """
 Codecs
 """
+import json
 import struct
         
 CODEC_NONE = "None"
 CODEC_RIVER_STRING = "RiverString"
 CODEC_RIVER_BYTE_ARRAY = "RiverByteArray"
+CODEC_RIVER_INT = "RiverInt"
+CODEC_RIVER_LONG = "RiverLong"
+CODEC_RIVER_BOOLEAN = "RiverBoolean"
+CODEC_RIVER_LIST = "RiverList"
+CODEC_RIVER_MAP = "RiverMap"
 
-KNOWN_CODECS = [ CODEC_NONE, CODEC_RIVER_STRING, CODEC_RIVER_BYTE_ARRAY ]
+KNOWN_CODECS = [ CODEC_NONE, CODEC_RIVER_STRING, CODEC_RIVER_BYTE_ARRAY, CODEC_RIVER_INT, CODEC_RIVER_LONG,
+                 CODEC_RIVER_BOOLEAN, CODEC_RIVER_LIST, CODEC_RIVER_MAP ]
         
 RIVER_VERSION = 0x03
 RIVER_ID_STR_EMPTY =  0x3d
@@ -34,6 +41,16 @@ def fromString(codecSpec):
     return RiverStringCodec()
   elif codecSpec == CODEC_RIVER_BYTE_ARRAY:
     return RiverByteArrayCodec()
+  elif codecSpec == CODEC_RIVER_INT:
+    return RiverIntCodec()
+  elif codecSpec == CODEC_RIVER_LONG:
+    return RiverLongCodec()
+  elif codecSpec == CODEC_RIVER_BOOLEAN:
+    return RiverBooleanCodec()
+  elif codecSpec == CODEC_RIVER_LIST:
+    return RiverListCodec()
+  elif codecSpec == CODEC_RIVER_MAP:
+    return RiverMapCodec()
   else:
     raise CodecError("unknown codec")
 
@@ -127,3 +144,425 @@ class RiverByteArrayCodec:
       return unicode(bytes[7:strlen+7], "utf-8").decode("utf-8")
     else:
       raise CodecError("Invalid RiverByteArray value")
+
+# java.lang wrappers and collections, as marshalled by RiverMarshaller
+RIVER_ID_NULL                  = 0x01
+RIVER_ID_REPEAT_OBJECT_FAR     = 0x06
+RIVER_ID_REPEAT_OBJECT_NEAR    = 0x07
+RIVER_ID_REPEAT_OBJECT_NEARISH = 0x08
+
+RIVER_ID_BYTE_OBJECT           = 0x45
+RIVER_ID_BOOLEAN_OBJECT_TRUE   = 0x46
+RIVER_ID_BOOLEAN_OBJECT_FALSE  = 0x47
+RIVER_ID_CHARACTER_OBJECT      = 0x48
+RIVER_ID_DOUBLE_OBJECT         = 0x49
+RIVER_ID_FLOAT_OBJECT          = 0x4a
+RIVER_ID_INTEGER_OBJECT        = 0x4b
+RIVER_ID_LONG_OBJECT           = 0x4c
+RIVER_ID_SHORT_OBJECT          = 0x4d
+
+RIVER_ID_COLLECTION_EMPTY      = 0x58
+RIVER_ID_COLLECTION_SMALL      = 0x59
+RIVER_ID_COLLECTION_MEDIUM     = 0x5a
+RIVER_ID_COLLECTION_LARGE      = 0x5b
+
+RIVER_ID_CC_ARRAY_LIST         = 0x60
+RIVER_ID_CC_LINKED_LIST        = 0x61
+RIVER_ID_CC_HASH_SET           = 0x62
+RIVER_ID_CC_LINKED_HASH_SET    = 0x63
+RIVER_ID_CC_TREE_SET           = 0x64
+RIVER_ID_CC_IDENTITY_HASH_MAP  = 0x65
+RIVER_ID_CC_HASH_MAP           = 0x66
+RIVER_ID_CC_HASHTABLE          = 0x67
+RIVER_ID_CC_LINKED_HASH_MAP    = 0x68
+RIVER_ID_CC_TREE_MAP           = 0x69
+
+RIVER_LIST_TYPES = [ RIVER_ID_CC_ARRAY_LIST, RIVER_ID_CC_LINKED_LIST, RIVER_ID_CC_HASH_SET, RIVER_ID_CC_LINKED_HASH_SET, RIVER_ID_CC_TREE_SET ]
+RIVER_MAP_TYPES = [ RIVER_ID_CC_IDENTITY_HASH_MAP, RIVER_ID_CC_HASH_MAP, RIVER_ID_CC_HASHTABLE, RIVER_ID_CC_LINKED_HASH_MAP, RIVER_ID_CC_TREE_MAP ]
+RIVER_SORTED_TYPES = [ RIVER_ID_CC_TREE_SET, RIVER_ID_CC_TREE_MAP ]
+
+JAVA_INT_MIN = -0x80000000
+JAVA_INT_MAX = 0x7fffffff
+JAVA_LONG_MIN = -0x8000000000000000
+JAVA_LONG_MAX = 0x7fffffffffffffff
+
+# precompiled formats, ID = one byte type id
+_ID = struct.Struct(">B")
+_ID_BYTE = struct.Struct(">BB")
+_ID_USHORT = struct.Struct(">BH")
+_ID_SHORT = struct.Struct(">Bh")
+_ID_INT = struct.Struct(">Bi")
+_ID_LONG = struct.Struct(">Bq")
+_ID_FLOAT = struct.Struct(">Bf")
+_ID_DOUBLE = struct.Struct(">Bd")
+_ID_BYTE_ID = struct.Struct(">BBB")
+_ID_USHORT_ID = struct.Struct(">BHB")
+_ID_INT_ID = struct.Struct(">BiB")
+_BYTE = struct.Struct(">b")
+_UBYTE = struct.Struct(">B")
+_SHORT = struct.Struct(">h")
+_USHORT = struct.Struct(">H")
+_INT = struct.Struct(">i")
+_LONG = struct.Struct(">q")
+_FLOAT = struct.Struct(">f")
+_DOUBLE = struct.Struct(">d")
+_VERSION_ID = struct.Struct(">BB")
+_VERSION_ID_INT = struct.Struct(">BBi")
+_VERSION_ID_LONG = struct.Struct(">BBq")
+
+def _size_header(id_small, size):
+  """returns (id, encoded size) of the small/medium/large size header, 0 stands for 0x100 or 0x10000"""
+  if size <= 0x100:
+    return id_small, size & 0xff
+  elif size <= 0x10000:
+    return id_small + 1, size & 0xffff
+  else:
+    return id_small + 2, size
+
+class _RiverWriter(object):
+  """Encodes python values into River object stream. The first pass computes the exact size (and encodes
+     the strings to utf-8), the second one packs everything into a single preallocated buffer."""
+
+  def __init__(self):
+    self.strings = []
+
+  def size(self, obj):
+    if obj is None or obj is True or obj is False:
+      return 1
+    elif isinstance(obj, (int, long)):
+      if JAVA_INT_MIN <= obj <= JAVA_INT_MAX:
+        return 5
+      elif JAVA_LONG_MIN <= obj <= JAVA_LONG_MAX:
+        return 9
+      raise CodecError("Integer %s out of java long range" % obj)
+    elif isinstance(obj, float):
+      return 9
+    elif isinstance(obj, basestring):
+      if isinstance(obj, unicode):
+        obj = obj.encode("utf-8")
+      self.strings.append(obj)
+      strlen = len(obj)
+      if strlen == 0:
+        return 1
+      return (3 if strlen <= 0x100 else 4 if strlen <= 0x10000 else 6) + strlen
+    elif isinstance(obj, bytearray):
+      if len(obj) == 0:
+        return 2
+      return (4 if len(obj) <= 0x100 else 5 if len(obj) <= 0x10000 else 7) + len(obj)
+    elif isinstance(obj, (list, tuple)):
+      total = 2 if len(obj) == 0 else 3 if len(obj) <= 0x100 else 4 if len(obj) <= 0x10000 else 6
+      for item in obj:
+        total += self.size(item)
+      return total
+    elif isinstance(obj, dict):
+      total = 2 if len(obj) == 0 else 3 if len(obj) <= 0x100 else 4 if len(obj) <= 0x10000 else 6
+      for key, value in obj.iteritems():
+        total += self.size(key) + self.size(value)
+      return total
+    raise CodecError("Can't marshall values of type %s" % type(obj).__name__)
+
+  def _write_collection_header(self, buf, pos, size, cc_type):
+    if size == 0:
+      _ID_BYTE.pack_into(buf, pos, RIVER_ID_COLLECTION_EMPTY, cc_type)
+      return pos + 2
+    id, encoded_size = _size_header(RIVER_ID_COLLECTION_SMALL, size)
+    if id == RIVER_ID_COLLECTION_SMALL:
+      _ID_BYTE_ID.pack_into(buf, pos, id, encoded_size, cc_type)
+      return pos + 3
+    elif id == RIVER_ID_COLLECTION_MEDIUM:
+      _ID_USHORT_ID.pack_into(buf, pos, id, encoded_size, cc_type)
+      return pos + 4
+    _ID_INT_ID.pack_into(buf, pos, id, encoded_size, cc_type)
+    return pos + 6
+
+  def write(self, buf, pos, obj):
+    """writes obj at position pos of buf, returns position after it. strings are taken in the order of size()"""
+    if obj is None:
+      _ID.pack_into(buf, pos, RIVER_ID_NULL)
+      return pos + 1
+    elif obj is True:
+      _ID.pack_into(buf, pos, RIVER_ID_BOOLEAN_OBJECT_TRUE)
+      return pos + 1
+    elif obj is False:
+      _ID.pack_into(buf, pos, RIVER_ID_BOOLEAN_OBJECT_FALSE)
+      return pos + 1
+    elif isinstance(obj, (int, long)):
+      if JAVA_INT_MIN <= obj <= JAVA_INT_MAX:
+        _ID_INT.pack_into(buf, pos, RIVER_ID_INTEGER_OBJECT, obj)
+        return pos + 5
+      _ID_LONG.pack_into(buf, pos, RIVER_ID_LONG_OBJECT, obj)
+      return pos + 9
+    elif isinstance(obj, float):
+      _ID_DOUBLE.pack_into(buf, pos, RIVER_ID_DOUBLE_OBJECT, obj)
+      return pos + 9
+    elif isinstance(obj, basestring):
+      utfstr = self.strings.pop()
+      strlen = len(utfstr)
+      if strlen == 0:
+        _ID.pack_into(buf, pos, RIVER_ID_STR_EMPTY)
+        return pos + 1
+      id, encoded_len = _size_header(RIVER_ID_STR_SMALL, strlen)
+      if id == RIVER_ID_STR_SMALL:
+        _ID_BYTE.pack_into(buf, pos, id, encoded_len)
+        pos += 2
+      elif id == RIVER_ID_STR_MEDIUM:
+        _ID_USHORT.pack_into(buf, pos, id, encoded_len)
+        pos += 3
+      else:
+        _ID_INT.pack_into(buf, pos, id, encoded_len)
+        pos += 5
+      buf[pos:pos + strlen] = utfstr
+      return pos + strlen
+    elif isinstance(obj, bytearray):
+      arrlen = len(obj)
+      if arrlen == 0:
+        _ID_BYTE.pack_into(buf, pos, RIVER_ID_ARRAY_EMPTY, RIVER_ID_PRIM_BYTE)
+        return pos + 2
+      id, encoded_len = _size_header(RIVER_ID_ARRAY_SMALL, arrlen)
+      if id == RIVER_ID_ARRAY_SMALL:
+        _ID_BYTE_ID.pack_into(buf, pos, id, encoded_len, RIVER_ID_PRIM_BYTE)
+        pos += 3
+      elif id == RIVER_ID_ARRAY_MEDIUM:
+        _ID_USHORT_ID.pack_into(buf, pos, id, encoded_len, RIVER_ID_PRIM_BYTE)
+        pos += 4
+      else:
+        _ID_INT_ID.pack_into(buf, pos, id, encoded_len, RIVER_ID_PRIM_BYTE)
+        pos += 6
+      buf[pos:pos + arrlen] = obj
+      return pos + arrlen
+    elif isinstance(obj, (list, tuple)):
+      pos = self._write_collection_header(buf, pos, len(obj), RIVER_ID_CC_ARRAY_LIST)
+      for item in obj:
+        pos = self.write(buf, pos, item)
+      return pos
+    else:
+      pos = self._write_collection_header(buf, pos, len(obj), RIVER_ID_CC_HASH_MAP)
+      for key, value in obj.iteritems():
+        pos = self.write(buf, pos, key)
+        pos = self.write(buf, pos, value)
+      return pos
+
+def river_encode(obj):
+  """Marshalls python value (None, bool, int, long, float, str, unicode, bytearray, list, tuple, dict) the same
+     way as RiverMarshaller would marshall the corresponding java object (ints that don't fit into java int
+     become Long, lists become ArrayList, dicts HashMap)"""
+  writer = _RiverWriter()
+  size = 1 + writer.size(obj)
+  writer.strings.reverse() # write() pops them from the end
+  buf = bytearray(size)
+  _UBYTE.pack_into(buf, 0, RIVER_VERSION)
+  writer.write(buf, 1, obj)
+  return str(buf)
+
+class _RiverReader(object):
+  def __init__(self, data):
+    self.data = data
+    self.pos = 0
+    self.instances = [] # back references of RiverMarshaller point here
+
+  def _unpack(self, fmt):
+    value = fmt.unpack_from(self.data, self.pos)[0]
+    self.pos += fmt.size
+    return value
+
+  def _read_bytes(self, length):
+    if self.pos + length > len(self.data):
+      raise CodecError("Truncated River value")
+    value = self.data[self.pos:self.pos + length]
+    self.pos += length
+    return value
+
+  def _read_size(self, id, id_small):
+    if id == id_small:
+      size = self._unpack(_UBYTE)
+      return 0x100 if size == 0 else size
+    elif id == id_small + 1:
+      size = self._unpack(_USHORT)
+      return 0x10000 if size == 0 else size
+    return self._unpack(_INT)
+
+  def read_object(self):
+    id = self._unpack(_UBYTE)
+    if id == RIVER_ID_NULL:
+      return None
+    elif id == RIVER_ID_BOOLEAN_OBJECT_TRUE:
+      return True
+    elif id == RIVER_ID_BOOLEAN_OBJECT_FALSE:
+      return False
+    elif id == RIVER_ID_INTEGER_OBJECT:
+      return self._unpack(_INT)
+    elif id == RIVER_ID_LONG_OBJECT:
+      return self._unpack(_LONG)
+    elif id == RIVER_ID_SHORT_OBJECT:
+      return self._unpack(_SHORT)
+    elif id == RIVER_ID_BYTE_OBJECT:
+      return self._unpack(_BYTE)
+    elif id == RIVER_ID_DOUBLE_OBJECT:
+      return self._unpack(_DOUBLE)
+    elif id == RIVER_ID_FLOAT_OBJECT:
+      return self._unpack(_FLOAT)
+    elif id == RIVER_ID_CHARACTER_OBJECT:
+      return unichr(self._unpack(_USHORT))
+    elif id == RIVER_ID_STR_EMPTY:
+      self.instances.append(u"")
+      return u""
+    elif RIVER_ID_STR_SMALL <= id <= RIVER_ID_STR_LARGE:
+      value = unicode(self._read_bytes(self._read_size(id, RIVER_ID_STR_SMALL)), "utf-8")
+      self.instances.append(value)
+      return value
+    elif RIVER_ID_ARRAY_EMPTY <= id <= RIVER_ID_ARRAY_LARGE:
+      size = 0 if id == RIVER_ID_ARRAY_EMPTY else self._read_size(id, RIVER_ID_ARRAY_SMALL)
+      if self._unpack(_UBYTE) != RIVER_ID_PRIM_BYTE:
+        raise CodecError("Only byte arrays are supported")
+      value = bytearray(self._read_bytes(size))
+      self.instances.append(value)
+      return value
+    elif RIVER_ID_COLLECTION_EMPTY <= id <= RIVER_ID_COLLECTION_LARGE:
+      size = 0 if id == RIVER_ID_COLLECTION_EMPTY else self._read_size(id, RIVER_ID_COLLECTION_SMALL)
+      cc_type = self._unpack(_UBYTE)
+      if cc_type in RIVER_SORTED_TYPES:
+        self.read_object() # comparator, we only keep the order
+      if cc_type in RIVER_LIST_TYPES:
+        value = []
+        self.instances.append(value)
+        for i in xrange(size):
+          value.append(self.read_object())
+      elif cc_type in RIVER_MAP_TYPES:
+        value = {}
+        self.instances.append(value)
+        for i in xrange(size):
+          key = self.read_object()
+          try:
+            value[key] = self.read_object()
+          except TypeError:
+            raise CodecError("Unsupported map key type %s" % type(key).__name__)
+      else:
+        raise CodecError("Unsupported River collection type 0x%02x" % cc_type)
+      return value
+    elif id == RIVER_ID_REPEAT_OBJECT_NEAR:
+      return self._instance(len(self.instances) + (self._unpack(_UBYTE) | -0x100))
+    elif id == RIVER_ID_REPEAT_OBJECT_NEARISH:
+      return self._instance(len(self.instances) + (self._unpack(_USHORT) | -0x10000))
+    elif id == RIVER_ID_REPEAT_OBJECT_FAR:
+      return self._instance(self._unpack(_INT))
+    raise CodecError("Unsupported River type id 0x%02x" % id)
+
+  def _instance(self, idx):
+    if idx < 0 or idx >= len(self.instances):
+      raise CodecError("Invalid River back reference")
+    return self.instances[idx]
+
+def river_decode(bytes):
+  """Unmarshalls RiverMarshaller output into python value, see river_encode"""
+  if len(bytes) < 2 or ord(bytes[0]) != RIVER_VERSION:
+    raise CodecError("Unknown river marshaller version")
+  reader = _RiverReader(bytes)
+  reader.pos = 1
+  try:
+    return reader.read_object()
+  except struct.error:
+    raise CodecError("Truncated River value")
+
+class RiverIntCodec:
+  """marshalls java.lang.Integer the same way as RiverMarshaller/RiverUnmarshaller"""
+  def encode(self, value):
+    try:
+      value = int(value)
+    except ValueError:
+      raise CodecError("RiverInt value must be an integer")
+    if not JAVA_INT_MIN <= value <= JAVA_INT_MAX:
+      raise CodecError("RiverInt value out of range")
+    return _VERSION_ID_INT.pack(RIVER_VERSION, RIVER_ID_INTEGER_OBJECT, value)
+
+  def decode(self, bytes):
+    if len(bytes) != _VERSION_ID_INT.size:
+      raise CodecError("Invalid RiverInt value")
+    version, id, value = _VERSION_ID_INT.unpack(bytes)
+    if version != RIVER_VERSION:
+      raise CodecError("Unknown river marshaller version")
+    if id != RIVER_ID_INTEGER_OBJECT:
+      raise CodecError("Invalid RiverInt value")
+    return value
+
+class RiverLongCodec:
+  """marshalls java.lang.Long the same way as RiverMarshaller/RiverUnmarshaller"""
+  def encode(self, value):
+    try:
+      value = long(value)
+    except ValueError:
+      raise CodecError("RiverLong value must be an integer")
+    if not JAVA_LONG_MIN <= value <= JAVA_LONG_MAX:
+      raise CodecError("RiverLong value out of range")
+    return _VERSION_ID_LONG.pack(RIVER_VERSION, RIVER_ID_LONG_OBJECT, value)
+
+  def decode(self, bytes):
+    if len(bytes) != _VERSION_ID_LONG.size:
+      raise CodecError("Invalid RiverLong value")
+    version, id, value = _VERSION_ID_LONG.unpack(bytes)
+    if version != RIVER_VERSION:
+      raise CodecError("Unknown river marshaller version")
+    if id != RIVER_ID_LONG_OBJECT:
+      raise CodecError("Invalid RiverLong value")
+    return value
+
+class RiverBooleanCodec:
+  """marshalls java.lang.Boolean the same way as RiverMarshaller/RiverUnmarshaller"""
+  def encode(self, value):
+    if not isinstance(value, bool):
+      if value in ("true", "True", "1"):
+        value = True
+      elif value in ("false", "False", "0"):
+        value = False
+      else:
+        raise CodecError("RiverBoolean value must be true or false")
+    return _VERSION_ID.pack(RIVER_VERSION, RIVER_ID_BOOLEAN_OBJECT_TRUE if value else RIVER_ID_BOOLEAN_OBJECT_FALSE)
+
+  def decode(self, bytes):
+    if len(bytes) != _VERSION_ID.size:
+      raise CodecError("Invalid RiverBoolean value")
+    version, id = _VERSION_ID.unpack(bytes)
+    if version != RIVER_VERSION:
+      raise CodecError("Unknown river marshaller version")
+    if id == RIVER_ID_BOOLEAN_OBJECT_TRUE:
+      return True
+    elif id == RIVER_ID_BOOLEAN_OBJECT_FALSE:
+      return False
+    raise CodecError("Invalid RiverBoolean value")
+
+class RiverListCodec:
+  """marshalls java.util.ArrayList the same way as RiverMarshaller/RiverUnmarshaller.
+     encode accepts python list or its JSON representation, decode returns python list."""
+  def encode(self, value):
+    if isinstance(value, basestring):
+      try:
+        value = json.loads(value)
+      except ValueError:
+        raise CodecError("RiverList value must be a JSON array")
+    if not isinstance(value, (list, tuple)):
+      raise CodecError("RiverList value must be a JSON array")
+    return river_encode(value)
+
+  def decode(self, bytes):
+    value = river_decode(bytes)
+    if not isinstance(value, list):
+      raise CodecError("Invalid RiverList value")
+    return value
+
+class RiverMapCodec:
+  """marshalls java.util.HashMap the same way as RiverMarshaller/RiverUnmarshaller.
+     encode accepts python dict or its JSON representation, decode returns python dict."""
+  def encode(self, value):
+    if isinstance(value, basestring):
+      try:
+        value = json.loads(value)
+      except ValueError:
+        raise CodecError("RiverMap value must be a JSON object")
+    if not isinstance(value, dict):
+      raise CodecError("RiverMap value must be a JSON object")
+    return river_encode(value)
+
+  def decode(self, bytes):
+    value = river_decode(bytes)
+    if not isinstance(value, dict):
+      raise CodecError("Invalid RiverMap value")
+    return value
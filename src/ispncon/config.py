@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Configuration of the console and the cache clients
+"""
+from ispncon import DEFAULT_CACHE_NAME
+from ispncon.codec import CODEC_NONE
+import ConfigParser
+import os
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+class ConfigError(Exception):
+  """Unknown or malformed config key"""
+  def __init__(self, msg):
+    Exception.__init__(self, msg)
+    self.msg = msg
+
+MAIN_CONFIG_SECTION = "ispncon"
+KNOWN_CONFIG_KEYS = ["client_type", "host", "port", "cache", "exit_on_error", "default_codec", "rest.server_url", "rest.content_type", "hotrod.use_river_string_keys", "hotkeys.capacity", "hotkeys.sample_rate", "bulk.workers", "chunking.threshold", "chunking.chunk_size", "rest.pipeline_window", "memcached.pipeline_window", "memcached.noreply_bulk", "hotrod.key_codec", "limit.ops_per_second", "limit.bytes_per_second", "transport.tcp_nodelay", "transport.keepalive", "transport.send_buffer", "transport.receive_buffer", "transport.connect_timeout", "transport.read_timeout", "transport.dns_cache_ttl", "buffer.max_entries", "buffer.flush_interval", "memcached.meta_commands", "rest.accept_encoding", "rest.compress_threshold", "client_cache.max_clients", "client_cache.idle_timeout", "hotrod.servers", "hotrod.pool_size", "hotrod.retry_interval", "hotrod.pipeline_window", "bloom.file", "bloom.capacity", "bloom.error_rate", "metrics.port", "metrics.host", "metrics.file", "metrics.interval"]
+
+class Config(dict):
+  def _override_with_user_config(self):
+    user_cfg_file = os.path.expanduser("~/.ispncon")
+    if not os.path.exists(user_cfg_file):
+      return
+    cfgp = ConfigParser.ConfigParser()
+    cfgp.read(user_cfg_file)
+    for key, value in cfgp.items(MAIN_CONFIG_SECTION):
+      self[key]=value
+    for section in cfgp.sections():
+      if section != MAIN_CONFIG_SECTION:
+        for key, value in cfgp.items(section):
+          self[section + "." + key] = value
+        
+  def __init__(self, *args, **kw):
+    super(Config, self).__init__(*args, **kw)
+    # set defaults
+    self["client_type"] = "hotrod"
+    self["host"] = "localhost"
+    self["port"] = "11222"
+    self["cache"] = DEFAULT_CACHE_NAME
+    self["exit_on_error"] = "False"
+    self["default_codec"] = CODEC_NONE
+    self["rest.server_url"] = "/infinispan-server-rest/rest"
+    self["rest.content_type"] = "text/plain"
+    self["rest.pipeline_window"] = "1"
+    self["rest.accept_encoding"] = "gzip, deflate"
+    self["rest.compress_threshold"] = "0"
+    self["hotrod.use_river_string_keys"] = "True"
+    self["hotrod.key_codec"] = "RiverString"
+    self["hotrod.servers"] = ""
+    self["hotrod.pool_size"] = "1"
+    self["hotrod.retry_interval"] = "10"
+    self["hotrod.pipeline_window"] = "64"
+    self["memcached.pipeline_window"] = "64"
+    self["memcached.noreply_bulk"] = "False"
+    self["memcached.meta_commands"] = "auto"
+    self["hotkeys.capacity"] = "0"
+    self["hotkeys.sample_rate"] = "1.0"
+    self["bulk.workers"] = "4"
+    self["chunking.threshold"] = "0"
+    self["chunking.chunk_size"] = "1048576"
+    self["limit.ops_per_second"] = "0"
+    self["limit.bytes_per_second"] = "0"
+    self["buffer.max_entries"] = "0"
+    self["buffer.flush_interval"] = "1.0"
+    self["client_cache.max_clients"] = "8"
+    self["client_cache.idle_timeout"] = "300"
+    self["bloom.file"] = ""
+    self["bloom.capacity"] = "1000000"
+    self["bloom.error_rate"] = "0.01"
+    self["metrics.port"] = "0"
+    self["metrics.host"] = "127.0.0.1"
+    self["metrics.file"] = ""
+    self["metrics.interval"] = "15"
+    self["transport.tcp_nodelay"] = "True"
+    self["transport.keepalive"] = "False"
+    self["transport.send_buffer"] = "0"
+    self["transport.receive_buffer"] = "0"
+    self["transport.connect_timeout"] = "0"
+    self["transport.read_timeout"] = "0"
+    self["transport.dns_cache_ttl"] = "60"
+    # override with whatever is in ~/.ispncon file
+    self._override_with_user_config()
+    
+  def __str__(self):
+    str = ""
+    for  key in KNOWN_CONFIG_KEYS:
+      str += "%s = %s\n" % (key, self[key])
+    return str
+  
+  def __setitem__(self, key, value):
+    if not key in KNOWN_CONFIG_KEYS:
+      self._error("Unknown config key: %s" % key)
+    super(Config, self).__setitem__(key, value)
+
+  def _error(self, msg):
+    raise ConfigError(msg)
+  
+  def _parse_section_key(self, section_key):
+    v = section_key.split(".")
+    if len(v) == 1:
+      return "ispncon", v[0]
+    elif len(v) == 2:
+      return v[0], v[1]
+    else:
+      self._error("Invalid key format. Must be <section>.<key>")
+
+  def save(self):
+    f = open(os.path.expanduser("~/.ispncon"), "w")
+    cfgp = ConfigParser.ConfigParser()
+
+    for section_key in self.iterkeys():
+      section, key = self._parse_section_key(section_key)
+      if not cfgp.has_section(section):
+        cfgp.add_section(section)
+      cfgp.set(section, key, self[section_key])
+
+    cfgp.write(f)
@@ -6,143 +6,150 @@ Command parsing and execution
 """
 from ispncon import ISPNCON_VERSION, HELP, USAGE, DEFAULT_CACHE_NAME,\
   TRUE_STR_VALUES
+from ispncon.api import Session, ERROR, REMOVED
 from ispncon.client import CacheClientError, ConflictError, NotFoundError
-from ispncon.codec import CODEC_NONE, CodecError
-import ConfigParser
+from ispncon.codec import CodecError
+from ispncon.config import Config, ConfigError, KNOWN_CONFIG_KEYS
+from ispncon.script import ParsedArgs, ScriptCache, compile_line, parse_args
+from ispncon.shard import ShardedRunner
+from ispncon.timing import PhaseProfiler, ProfiledOutput, NO_PHASE, PHASE_PARSE
+import cProfile
 import getopt
+import json
 import ispncon
 import os
-import shlex
+import subprocess
 import sys
+import time
 
 __author__ = "Michal Linhard"
 __copyright__ = "(C) 2011 Red Hat Inc."
 
-MAIN_CONFIG_SECTION = "ispncon"
-KNOWN_CONFIG_KEYS = ["client_type", "host", "port", "cache", "exit_on_error", "default_codec", "rest.server_url", "rest.content_type", "hotrod.use_river_string_keys"]
-
-class Config(dict):
-  def _override_with_user_config(self):
-    user_cfg_file = os.path.expanduser("~/.ispncon")
-    if not os.path.exists(user_cfg_file):
-      return
-    cfgp = ConfigParser.ConfigParser()
-    cfgp.read(user_cfg_file)
-    for key, value in cfgp.items(MAIN_CONFIG_SECTION):
-      self[key]=value
-    for section in cfgp.sections():
-      if section != MAIN_CONFIG_SECTION:
-        for key, value in cfgp.items(section):
-          self[section + "." + key] = value
-        
-  def __init__(self, *args, **kw):
-    super(Config, self).__init__(*args, **kw)
-    # set defaults
-    self["client_type"] = "hotrod"
-    self["host"] = "localhost"
-    self["port"] = "11222"
-    self["cache"] = DEFAULT_CACHE_NAME
-    self["exit_on_error"] = "False"
-    self["default_codec"] = CODEC_NONE
-    self["rest.server_url"] = "/infinispan-server-rest/rest"
-    self["rest.content_type"] = "text/plain"
-    self["hotrod.use_river_string_keys"] = "True"
-    # override with whatever is in ~/.ispncon file
-    self._override_with_user_config()
-    
-  def __str__(self):
-    str = ""
-    for  key in KNOWN_CONFIG_KEYS:
-      str += "%s = %s\n" % (key, self[key])
-    return str
-  
-  def __setitem__(self, key, value):
-    if not key in KNOWN_CONFIG_KEYS:
-      self._error("Unknown config key: %s" % key)
-    super(Config, self).__setitem__(key, value)
-
-  def _error(self, msg):
-    raise CommandExecutionError(msg)
-  
-  def _parse_section_key(self, section_key):
-    v = section_key.split(".")
-    if len(v) == 1:
-      return "ispncon", v[0]
-    elif len(v) == 2:
-      return v[0], v[1]
-    else:
-      self._error("Invalid key format. Must be <section>.<key>")
-
-  def save(self):
-    f = open(os.path.expanduser("~/.ispncon"), "w")
-    cfgp = ConfigParser.ConfigParser()
-
-    for section_key in self.iterkeys():
-      section, key = self._parse_section_key(section_key)
-      if not cfgp.has_section(section):
-        cfgp.add_section(section)
-      cfgp.set(section, key, self[section_key])
-
-    cfgp.write(f)
-
 class CommandExecutionError(Exception):
   def __init__(self, msg, exit_code=1):
     self.msg = msg
     self.exit_code = exit_code
 
 class CommandExecutor:
-  def __init__(self, config):
+  """Executes console commands on a Session and prints the results"""
+  def __init__(self, config, profiler=None):
     self.config = config
+    self.profiler = profiler
     self.exit_on_error = (self.config["exit_on_error"] in TRUE_STR_VALUES)
-    self.default_codec = ispncon.codec.fromString(self.config["default_codec"])
-    self.client = None
-    
-  # get the client lazily
-  def _get_client(self):
-    if self.client == None:
-      try:
-        self.client = ispncon.client.fromString(self.config)
-      except CacheClientError as e:
-        raise e
-      except Exception as e:
-        self._error("creating client: %s" % str(e.args))
-    return self.client
-      
-  def _optionally_encode(self, codec, value):
-    if (codec == None):
-      if (self.default_codec == None):
-        return value
-      else:
-        return self.default_codec.encode(value)
-    else:
-      currentCodec = ispncon.codec.fromString(codec)
-      if currentCodec == None:
-        return value
-      else:
-        return currentCodec.encode(value)
+    self.session = Session(config, profiler)
+    self.scripts = ScriptCache()
 
-  def _optionally_decode(self, codec, value):
-    if (codec == None):
-      if (self.default_codec == None):
-        return value
-      else:
-        return self.default_codec.decode(value)
-    else:
-      currentCodec = ispncon.codec.fromString(codec)
-      if currentCodec == None:
-        return value
+  def close(self):
+    """writes out buffered puts and closes the client"""
+    self._print_errors(self.session.close()[1])
+
+  def _print_errors(self, errors):
+    for key, error in errors:
+      print "ERROR %s %s" % (key, error.msg)
+
+  def _phase(self, name):
+    if self.profiler == None:
+      return NO_PHASE
+    return self.profiler.phase(name)
+
+  def _getopt(self, args):
+    """options and arguments of a command listed in OPTION_SPECS, parsed by execute_cmd"""
+    if args.error != None:
+      raise args.error
+    return args.opts, args.args
+
+  def _read_key_file(self, keyfile):
+    f = None
+    try:
+      if keyfile == "-":
+        f = sys.stdin
       else:
-        return currentCodec.decode(value)
+        f = open(keyfile, "r")
+      for line in f:
+        key = line.strip()
+        if key != "":
+          yield key
+    except IOError:
+      self._error("while reading file %s" % keyfile)
+    finally:
+      if f != None and f != sys.stdin:
+        f.close()
+
+  def _key_source(self, keyfile, keys):
+    """keys given on the command line, read from keyfile ("-" means stdin) or None for all the keys in the cache"""
+    if keyfile != None:
+      if (len(keys) > 0):
+        self._error("You cannot supply both keys and key file.")
+      return self._read_key_file(keyfile)
+    if (len(keys) > 0):
+      return keys
+    return None
+
+  def _format_value(self, value):
+    """text form of decoded value, collections are formatted as JSON"""
+    if isinstance(value, bool):
+      return "true" if value else "false"
+    elif isinstance(value, (int, long, float)):
+      return str(value)
+    elif isinstance(value, (list, dict)):
+      return json.dumps(value, default=self._json_default)
+    return value
+
+  def _json_default(self, obj):
+    if isinstance(obj, bytearray):
+      return list(obj)
+    raise TypeError("%s is not JSON serializable" % type(obj).__name__)
 
   def _cmd_include(self, args):
-    if (len(args) != 1):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
       self._error("Wrong include command syntax.")
-      
-    f = open(args[0], 'r')
-    for line in f:
-        self.execute(line)
-    f.close()
+    if (len(args1) != 1):
+      self._error("Wrong include command syntax.")
+    print_stats = False
+    jobs = 1
+    for opt, arg in opts1:
+        if opt in ("-s", "--stats"):
+            print_stats = True
+        if opt in ("-j", "--jobs"):
+            try:
+              jobs = int(arg)
+            except ValueError:
+              self._error("Number of jobs must be an integer.")
+    if jobs < 1:
+      self._error("Number of jobs must be positive.")
+    start = time.time()
+    try:
+      with self._phase(PHASE_PARSE):
+        operations, lines = self.scripts.compile(args1[0])
+    except (IOError, OSError):
+      self._error("while reading file %s" % args1[0])
+    parsed = time.time()
+    if jobs > 1:
+      self._include_sharded(operations, jobs)
+    else:
+      for op in operations:
+        self.execute_op(op)
+    if print_stats:
+      end = time.time()
+      if lines > 0:
+        print >> sys.stderr, "PARSE %d lines %.3f s %.0f lines/s" % (lines, parsed - start, lines / max(parsed - start, 1e-6))
+      else:
+        print >> sys.stderr, "PARSE cached"
+      print >> sys.stderr, "EXECUTE %d operations %.3f s %.0f lines/s" % (len(operations), end - parsed, len(operations) / max(end - parsed, 1e-6))
   
+  def _include_sharded(self, operations, jobs):
+    """executes the operations in jobs worker processes, operations are sharded by key"""
+    self._print_errors(self.session.flush()[1]) # the workers have to see the buffered puts
+    runner = ShardedRunner(self.config, jobs)
+    try:
+      exit_code = runner.run(operations, self.exit_on_error)
+    finally:
+      runner.close()
+    if exit_code != 0:
+      self._possiblyexit(exit_code)
+
   def _cmd_put(self, args):
     """options:
   -i <filename> don't specify inline string value, instead put the whole contents of the specified file
@@ -153,7 +160,7 @@ class CommandExecutor:
      and doesn't put anything in that case"""
         
     try:
-      opts1, args1 = getopt.getopt(args, "i:v:l:I:ae:", ["input-filename=", "version=", "lifespan=", "max-idle=", "put-if-absent", "encode="])
+      opts1, args1 = self._getopt(args)
     except getopt.GetoptError:          
       self._error("Wrong put command syntax.")
     filename = None
@@ -198,17 +205,12 @@ class CommandExecutor:
       finally:
         if (f != None):
           f.close()
-    try:
-      encoded_value = self._optionally_encode(codec, value)
-    except CodecError as e:
-      self._error(e.args[0]);
-    self._get_client().put(args1[0], encoded_value, version, lifespan, maxidle, put_if_absent)
+    self.session.put(args1[0], value, version, lifespan, maxidle, put_if_absent, codec)
     print "STORED"
       
   def _cmd_get(self, args):
-    _client = self._get_client()
     try:
-      opts1, args1 = getopt.getopt(args, "o:vd:", ["output-filename=", "version", "decode="])
+      opts1, args1 = self._getopt(args)
     except getopt.GetoptError:          
       self._error("Wrong get command syntax.")
     output_filename = None
@@ -223,18 +225,14 @@ class CommandExecutor:
             get_version = True
         if opt in ("-d", "--decode"):
             codec = arg
-    version = None
-    value = None
+    if output_filename != None and self.session.codec(codec) == None:
+      self._get_to_file(args1[0], output_filename, get_version)
+      return
+    value = self.session.get(args1[0], get_version, codec)
     if get_version:
-      version, value = _client.get(args1[0], True)
-      print "VERSION %s" % version
-    else:
-      value = _client.get(args1[0], False)
-
-    try:
-      decoded_value = self._optionally_decode(codec, value)
-    except CodecError as e:
-      self._error(e.args[0]);
+      print "VERSION %s" % value.version
+      value = value.value
+    decoded_value = self._format_value(value)
     if output_filename == None:
       print decoded_value
     else:
@@ -245,16 +243,33 @@ class CommandExecutor:
       except IOError:
         self._error("writing file %s" % output_filename)
 
+  def _get_to_file(self, key, output_filename, get_version):
+    """streams undecoded value into the file, chunked values are never held in memory as a whole"""
+    try:
+      outfile = open(output_filename, "wb")
+    except IOError:
+      self._error("writing file %s" % output_filename)
+    try:
+      result = self.session.get_into(key, outfile, get_version)
+      if get_version:
+        print "VERSION %s" % result.version
+    except IOError:
+      outfile.close()
+      self._error("writing file %s" % output_filename)
+    except CacheClientError:
+      outfile.close()
+      os.remove(output_filename)
+      raise
+    outfile.close()
+
   def _cmd_version(self, args):
-    _client = self._get_client()
     if (len(args) != 1):
       self._error("You must supply key.")
-    print _client.version(args[0])
+    print self.session.version(args[0])
 
   def _cmd_delete(self, args):
-    _client = self._get_client()
     try:
-      opts1, args1 = getopt.getopt(args, "v:", ["version="])
+      opts1, args1 = self._getopt(args)
     except getopt.GetoptError:          
       self._error("Wrong delete command syntax.")
     version = None
@@ -265,10 +280,80 @@ class CommandExecutor:
             version = arg
     if (len(args1) != 1):
       self._error("You must supply key.")
-    _client.delete(args1[0], version)
+    self.session.delete(args1[0], version)
     print "DELETED"
+
+  def _cmd_mdelete(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong mdelete command syntax.")
+    keyfile = None
+    prefix = None
+    for opt, arg in opts1:
+        if opt in ("-f", "--key-file"):
+            keyfile = arg
+        if opt in ("-p", "--prefix"):
+            prefix = arg
+    keys = self._key_source(keyfile, args1)
+    if keys == None:
+      if prefix == None:
+        self._error("You must supply keys, key file or prefix.")
+      keys = self.session.keys()
+    if prefix != None:
+      keys = (key for key in keys if key.startswith(prefix))
+    deleted = not_found = errors = 0
+    for key, value, error in self.session.delete_many(keys):
+      if error == None:
+        deleted += 1
+      elif isinstance(error, NotFoundError):
+        not_found += 1
+      else:
+        errors += 1
+        print "ERROR %s %s" % (key, error.msg)
+    print "DELETED %d" % deleted
+    print "NOT_FOUND %d" % not_found
+    print "ERRORS %d" % errors
+    if errors > 0:
+      self._possiblyexit(1)
     
 
+  def _cmd_touch(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong touch command syntax.")
+    keyfile = None
+    lifespan = None
+    max_idle = None
+    workers = None
+    for opt, arg in opts1:
+        if opt in ("-f", "--key-file"):
+            keyfile = arg
+        if opt in ("-l", "--lifespan"):
+            try:
+              lifespan = int(arg)
+            except ValueError:
+              self._error("Converting lifespan. must be an integer.")
+        if opt in ("-I", "--max-idle"):
+            try:
+              max_idle = int(arg)
+            except ValueError:
+              self._error("Converting max idle. must be an integer.")
+        if opt in ("-w", "--workers"):
+            workers = arg
+    keys = self._key_source(keyfile, args1)
+    if keys == None:
+      self._error("You must supply keys or key file.")
+    stats = self.session.touch_many(keys, lifespan, max_idle, workers)
+    for key, error in stats.errors:
+      print "ERROR %s %s" % (key, error.msg)
+    print "TOUCHED %d" % stats.touched
+    print "NOT_FOUND %d" % stats.not_found
+    print "ERRORS %d" % len(stats.errors)
+    if stats.errors:
+      self._possiblyexit(1)
+
   def _cmd_help(self, args):
     if (len(args) == 0):
       print "Supported operatiotype: <class 'ispncon.console.Config'>ns: \n", "\n".join(sorted(["%s\t\t%s" % (x, HELP[x].split("\n")[0]) for x in HELP.keys()]))
@@ -281,18 +366,220 @@ class CommandExecutor:
   def _cmd_clear(self, args):
     if (len(args) != 0):
       self._error("Clear command doesn't have any arguments.")
-    self._get_client().clear()
+    self.session.clear()
     print "DELETED"
 
   def _cmd_exists(self, args):
-    _client = self._get_client()
     if (len(args) < 1):
       self._error("You must supply key.")
     if (len(args) > 1):
       self._error("Wrong exists command syntax.")
-    _client.exists(args[0])
+    if not self.session.exists(args[0]):
+      raise NotFoundError
     print "EXISTS"
 
+  def _max_retries(self, opts):
+    max_retries = ispncon.client.UPDATE_MAX_RETRIES
+    for opt, arg in opts:
+        if opt in ("-r", "--retries"):
+            try:
+              max_retries = int(arg)
+            except ValueError:
+              self._error("Number of retries must be an integer.")
+    return max_retries
+
+  def _cmd_incr(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong incr command syntax.")
+    if (len(args1) < 1 or len(args1) > 2):
+      self._error("You must supply key and optionally delta.")
+    max_retries = self._max_retries(opts1)
+    delta = 1
+    if (len(args1) == 2):
+      try:
+        delta = int(args1[1])
+      except ValueError:
+        self._error("Delta must be an integer.")
+    print self.session.incr(args1[0], delta, max_retries)
+
+  def _cmd_update(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong update command syntax.")
+    if (len(args1) != 2):
+      self._error("You must supply key and filter command.")
+    max_retries = self._max_retries(opts1)
+    def transform(value):
+      proc = subprocess.Popen(args1[1], shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+      new_value = proc.communicate(value)[0]
+      if proc.returncode != 0:
+        self._error("Filter command failed with exit code %s." % proc.returncode)
+      return new_value
+    self.session.update(args1[0], transform, max_retries)
+    print "STORED"
+
+  def _cmd_bloom(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong bloom command syntax.")
+    keyfile = None
+    capacity = None
+    error_rate = None
+    info = False
+    for opt, arg in opts1:
+        if opt in ("-f", "--key-file"):
+            keyfile = arg
+        if opt in ("-n", "--capacity"):
+            capacity = arg
+        if opt in ("-e", "--error-rate"):
+            error_rate = arg
+        if opt in ("-i", "--info"):
+            info = True
+    if info:
+      if keyfile != None or capacity != None or error_rate != None or len(args1) > 0:
+        self._error("Wrong bloom command syntax.")
+      info = self.session.bloom_info()
+    else:
+      info = self.session.build_bloom(self._key_source(keyfile, args1), capacity, error_rate)
+    print "KEYS %d" % info.keys
+    print "BITS %d" % info.bits
+    print "HASHES %d" % info.hashes
+    print "FILL %.4f" % info.fill
+    print "ERROR_RATE %.6f" % info.error_rate
+    print "SKIPPED %d" % info.skipped
+
+  def _cmd_hotkeys(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong hotkeys command syntax.")
+    if (len(args1) > 1):
+      self._error("Wrong hotkeys command syntax.")
+    reset = False
+    for opt, arg in opts1:
+        if opt in ("-r", "--reset"):
+            reset = True
+    count = 10
+    if (len(args1) == 1):
+      try:
+        count = int(args1[0])
+      except ValueError:
+        self._error("Number of keys must be an integer.")
+    for key, hits, error, nbytes in self.session.hotkeys(count, reset):
+      print "%s %s %s %s" % (key, hits, error, nbytes)
+
+  def _cmd_sizes(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong sizes command syntax.")
+    keyfile = None
+    workers = None
+    for opt, arg in opts1:
+        if opt in ("-f", "--key-file"):
+            keyfile = arg
+        if opt in ("-w", "--workers"):
+            workers = arg
+    stats = self.session.sizes(self._key_source(keyfile, args1), workers)
+    histogram = stats.histogram
+    print "COUNT %d" % histogram.count
+    print "TOTAL %d" % histogram.total
+    print "MIN %s" % (histogram.min if histogram.min != None else 0)
+    print "MAX %s" % (histogram.max if histogram.max != None else 0)
+    print "MEAN %.1f" % histogram.mean()
+    print "NOT_FOUND %d" % stats.not_found
+    print "ERRORS %d" % stats.errors
+    for lower, upper, count in histogram.ranges():
+      print "%d-%d %d" % (lower, upper - 1, count)
+
+  def _cmd_checksum(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong checksum command syntax.")
+    keyfile = None
+    workers = None
+    buckets = 0
+    only_bucket = None
+    for opt, arg in opts1:
+        if opt in ("-f", "--key-file"):
+            keyfile = arg
+        if opt in ("-w", "--workers"):
+            workers = arg
+        if opt in ("-b", "--buckets"):
+            try:
+              buckets = int(arg)
+            except ValueError:
+              self._error("Number of buckets must be an integer.")
+        if opt in ("-B", "--bucket"):
+            try:
+              only_bucket = int(arg)
+            except ValueError:
+              self._error("Bucket must be an integer.")
+    result = self.session.checksum(self._key_source(keyfile, args1), workers, buckets, only_bucket)
+    digest = result.digest
+    print "COUNT %d" % digest.count
+    print "DIGEST %016x" % digest.digest
+    print "NOT_FOUND %d" % result.not_found
+    print "ERRORS %d" % result.errors
+    if only_bucket != None:
+      for key, ehash in result.entries:
+        print "ENTRY %s %016x" % (key, ehash)
+    else:
+      for idx, (count, bucket_digest) in enumerate(digest.buckets):
+        print "BUCKET %d %d %016x" % (idx, count, bucket_digest)
+
+  def _cmd_watch(self, args):
+    try:
+      opts1, args1 = self._getopt(args)
+    except getopt.GetoptError:
+      self._error("Wrong watch command syntax.")
+    keyfile = None
+    interval = 0.5
+    max_interval = 30.0
+    count = None
+    timeout = None
+    try:
+      for opt, arg in opts1:
+          if opt in ("-f", "--key-file"):
+              keyfile = arg
+          if opt in ("-i", "--interval"):
+              interval = float(arg)
+          if opt in ("-m", "--max-interval"):
+              max_interval = float(arg)
+          if opt in ("-n", "--count"):
+              count = int(arg)
+          if opt in ("-t", "--timeout"):
+              timeout = float(arg)
+    except ValueError:
+      self._error("Intervals and timeout must be numbers of seconds, count an integer.")
+    if keyfile == None and len(args1) == 0:
+      self._error("You must supply keys or key file.")
+    try:
+      for kind, key, version, error in self.session.watch(self._key_source(keyfile, args1), interval, max_interval, count, timeout):
+        if kind == ERROR:
+          print "ERROR %s %s" % (key, error.msg)
+        elif kind == REMOVED:
+          print "REMOVED %s" % key
+        else:
+          print "%s %s %s" % (kind, key, version)
+        sys.stdout.flush()
+    except KeyboardInterrupt:
+      pass
+
+  def _cmd_flush(self, args):
+    if (len(args) != 0):
+      self._error("Wrong flush command syntax.")
+    written, errors = self.session.flush()
+    self._print_errors(errors)
+    print "FLUSHED %d" % written
+    if errors:
+      self._possiblyexit(1)
+
   def _cmd_config(self, args):
     if (len(args) == 0):
       print self.config
@@ -307,9 +594,11 @@ class CommandExecutor:
     if (len(args) > 2):
       self._error("Wrong config command syntax.")
 
-    self.config[args[0]] = args[1]
-    self.client = None # throw away the old client
-    self._get_client() # try to create new one
+    try:
+      errors = self.session.configure(args[0], args[1])
+    except ConfigError as e:
+      self._error(e.msg)
+    self._print_errors(errors)
     print "STORED"
   
   def _error(self, msg):
@@ -322,10 +611,33 @@ class CommandExecutor:
   def execute(self, line):
     if (line == None or line.strip() == ""):
       return
-    tokens = shlex.split(line)
-    self.execute_cmd(tokens[0], tokens[1:])
+    start = time.time()
+    op = compile_line(line)
+    if op == None:
+      return
+    if self.profiler != None:
+      self.profiler.add(op.cmd, PHASE_PARSE, time.time() - start)
+    self.execute_op(op)
+
+  def execute_op(self, op):
+    """executes Operation returned by compile_line"""
+    if op.error != None:
+      raise op.error
+    self.execute_cmd(op.cmd, op.args)
     
   def execute_cmd(self, cmd, args):
+    if not isinstance(args, ParsedArgs):
+      start = time.time()
+      args = parse_args(cmd, args)
+      if self.profiler != None:
+        self.profiler.add(cmd, PHASE_PARSE, time.time() - start)
+    if self.profiler != None:
+      with self.profiler.command(cmd):
+        self._execute_cmd(cmd, args)
+    else:
+      self._execute_cmd(cmd, args)
+
+  def _execute_cmd(self, cmd, args):
     try:
       if cmd == "put":
         self._cmd_put(args)
@@ -335,6 +647,10 @@ class CommandExecutor:
         self._cmd_version(args)
       elif cmd == "delete":
         self._cmd_delete(args)
+      elif cmd == "mdelete":
+        self._cmd_mdelete(args)
+      elif cmd == "touch":
+        self._cmd_touch(args)
       elif cmd == "include":
         self._cmd_include(args)
       elif cmd == "help":
@@ -345,6 +661,22 @@ class CommandExecutor:
         self._cmd_exists(args)
       elif cmd == "config":
         self._cmd_config(args)
+      elif cmd == "bloom":
+        self._cmd_bloom(args)
+      elif cmd == "hotkeys":
+        self._cmd_hotkeys(args)
+      elif cmd == "sizes":
+        self._cmd_sizes(args)
+      elif cmd == "flush":
+        self._cmd_flush(args)
+      elif cmd == "watch":
+        self._cmd_watch(args)
+      elif cmd == "checksum":
+        self._cmd_checksum(args)
+      elif cmd == "incr":
+        self._cmd_incr(args)
+      elif cmd == "update":
+        self._cmd_update(args)
       else:
         self._error("unknown command: %s" % cmd)
     except CommandExecutionError as e:
@@ -356,17 +688,23 @@ class CommandExecutor:
     except ConflictError as e:
       print "CONFLICT"
       self._possiblyexit(3)
+    except CodecError as e:
+      print "ERROR", e.args[0]
+      self._possiblyexit(1)
     except CacheClientError as e: # most general cache client error, it has to be handled last
       print "ERROR", e.msg
       self._possiblyexit(1)
  
 def main(args):
   try:
-    opts, args = getopt.getopt(sys.argv[1:], "c:h:p:C:veP:", ["client=", "host=", "port=", "cache-name=", "version", "exit-on-error", "config="])
+    opts, args = getopt.getopt(sys.argv[1:], "c:h:p:C:veP:", ["client=", "host=", "port=", "cache-name=", "version", "exit-on-error", "config=", "profile", "profile-output=", "limit-ops=", "limit-bytes="])
   except getopt.GetoptError:          
     print USAGE              
     sys.exit(2)     
 
+  profiler = None
+  profile_output = None
+
   config = Config() # values here will be overriden by anything passed in commandline
   for opt, arg in opts:
     if opt in ("-c", "--client"):
@@ -389,11 +727,40 @@ def main(args):
         sys.exit(0)
       try:
         config[params[0]] = params[1]
-      except CommandExecutionError as e:
+      except ConfigError as e:
         print e.msg
         sys.exit(1)
+    if opt == "--profile":
+      profiler = PhaseProfiler()
+    if opt == "--profile-output":
+      profile_output = arg
+    if opt == "--limit-ops":
+      config["limit.ops_per_second"] = arg
+    if opt == "--limit-bytes":
+      config["limit.bytes_per_second"] = arg
+
+  if profile_output != None:
+    session_profile = cProfile.Profile()
+    session_profile.enable()
+  if profiler != None:
+    stdout = sys.stdout
+    sys.stdout = ProfiledOutput(stdout, profiler)
+  try:
+    executor = CommandExecutor(config, profiler)
+    try:
+      _run(executor, args)
+    finally:
+      executor.close() # puts may still be waiting in the write-behind buffer
+  finally:
+    if profiler != None:
+      sys.stdout = stdout
+      for line in profiler.report():
+        print >> sys.stderr, line
+    if profile_output != None:
+      session_profile.disable()
+      session_profile.dump_stats(profile_output)
 
-  executor = CommandExecutor(config)
+def _run(executor, args):
   isatty = sys.stdin.isatty()
   prompt = "> " if isatty else ""
   if (len(args) == 0):
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memcached text protocol connection
+
+Talks to a single server, returns the exact reply status lines so that callers can tell apart
+STORED / NOT_STORED / EXISTS / NOT_FOUND. Requests can be pipelined: written in batches without
+waiting for the replies, which are then read in the same order.
+"""
+from ispncon.transport import Transport
+import socket
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+MAX_KEY_LENGTH = 250
+
+class MemcachedProtocolError(Exception):
+  """Connection broken or a reply we don't understand"""
+  def __init__(self, msg):
+    Exception.__init__(self, msg)
+    self.msg = msg
+
+class MemcachedConnection(object):
+  def __init__(self, host, port, window=64, transport=None):
+    self.host = host
+    self.port = port
+    self.window = window
+    self.transport = transport if transport != None else Transport()
+    self.sock = None
+    self.reader = None
+
+  def _connect(self):
+    if self.sock == None:
+      try:
+        self.sock = self.transport.connect(self.host, self.port)
+      except socket.error as e:
+        raise MemcachedProtocolError("can't connect to %s:%s: %s" % (self.host, self.port, e))
+      self.reader = self.sock.makefile("rb")
+
+  def close(self):
+    if self.sock != None:
+      self.reader.close()
+      self.sock.close()
+      self.sock = None
+      self.reader = None
+
+  def check_key(self, key):
+    if len(key) == 0 or len(key) > MAX_KEY_LENGTH:
+      raise MemcachedProtocolError("memcached key length must be between 1 and %d" % MAX_KEY_LENGTH)
+    for c in key:
+      if ord(c) <= 32 or ord(c) == 127:
+        raise MemcachedProtocolError("memcached key can't contain whitespace or control characters")
+
+  def _send(self, data):
+    self._connect()
+    try:
+      self.sock.sendall(data)
+    except socket.error as e:
+      self.close()
+      raise MemcachedProtocolError("error sending request: %s" % e)
+
+  def _readline(self):
+    try:
+      line = self.reader.readline()
+    except socket.error as e:
+      self.close()
+      raise MemcachedProtocolError("error reading reply: %s" % e)
+    if not line.endswith("\r\n"):
+      self.close()
+      raise MemcachedProtocolError("connection closed by server")
+    return line[:-2]
+
+  def _read_exact(self, length):
+    try:
+      data = self.reader.read(length)
+    except socket.error as e:
+      self.close()
+      raise MemcachedProtocolError("error reading reply: %s" % e)
+    if len(data) != length:
+      self.close()
+      raise MemcachedProtocolError("connection closed by server")
+    return data
+
+  def _read_values(self):
+    """reads VALUE lines up to END, returns dict key -> (flags, value, cas or None)"""
+    values = {}
+    while True:
+      line = self._readline()
+      if line == "END":
+        return values
+      parts = line.split(" ")
+      if parts[0] != "VALUE" or len(parts) < 4:
+        self.close()
+        raise MemcachedProtocolError("unexpected reply: %s" % line)
+      value = self._read_exact(int(parts[3]) + 2)[:-2]
+      values[parts[1]] = (int(parts[2]), value, long(parts[4]) if len(parts) > 4 else None)
+
+  def pipeline(self, requests, read_reply):
+    """Writes requests (already formatted commands) in batches of at most window requests and yields
+       the results of read_reply() for each of them in order.
+    """
+    batch = []
+    unread = 0
+    try:
+      for request in requests:
+        batch.append(request)
+        if len(batch) >= self.window:
+          self._send("".join(batch))
+          unread = len(batch)
+          while unread > 0:
+            reply = read_reply()
+            unread -= 1
+            yield reply
+          batch = []
+      if batch:
+        self._send("".join(batch))
+        unread = len(batch)
+        while unread > 0:
+          reply = read_reply()
+          unread -= 1
+          yield reply
+    finally:
+      if unread > 0:
+        # the replies left in the stream would be taken for replies to the next requests
+        self.close()
+
+  def pipeline_noreply(self, requests):
+    """Writes requests with noreply flag in batches of at most window requests, each batch followed by
+       a version command. The server sends error replies (SERVER_ERROR, CLIENT_ERROR, ERROR) despite
+       noreply, they are the lines before the VERSION reply. yields (number of requests, list of error
+       lines) for each batch, the errors can't be told apart to which request of the batch they belong.
+    """
+    requests = iter(requests)
+    while True:
+      batch = [request for i, request in zip(xrange(self.window), requests)]
+      if not batch:
+        return
+      self._send("".join(batch) + "version\r\n")
+      errors = []
+      while True:
+        line = self._readline()
+        if line.startswith("VERSION"):
+          break
+        errors.append(line)
+        if len(errors) > len(batch):
+          self.close()
+          raise MemcachedProtocolError("server doesn't reply to version command")
+      yield len(batch), errors
+
+  def format_store(self, cmd, key, value, exptime=0, flags=0, cas=None, noreply=False):
+    self.check_key(key)
+    if cmd == "cas":
+      header = "cas %s %d %d %d %d" % (key, flags, exptime, len(value), cas)
+    else:
+      header = "%s %s %d %d %d" % (cmd, key, flags, exptime, len(value))
+    if noreply:
+      header += " noreply"
+    return "%s\r\n%s\r\n" % (header, value)
+
+  def store(self, cmd, key, value, exptime=0, flags=0, cas=None):
+    """cmd is one of set, add, replace, append, prepend, cas. returns reply status line."""
+    self._send(self.format_store(cmd, key, value, exptime, flags, cas))
+    return self._readline()
+
+  def retrieve(self, cmd, keys):
+    """cmd is get or gets. returns dict key -> (flags, value, cas), missing keys are left out"""
+    for key in keys:
+      self.check_key(key)
+    self._send("%s %s\r\n" % (cmd, " ".join(keys)))
+    return self._read_values()
+
+  def format_delete(self, key, noreply=False):
+    self.check_key(key)
+    return "delete %s%s\r\n" % (key, " noreply" if noreply else "")
+
+  def delete(self, key):
+    """returns reply status line: DELETED or NOT_FOUND"""
+    self._send(self.format_delete(key))
+    return self._readline()
+
+  def format_touch(self, key, exptime, noreply=False):
+    self.check_key(key)
+    return "touch %s %d%s\r\n" % (key, exptime, " noreply" if noreply else "")
+
+  def touch(self, key, exptime):
+    """returns reply status line: TOUCHED or NOT_FOUND"""
+    self._send(self.format_touch(key, exptime))
+    return self._readline()
+
+  def incr(self, cmd, key, delta):
+    """cmd is incr or decr. returns the reply line: new value, NOT_FOUND or error"""
+    self.check_key(key)
+    self._send("%s %s %d\r\n" % (cmd, key, delta))
+    return self._readline()
+
+  def format_meta_get(self, key, flags):
+    """meta get returning only the flags requested (no v flag means no value)"""
+    self.check_key(key)
+    return "mg %s%s\r\n" % (key, "".join(" " + flag for flag in flags))
+
+  def meta_get(self, key, flags):
+    """returns the reply line: HD <flags...> if found, EN if not, ERROR if the server doesn't know meta commands"""
+    self._send(self.format_meta_get(key, flags))
+    return self._readline()
+
+  def meta_noop(self):
+    """returns MN on servers supporting meta commands, ERROR on the older ones"""
+    self._send("mn\r\n")
+    return self._readline()
+
+  def read_status(self):
+    return self._readline()
+
+  def flush_all(self):
+    self._send("flush_all\r\n")
+    return self._readline()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Operation metrics in OpenMetrics (Prometheus) text format
+
+Counters of operations, transferred value bytes, errors and retries and latency histograms, labelled
+by client type and client operation. They are served over HTTP (metrics.port) or written into a file
+periodically (metrics.file), e.g. for the node exporter textfile collector.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from ispncon.client import CacheClient, CacheClientError
+import os
+import threading
+import time
+import types
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# counter name -> help text, in the order of the exposition
+COUNTERS = [
+  ("ispncon_operations", "Keys processed by cache client operations, batch operations count each key."),
+  ("ispncon_errors", "Keys whose operation failed, by error type (NotFoundError and ConflictError included)."),
+  ("ispncon_sent_bytes", "Bytes of values sent to the cache."),
+  ("ispncon_received_bytes", "Bytes of values received from the cache."),
+  ("ispncon_retries", "Operations started over after a version conflict or a failed server."),
+]
+LATENCY = ("ispncon_operation_duration_seconds", "Duration of cache client calls, batch operations until their last result.")
+
+def _escape(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels):
+  return ",".join("%s=\"%s\"" % (name, _escape(value)) for name, value in labels)
+
+def _format_number(value):
+  return repr(value) if isinstance(value, float) else str(value)
+
+class MetricsRegistry(object):
+  """Thread safe store of counters and latency histograms. Labels are tuples of (name, value)."""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counters = {} # (counter name, labels) -> value
+    self.latencies = {} # labels -> [bucket counts, sum, count]
+
+  def inc(self, name, labels, amount=1):
+    with self.lock:
+      key = (name, labels)
+      self.counters[key] = self.counters.get(key, 0) + amount
+
+  def observe(self, labels, seconds):
+    with self.lock:
+      histogram = self.latencies.get(labels)
+      if histogram == None:
+        histogram = self.latencies[labels] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+      for idx, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+          histogram[0][idx] += 1
+          break
+      histogram[1] += seconds
+      histogram[2] += 1
+
+  def render(self):
+    """the metrics in OpenMetrics text format"""
+    with self.lock:
+      counters = sorted(self.counters.items())
+      latencies = sorted((labels, (list(h[0]), h[1], h[2])) for labels, h in self.latencies.items())
+    lines = []
+    for name, helptext in COUNTERS:
+      lines.append("# TYPE %s counter" % name)
+      lines.append("# HELP %s %s" % (name, helptext))
+      for (counter, labels), value in counters:
+        if counter == name:
+          lines.append("%s_total{%s} %s" % (name, _format_labels(labels), _format_number(value)))
+    name, helptext = LATENCY
+    lines.append("# TYPE %s histogram" % name)
+    lines.append("# HELP %s %s" % (name, helptext))
+    for labels, (buckets, total, count) in latencies:
+      cumulative = 0
+      for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+        cumulative += bucket
+        lines.append("%s_bucket{%s} %d" % (name, _format_labels(labels + (("le", repr(bound)),)), cumulative))
+      lines.append("%s_bucket{%s} %d" % (name, _format_labels(labels + (("le", "+Inf"),)), count))
+      lines.append("%s_sum{%s} %s" % (name, _format_labels(labels), repr(total)))
+      lines.append("%s_count{%s} %d" % (name, _format_labels(labels), count))
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+class MeasuredClient(object):
+  """Cache client proxy recording every call (including iterating results) into a MetricsRegistry"""
+  def __init__(self, client, metrics, client_type):
+    self.client = client
+    self.metrics = metrics
+    self.client_type = client_type
+
+  def __getattr__(self, name):
+    attr = getattr(self.client, name)
+    if name.startswith("_") or not callable(attr) or name == "close":
+      return attr
+    labels = (("client", self.client_type), ("operation", name))
+    def measured(*args, **kw):
+      retries = self._retries()
+      start = time.time()
+      if name == "put_many":
+        args = (self._sent_entries(labels, args[0]),) + args[1:]
+      try:
+        result = attr(*args, **kw)
+      except CacheClientError as e:
+        self._finish(labels, start, retries, 1, e)
+        raise
+      if isinstance(result, types.GeneratorType):
+        return self._measured_iter(labels, start, retries, result)
+      self._finish(labels, start, retries, 1)
+      if name == "put":
+        self.metrics.inc("ispncon_sent_bytes", labels, len(args[1]))
+      elif name == "update":
+        self.metrics.inc("ispncon_sent_bytes", labels, len(result))
+      elif name == "get":
+        self.metrics.inc("ispncon_received_bytes", labels, len(result[1] if isinstance(result, tuple) else result))
+      elif name == "get_into":
+        self.metrics.inc("ispncon_received_bytes", labels, result[1] if isinstance(result, tuple) else result)
+      return result
+    return measured
+
+  def _retries(self):
+    """retries done by the client and the clients it wraps so far"""
+    total = 0
+    client = self.client
+    while isinstance(client, CacheClient):
+      total += client.retries
+      client = getattr(client, "client", None)
+    return total
+
+  def _finish(self, labels, start, retries, operations, error=None):
+    metrics = self.metrics
+    metrics.observe(labels, time.time() - start)
+    metrics.inc("ispncon_operations", labels, operations)
+    if error != None:
+      metrics.inc("ispncon_errors", labels + (("error", type(error).__name__),))
+    retries = self._retries() - retries
+    if retries > 0:
+      metrics.inc("ispncon_retries", labels[:1], retries)
+
+  def _sent_entries(self, labels, entries):
+    for key, value in entries:
+      self.metrics.inc("ispncon_sent_bytes", labels, len(value))
+      yield key, value
+
+  def _measured_iter(self, labels, start, retries, iterator):
+    # batch operations yield (key, result, error), keys yields just keys
+    operations = 0
+    received = 0
+    errors = {}
+    try:
+      for item in iterator:
+        operations += 1
+        if isinstance(item, tuple) and len(item) == 3:
+          key, result, error = item
+          if error != None:
+            errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+          elif labels[1][1] == "get_many":
+            received += len(result[1] if isinstance(result, tuple) else result)
+        yield item
+    except CacheClientError as e:
+      errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+      raise
+    finally:
+      self._finish(labels, start, retries, operations)
+      for error, count in errors.iteritems():
+        self.metrics.inc("ispncon_errors", labels + (("error", error),), count)
+      if received > 0:
+        self.metrics.inc("ispncon_received_bytes", labels, received)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    body = self.server.metrics.render()
+    self.send_response(200)
+    self.send_header("Content-Type", CONTENT_TYPE)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+class MetricsServer(object):
+  """Serves the metrics on every path of http://host:port/ from a background thread.
+     raises socket.error if the port can't be bound"""
+  def __init__(self, metrics, host, port):
+    self.httpd = HTTPServer((host, port), _MetricsHandler)
+    self.httpd.metrics = metrics
+    self.thread = threading.Thread(target=self.httpd.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    self.thread.join()
+
+class MetricsFileWriter(object):
+  """Writes the metrics into the file every interval seconds and when stopped. The file is replaced
+     atomically, scrapers never see it half written. raises IOError if the file can't be written"""
+  def __init__(self, metrics, path, interval):
+    self.metrics = metrics
+    self.path = path
+    self.interval = interval
+    self.stopped = threading.Event()
+    self.write() # fail early
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def write(self):
+    tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+    f = open(tmp_path, "w")
+    try:
+      f.write(self.metrics.render())
+    finally:
+      f.close()
+    os.rename(tmp_path, self.path)
+
+  def _run(self):
+    while not self.stopped.wait(self.interval):
+      try:
+        self.write()
+      except IOError:
+        pass # the next write or stop tries again
+
+  def stop(self):
+    self.stopped.set()
+    self.thread.join()
+    self.write()
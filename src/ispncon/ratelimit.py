@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput limiting of cache operations
+"""
+import threading
+import time
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+class TokenBucket(object):
+  """Thread safe token bucket refilled with rate tokens per second, holding at most one second worth
+     of tokens. acquire() takes the tokens right away and lets the balance go negative, the caller then
+     sleeps until the debt is paid off, so requests bigger than the bucket (large values) pass too and
+     concurrent callers queue up behind each other. Rate 0 means no limit.
+  """
+  def __init__(self, rate=0):
+    self.lock = threading.Lock()
+    self.rate = 0
+    self.tokens = 0.0
+    self.last = time.time()
+    self.set_rate(rate)
+
+  def set_rate(self, rate):
+    with self.lock:
+      if rate != self.rate:
+        self.rate = rate
+        self.tokens = float(rate)
+        self.last = time.time()
+
+  def acquire(self, n=1):
+    if self.rate <= 0 or n <= 0:
+      return
+    with self.lock:
+      now = time.time()
+      self.tokens = min(float(self.rate), self.tokens + (now - self.last) * self.rate)
+      self.last = now
+      self.tokens -= n
+      wait = -self.tokens / self.rate
+    if wait > 0:
+      time.sleep(wait)
+
+class RateLimiter(object):
+  """Limits operations per second and bytes per second, 0 means no limit"""
+  def __init__(self, ops_per_second=0, bytes_per_second=0):
+    self.ops = TokenBucket(ops_per_second)
+    self.bytes = TokenBucket(bytes_per_second)
+
+  def set_limits(self, ops_per_second, bytes_per_second):
+    self.ops.set_rate(ops_per_second)
+    self.bytes.set_rate(bytes_per_second)
+
+  def active(self):
+    return self.ops.rate > 0 or self.bytes.rate > 0
+
+  def acquire(self, ops=1, nbytes=0):
+    self.ops.acquire(ops)
+    self.bytes.acquire(nbytes)
+
+def _value_len(result):
+  """length of value returned by get, possibly together with version"""
+  if isinstance(result, tuple):
+    result = result[1]
+  if isinstance(result, (int, long)):
+    return result # get_into returns number of bytes
+  return len(result) if result != None else 0
+
+class LimitedClient(object):
+  """Cache client proxy passing every operation through the rate limiter. Values sent count before
+     the operation, values received after it (they delay the operations that follow).
+  """
+  def __init__(self, client, limiter):
+    self.client = client
+    self.limiter = limiter
+
+  def put(self, key, value, *args, **kw):
+    self.limiter.acquire(1, len(value))
+    return self.client.put(key, value, *args, **kw)
+
+  def get(self, key, get_version=False):
+    self.limiter.acquire(1)
+    result = self.client.get(key, get_version)
+    self.limiter.acquire(0, _value_len(result))
+    return result
+
+  def get_into(self, key, outfile, get_version=False):
+    self.limiter.acquire(1)
+    result = self.client.get_into(key, outfile, get_version)
+    self.limiter.acquire(0, _value_len(result))
+    return result
+
+  def update(self, key, transform, *args, **kw):
+    # every attempt reads the value and writes the new one
+    def limited_transform(value):
+      new_value = transform(value)
+      self.limiter.acquire(2, len(value) + len(new_value))
+      return new_value
+    return self.client.update(key, limited_transform, *args, **kw)
+
+  def touch(self, key, lifespan=None, max_idle=None):
+    # one operation even for clients re-putting the value, its size isn't known without reading it again
+    self.limiter.acquire(1)
+    return self.client.touch(key, lifespan, max_idle)
+
+  def get_many(self, keys, get_version=False):
+    def limited_keys():
+      for key in keys:
+        self.limiter.acquire(1)
+        yield key
+    for key, result, error in self.client.get_many(limited_keys(), get_version):
+      if error == None:
+        self.limiter.acquire(0, _value_len(result))
+      yield key, result, error
+
+  def versions(self, keys):
+    def limited_keys():
+      for key in keys:
+        self.limiter.acquire(1)
+        yield key
+    return self.client.versions(limited_keys())
+
+  def delete_many(self, keys):
+    def limited_keys():
+      for key in keys:
+        self.limiter.acquire(1)
+        yield key
+    return self.client.delete_many(limited_keys())
+
+  def touch_many(self, keys, lifespan=None, max_idle=None):
+    def limited_keys():
+      for key in keys:
+        self.limiter.acquire(1)
+        yield key
+    return self.client.touch_many(limited_keys(), lifespan, max_idle)
+
+  def put_many(self, entries, lifespan=None, max_idle=None):
+    def limited_entries():
+      for key, value in entries:
+        self.limiter.acquire(1, len(value))
+        yield key, value
+    return self.client.put_many(limited_entries(), lifespan, max_idle)
+
+  def __getattr__(self, name):
+    attr = getattr(self.client, name)
+    if name.startswith("_") or name == "close" or not callable(attr):
+      return attr
+    def limited(*args, **kw):
+      self.limiter.acquire(1)
+      return attr(*args, **kw)
+    return limited
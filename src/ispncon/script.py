@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Command line parsing and compiled include scripts
+
+Every command line is tokenized and its options parsed once into an Operation. Include files are
+compiled into lists of operations which are cached until the file changes, so replaying a script
+doesn't parse it again.
+"""
+import getopt
+import os
+import shlex
+import threading
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+# command -> (short options, long options) for getopt, commands not listed take plain arguments
+OPTION_SPECS = {
+  "put" : ("i:v:l:I:ae:", ["input-filename=", "version=", "lifespan=", "max-idle=", "put-if-absent", "encode="]),
+  "get" : ("o:vd:", ["output-filename=", "version", "decode="]),
+  "delete" : ("v:", ["version="]),
+  "mdelete" : ("f:p:", ["key-file=", "prefix="]),
+  "touch" : ("f:l:I:w:", ["key-file=", "lifespan=", "max-idle=", "workers="]),
+  "incr" : ("r:", ["retries="]),
+  "update" : ("r:", ["retries="]),
+  "hotkeys" : ("r", ["reset"]),
+  "bloom" : ("f:n:e:i", ["key-file=", "capacity=", "error-rate=", "info"]),
+  "sizes" : ("f:w:", ["key-file=", "workers="]),
+  "checksum" : ("f:w:b:B:", ["key-file=", "workers=", "buckets=", "bucket="]),
+  "watch" : ("f:i:m:n:t:", ["key-file=", "interval=", "max-interval=", "count=", "timeout="]),
+  "include" : ("sj:", ["stats", "jobs="]),
+}
+
+class ParsedArgs(object):
+  """Result of getopt on the arguments of a command, or the GetoptError it raised.
+     Iterating yields the original tokens."""
+  def __init__(self, tokens, opts=None, args=None, error=None):
+    self.tokens = tokens
+    self.opts = opts
+    self.args = args
+    self.error = error
+
+  def __iter__(self):
+    return iter(self.tokens)
+
+  def __len__(self):
+    return len(self.tokens)
+
+def parse_args(cmd, tokens):
+  """returns ParsedArgs for commands with options, the tokens themselves otherwise"""
+  spec = OPTION_SPECS.get(cmd)
+  if spec == None:
+    return tokens
+  try:
+    opts, args = getopt.getopt(tokens, spec[0], spec[1])
+  except getopt.GetoptError as e:
+    return ParsedArgs(tokens, error=e)
+  return ParsedArgs(tokens, opts, args)
+
+class Operation(object):
+  """Parsed command line. If the line couldn't be tokenized, error holds the exception to raise
+     when the operation is executed, so that the preceding lines still run first."""
+  def __init__(self, cmd, args, error=None):
+    self.cmd = cmd
+    self.args = args
+    self.error = error
+
+def compile_line(line):
+  """Operation for the command line, None for an empty line"""
+  try:
+    tokens = shlex.split(line)
+  except ValueError as e:
+    return Operation(None, None, e)
+  if not tokens:
+    return None
+  return Operation(tokens[0], parse_args(tokens[0], tokens[1:]))
+
+class ScriptCache(object):
+  """Compiled include files, recompiled when the modification time or size of the file changes"""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.scripts = {} # absolute path -> (mtime, size, operations)
+
+  def compile(self, filename):
+    """returns (operations, number of lines compiled now, 0 if the cached version was used).
+       raises IOError if the file can't be read"""
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    with self.lock:
+      cached = self.scripts.get(path)
+    if cached != None and cached[0] == st.st_mtime and cached[1] == st.st_size:
+      return cached[2], 0
+    operations = []
+    lines = 0
+    f = open(path, "r")
+    try:
+      for line in f:
+        lines += 1
+        op = compile_line(line)
+        if op != None:
+          operations.append(op)
+    finally:
+      f.close()
+    with self.lock:
+      self.scripts[path] = (st.st_mtime, st.st_size, operations)
+    return operations, lines
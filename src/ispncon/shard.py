@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Multi-process execution of include files
+
+Operations on a single key are sharded by key hash across worker processes, each with its own
+CommandExecutor and cache client, so parsing, coding and protocol work use several CPU cores.
+Operations on the same key always go to the same worker and keep their order. Outputs are printed
+in the order of the input. Other operations run in the first worker, except those reporting state of the
+session (hot keys, Bloom filter statistics) which would only cover the keys of one worker: hotkeys is
+run in every worker and the lists are merged, bloom -i is refused. After clear and bloom the other
+workers load the Bloom filter the first one saved, their own filters are out of date.
+"""
+from ispncon.client import CacheClientError
+from ispncon.config import Config
+from ispncon.script import ParsedArgs
+from ispncon.stats import key_bucket
+from StringIO import StringIO
+import multiprocessing
+import sys
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+# commands whose first argument is the key, they are sharded
+KEY_COMMANDS = ["put", "get", "version", "delete", "exists", "incr", "update"]
+# commands executed by every worker
+BROADCAST_COMMANDS = ["config", "flush", "hotkeys"]
+# commands run in the first worker that replace the Bloom filter in bloom.file, the others reload it
+BLOOM_COMMANDS = ["clear", "bloom"]
+# max number of operations sent to the workers at once
+BATCH_SIZE = 4096
+
+def operation_key(op):
+  """key of the operation if it is sharded, None otherwise"""
+  if not op.cmd in KEY_COMMANDS:
+    return None
+  args = op.args
+  if isinstance(args, ParsedArgs):
+    args = args.args if args.error == None else args.tokens
+  return args[0] if args else ""
+
+def _merge_hotkeys(op, outputs):
+  """hotkeys output of the whole run: every key is sampled by one worker only, so the heaviest keys
+     overall are the heaviest of the workers' lists. None if the workers failed"""
+  args = op.args
+  if not isinstance(args, ParsedArgs) or args.error != None:
+    return None
+  try:
+    count = int(args.args[0]) if args.args else 10
+  except ValueError:
+    return None
+  lines = []
+  for output in outputs:
+    for line in output.splitlines():
+      if line.startswith("ERROR"):
+        return None
+      lines.append(line)
+  # <key> <count> <error> <bytes>, the key may contain spaces
+  lines.sort(key=lambda line: -long(line.rsplit(" ", 3)[1]))
+  return "".join(line + "\n" for line in lines[:count])
+
+# command -> function(op, outputs of the workers) combining the outputs of a broadcast command
+MERGED_OUTPUTS = {"hotkeys": _merge_hotkeys}
+
+def refused(op):
+  """error message if the operation can't be executed by sharded workers, None otherwise"""
+  if op.cmd == "bloom" and isinstance(op.args, ParsedArgs) and op.args.error == None:
+    if [opt for opt, arg in op.args.opts if opt in ("-i", "--info")]:
+      return "bloom -i can't be used with include -j, every worker has its own Bloom filter."
+  return None
+
+def _worker_config(config, workers):
+  """config of one worker, throughput limits are split among the workers. the workers don't export
+     metrics, they'd compete for the port or the file"""
+  worker_config = Config()
+  for key, value in config.iteritems():
+    worker_config[key] = value
+  worker_config["metrics.port"] = "0"
+  worker_config["metrics.file"] = ""
+  for key in ("limit.ops_per_second", "limit.bytes_per_second"):
+    try:
+      worker_config[key] = str(float(config[key]) / workers)
+    except ValueError:
+      pass # the worker reports it
+  return worker_config
+
+def _capture(function, *args):
+  """runs function, returns what it printed"""
+  stdout = sys.stdout
+  sys.stdout = output = StringIO()
+  try:
+    function(*args)
+  finally:
+    sys.stdout = stdout
+  return output.getvalue()
+
+def _reload_bloom(executor):
+  from ispncon.api import SessionError
+  try:
+    executor.session.reload_bloom()
+  except SessionError as e:
+    print "ERROR", e.msg
+
+def _worker_main(conn, config, workers):
+  from ispncon.console import CommandExecutor
+  class ShardExecutor(CommandExecutor):
+    """records exit codes instead of exiting, the parent decides"""
+    def _possiblyexit(self, exit_code):
+      self.exit_code = exit_code
+
+  executor = ShardExecutor(_worker_config(config, workers))
+  stop_on_error = executor.exit_on_error
+  try:
+    while True:
+      msg = conn.recv()
+      if msg[0] == "run":
+        results = []
+        for idx, cmd, tokens in msg[1]:
+          executor.exit_code = 0
+          output = _capture(executor.execute_cmd, cmd, tokens)
+          results.append((idx, output, executor.exit_code))
+          if stop_on_error and executor.exit_code != 0:
+            break
+        conn.send(results)
+      elif msg[0] == "sync":
+        # buffered puts have to reach the cache before an operation that isn't sharded
+        conn.send(_capture(lambda: executor._print_errors(executor.session.flush()[1])))
+      elif msg[0] == "reload_bloom":
+        conn.send(_capture(_reload_bloom, executor))
+      elif msg[0] == "close":
+        conn.send(_capture(executor.close))
+        return
+  except KeyboardInterrupt:
+    pass
+  finally:
+    conn.close()
+
+class ShardedRunner(object):
+  """Executes operations with a pool of worker processes. Operations that aren't sharded run in the
+     first worker after all the operations before them finished (and buffered puts were written),
+     config and flush run in every worker. After clear and bloom the other workers reload the Bloom filter.
+  """
+  def __init__(self, config, workers):
+    self.workers = workers
+    self.exit_on_error = False
+    self.conns = []
+    self.processes = []
+    for i in range(workers):
+      parent_conn, child_conn = multiprocessing.Pipe()
+      process = multiprocessing.Process(target=_worker_main, args=(child_conn, dict(config), workers))
+      process.daemon = True
+      process.start()
+      child_conn.close()
+      self.conns.append(parent_conn)
+      self.processes.append(process)
+
+  def _recv(self, conn):
+    try:
+      return conn.recv()
+    except (EOFError, IOError):
+      raise CacheClientError("worker process %d died" % self.conns.index(conn))
+
+  def _run_batch(self, shards):
+    """executes lists of (index, cmd, tokens) in the workers, returns first non zero exit code in
+       the order of the indexes. outputs are printed in that order"""
+    for conn, shard in zip(self.conns, shards):
+      if shard:
+        conn.send(("run", shard))
+    results = []
+    for conn, shard in zip(self.conns, shards):
+      if shard:
+        results.extend(self._recv(conn))
+    results.sort()
+    for idx, output, exit_code in results:
+      sys.stdout.write(output)
+      if exit_code != 0 and self.exit_on_error:
+        return exit_code
+    return 0
+
+  def _broadcast(self, idx, op):
+    shard = [(idx, op.cmd, list(op.args))]
+    for conn in self.conns:
+      conn.send(("run", shard))
+    outputs = []
+    exit_code = 0
+    for conn in self.conns:
+      for idx, output, code in self._recv(conn):
+        outputs.append(output)
+        exit_code = exit_code or code
+    merge = MERGED_OUTPUTS.get(op.cmd)
+    merged = merge(op, outputs) if merge != None else None
+    if merged == None:
+      # the workers print the same, e.g. STORED of config
+      merged = "".join(output for i, output in enumerate(outputs) if not output in outputs[:i])
+    sys.stdout.write(merged)
+    return exit_code if self.exit_on_error else 0
+
+  def _sync(self, conns=None, msg=("sync",)):
+    conns = self.conns if conns == None else conns
+    for conn in conns:
+      conn.send(msg)
+    for conn in conns:
+      sys.stdout.write(self._recv(conn))
+
+  def run(self, operations, exit_on_error=False):
+    """executes the operations, returns exit code of the first failed operation if exit_on_error,
+       0 otherwise. raises the error of an operation whose line couldn't be tokenized when reached"""
+    self.exit_on_error = exit_on_error
+    shards = [[] for i in range(self.workers)]
+    pending = 0
+    for idx, op in enumerate(operations):
+      key = operation_key(op) if op.error == None else None
+      if key != None:
+        shards[key_bucket(key, self.workers)].append((idx, op.cmd, list(op.args)))
+        pending += 1
+        if pending < BATCH_SIZE:
+          continue
+      exit_code = self._run_batch(shards)
+      shards = [[] for i in range(self.workers)]
+      pending = 0
+      if exit_code != 0:
+        return exit_code
+      if key != None:
+        continue
+      if op.error != None:
+        raise op.error
+      error = refused(op)
+      if error != None:
+        print "ERROR", error
+        exit_code = 1 if self.exit_on_error else 0
+      elif op.cmd in BROADCAST_COMMANDS:
+        exit_code = self._broadcast(idx, op)
+      else:
+        self._sync()
+        exit_code = self._run_batch([[(idx, op.cmd, list(op.args))]])
+        if op.cmd in BLOOM_COMMANDS:
+          self._sync(self.conns[1:], ("reload_bloom",))
+      if exit_code != 0:
+        return exit_code
+    return self._run_batch(shards)
+
+  def close(self):
+    """closes the workers' clients (printing errors of their buffered puts) and stops them"""
+    for conn in self.conns:
+      try:
+        conn.send(("close",))
+        sys.stdout.write(conn.recv())
+      except (EOFError, IOError):
+        pass
+      conn.close()
+    for process in self.processes:
+      process.join()
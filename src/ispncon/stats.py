@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming statistics with bounded memory
+"""
+import hashlib
+import random
+import struct
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+class SpaceSavingSketch(object):
+  """Space-Saving heavy hitter sketch (Metwally, Agrawal, El Abbadi).
+     Monitors at most capacity keys, counts are overestimated by at most the reported error.
+  """
+  def __init__(self, capacity, sample_rate=1.0):
+    if capacity < 1:
+      raise ValueError("sketch capacity must be positive")
+    self.capacity = capacity
+    self.sample_rate = sample_rate
+    self.reset()
+
+  def reset(self):
+    self.counters = {} # key -> [count, error, bytes]
+    self.buckets = {} # count -> set of keys having that count
+    self.min_count = 0
+    self.total = 0
+
+  def _bucket_add(self, key, count):
+    bucket = self.buckets.get(count)
+    if bucket == None:
+      bucket = self.buckets[count] = set()
+    bucket.add(key)
+
+  def _bucket_remove(self, key, count):
+    bucket = self.buckets[count]
+    bucket.discard(key)
+    if not bucket:
+      del self.buckets[count]
+      return True
+    return False
+
+  def offer(self, key, nbytes=0):
+    """Record one access to key that transferred nbytes, subject to sampling"""
+    if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+      return
+    self.total += 1
+    counter = self.counters.get(key)
+    if counter != None:
+      count = counter[0]
+      if self._bucket_remove(key, count) and count == self.min_count:
+        self.min_count = count + 1
+      counter[0] = count + 1
+      counter[2] += nbytes
+      self._bucket_add(key, count + 1)
+    elif len(self.counters) < self.capacity:
+      self.counters[key] = [1, 0, nbytes]
+      self._bucket_add(key, 1)
+      self.min_count = 1
+    else:
+      # evict one of the least counted keys, the newcomer inherits its count as error
+      victim = iter(self.buckets[self.min_count]).next()
+      self._bucket_remove(victim, self.min_count)
+      del self.counters[victim]
+      self.counters[key] = [self.min_count + 1, self.min_count, nbytes]
+      self._bucket_add(key, self.min_count + 1)
+      if not self.min_count in self.buckets:
+        self.min_count += 1
+
+  def top(self, n=None):
+    """Returns list of (key, estimated count, max overestimation, estimated bytes),
+       heaviest first. Counts and bytes are scaled by the sampling rate.
+    """
+    scale = 1.0 / self.sample_rate
+    entries = sorted(self.counters.iteritems(), key=lambda e: e[1][0], reverse=True)
+    if n != None:
+      entries = entries[:n]
+    return [(key, int(c[0] * scale), int(c[1] * scale), int(c[2] * scale)) for key, c in entries]
+
+class LogHistogram(object):
+  """Histogram of non-negative integer values with power-of-two bucket boundaries.
+     Bucket 0 counts zeros, bucket i counts values in interval [2^(i-1), 2^i).
+  """
+  def __init__(self):
+    self.buckets = []
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+
+  def add(self, value):
+    idx = value.bit_length() if value > 0 else 0
+    if idx >= len(self.buckets):
+      self.buckets.extend([0] * (idx + 1 - len(self.buckets)))
+    self.buckets[idx] += 1
+    self.count += 1
+    self.total += value
+    if self.min == None or value < self.min:
+      self.min = value
+    if self.max == None or value > self.max:
+      self.max = value
+
+  def mean(self):
+    if self.count == 0:
+      return 0
+    return float(self.total) / self.count
+
+  def ranges(self):
+    """Returns list of (lower bound, upper bound exclusive, count) for the non-empty buckets"""
+    ret = []
+    for idx, count in enumerate(self.buckets):
+      if count > 0:
+        if idx == 0:
+          ret.append((0, 1, count))
+        else:
+          ret.append((1 << (idx - 1), 1 << idx, count))
+    return ret
+
+DIGEST_MASK = (1 << 64) - 1
+
+def _hash64(data):
+  return struct.unpack_from(">Q", hashlib.md5(data).digest())[0]
+
+def entry_hash(key, value):
+  """64-bit hash of a cache entry"""
+  return _hash64("%d:%s%s" % (len(key), key, value))
+
+def key_bucket(key, buckets):
+  """bucket of the key, depends on the key only so that both compared sides agree on it"""
+  return _hash64(key) % buckets
+
+class SetDigest(object):
+  """Order independent digest of a set of cache entries: sum of the entry hashes modulo 2^64.
+     Optionally keeps separate digests for buckets of the key space, so that two caches can be
+     compared bucket by bucket and only the mismatching buckets examined further.
+  """
+  def __init__(self, buckets=0):
+    self.count = 0
+    self.digest = 0
+    self.buckets = [[0, 0] for i in xrange(buckets)] # [count, digest]
+
+  def add(self, key, ehash):
+    """add entry with given key and entry_hash"""
+    self.count += 1
+    self.digest = (self.digest + ehash) & DIGEST_MASK
+    if self.buckets:
+      bucket = self.buckets[key_bucket(key, len(self.buckets))]
+      bucket[0] += 1
+      bucket[1] = (bucket[1] + ehash) & DIGEST_MASK
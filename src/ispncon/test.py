@@ -2,62 +2,1577 @@
 Created on Jul 18, 2011
 
 @author: mlinhard
+
+Client overhead microbenchmarks and correctness checks
+
+Measures time per operation of command parsing, CommandExecutor.execute, every codec at several
+value sizes and every cache client against in-process loopback servers, so the numbers show the
+client side overhead only (no real server, no network). Codecs are checked to round trip first.
+With -c, pass/fail checks of the client side features run against the same loopback servers instead.
+
+USAGE: python -m ispncon.test [options] [benchmark name prefix...]
+    -n --ops <n>            operations per measurement. Default: 2000
+    -r --repeats <n>        measurements per benchmark, the fastest one counts. Default: 5
+    -s --save <file>        store the results as JSON baseline
+    -b --baseline <file>    compare with JSON baseline, exit code 1 if any benchmark got slower
+                            than threshold times its baseline
+    -t --threshold <ratio>  allowed slowdown against the baseline. Default: 1.5
+    -c --check              run the checks (name prefixes select them) instead of the benchmarks,
+                            exit code 1 if any check failed
 '''
-from ispncon.codec import RiverStringCodec, RiverByteArrayCodec
-
-def ByteToHex(byteStr):
-  return ''.join([ "%02X " % ord(x) for x in byteStr ]).strip()
-
-def hex(byteStr):
-  if len(byteStr) > 20:
-    return ByteToHex(byteStr[0:20]) + "...(next " + str(len(byteStr) - 20) + " chars)"
-  else:
-    return ByteToHex(byteStr) 
-  
-def char(byteStr):
-  if len(byteStr) > 20:
-    return byteStr[0:20] + "...(next " + str(len(byteStr) - 20) + " chars)"
-  else:
-    return byteStr
-  
-def test_codec_simple(m, str):
-  bytes = m.encode(str)
-  print char(str) + " = " + hex(bytes)
-  strunmarshalled = m.decode(bytes)
-  print "unmarshalled size: %i" % len(strunmarshalled)
-  if (str != strunmarshalled):
-    print "ERROR '" + char(str) + "' != '" + char(strunmarshalled) + "'"
-    print "original    : "+hex(str)
-    print "unmarshalled: "+hex(strunmarshalled)
-   
-def test_codec(m):
-  test_codec_simple(m, "")
-  test_codec_simple(m, "a")
-  test_codec_simple(m, "b")
-  test_codec_simple(m, "c")
-  a256 = ""
-  for i in range(1,256): a256+="a"
-  a257 = a256+"a";
-  a258 = a257+"a";
-  a65336 = "";
-  a65536 = "";
-  a65537 = "";
-  for i in range(1,65336): a65336+="a"
-  for i in range(1,65536): a65536+="a"
-  for i in range(1,65537): a65537+="a"
-  a65538 = a65537+"a";
-  
-  test_codec_simple(m, a256)
-  test_codec_simple(m, a257)
-  test_codec_simple(m, a258)
-  test_codec_simple(m, a65336)
-  test_codec_simple(m, a65536)
-  test_codec_simple(m, a65537)
-  test_codec_simple(m, a65538)
-
-print "testing RiverString"
-test_codec(RiverStringCodec())
-print "testing RiverByteArray"    
-test_codec(RiverByteArrayCodec())    
-    
-      
+from BaseHTTPServer import BaseHTTPRequestHandler
+from ispncon.buffer import WriteBehindBuffer
+from ispncon.codec import KNOWN_CODECS, CODEC_NONE, CodecError
+from ispncon.config import Config
+from ispncon.metrics import LATENCY_BUCKETS, MetricsRegistry
+from ispncon.script import compile_line
+from ispncon.stats import LogHistogram, SpaceSavingSketch
+import SocketServer
+import getopt
+import hashlib
+import ispncon.bloom
+import ispncon.client
+import ispncon.codec
+import json
+import os
+import re
+import shlex
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib2
+import zlib
+
+SIZES = [16, 1024, 65536]
+
+#################################### loopback servers ####################################
+
+class _Store(object):
+  """entries of a loopback server, key -> (version, value)"""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.entries = {}
+    self.counter = 0
+
+  def get(self, key):
+    with self.lock:
+      return self.entries.get(key)
+
+  def put(self, key, value, version=None, absent=False):
+    """returns False if the version doesn't match or the entry exists when absent is set"""
+    with self.lock:
+      entry = self.entries.get(key)
+      if absent and entry != None:
+        return False
+      if version != None and (entry == None or entry[0] != version):
+        return False
+      self.counter += 1
+      self.entries[key] = (self.counter, value)
+      return True
+
+  def remove(self, key, version=None):
+    """returns False if there's no such entry, None if the version doesn't match"""
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry == None:
+        return False
+      if version != None and entry[0] != version:
+        return None
+      del self.entries[key]
+      return True
+
+class _MemcachedHandler(SocketServer.StreamRequestHandler):
+  """set, add, cas, get, gets, delete, touch, incr, decr, mg, mn, version and flush_all of the memcached
+     text protocol. values longer than server.max_value get SERVER_ERROR, sent despite noreply as memcached does"""
+  disable_nagle_algorithm = True
+
+  def _store(self, store, cmd, tokens):
+    value = self.rfile.read(int(tokens[4]) + 2)[:-2]
+    if len(value) > self.server.max_value:
+      return "SERVER_ERROR object too large for cache\r\n", True
+    version = long(tokens[5]) if cmd == "cas" else None
+    if cmd == "cas" and store.get(tokens[1]) == None:
+      return "NOT_FOUND\r\n", False
+    ok = store.put(tokens[1], value, version, cmd == "add")
+    return ("STORED\r\n" if ok else ("EXISTS\r\n" if cmd == "cas" else "NOT_STORED\r\n")), False
+
+  def _incr(self, store, cmd, key, delta):
+    while True:
+      entry = store.get(key)
+      if entry == None:
+        return "NOT_FOUND\r\n"
+      if not entry[1].isdigit():
+        return "CLIENT_ERROR cannot increment or decrement non-numeric value\r\n"
+      value = (long(entry[1]) + delta) % 2 ** 64 if cmd == "incr" else max(long(entry[1]) - delta, 0)
+      if store.put(key, str(value), entry[0]):
+        return "%d\r\n" % value
+
+  def _meta_get(self, store, key, flags):
+    entry = store.get(key)
+    if entry == None:
+      return "EN\r\n"
+    meta = {"c": "c%d" % entry[0], "s": "s%d" % len(entry[1]), "k": "k" + key}
+    returned = "".join(" " + meta[flag] for flag in flags if flag in meta)
+    if "v" in flags:
+      return "VA %d%s\r\n%s\r\n" % (len(entry[1]), returned, entry[1])
+    return "HD%s\r\n" % returned
+
+  def handle(self):
+    store = self.server.store
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      tokens = line.split()
+      cmd = tokens[0]
+      error = False
+      if cmd in ("set", "add", "cas"):
+        reply, error = self._store(store, cmd, tokens)
+      elif cmd in ("get", "gets"):
+        reply = ""
+        for key in tokens[1:]:
+          entry = store.get(key)
+          if entry != None:
+            cas = " %d" % entry[0] if cmd == "gets" else ""
+            reply += "VALUE %s 0 %d%s\r\n%s\r\n" % (key, len(entry[1]), cas, entry[1])
+        reply += "END\r\n"
+      elif cmd == "delete":
+        reply = "DELETED\r\n" if store.remove(tokens[1]) else "NOT_FOUND\r\n"
+      elif cmd == "touch":
+        # expiration isn't simulated, only recorded
+        self.server.touches.append((tokens[1], int(tokens[2])))
+        reply = "TOUCHED\r\n" if store.get(tokens[1]) != None else "NOT_FOUND\r\n"
+      elif cmd in ("incr", "decr"):
+        reply = self._incr(store, cmd, tokens[1], long(tokens[2]))
+      elif cmd == "mg":
+        reply = self._meta_get(store, tokens[1], [token[0] for token in tokens[2:]])
+      elif cmd == "mn":
+        reply = "MN\r\n"
+      elif cmd == "version":
+        reply = "VERSION 1.6.0-loopback\r\n"
+      elif cmd == "flush_all":
+        with store.lock:
+          store.entries.clear()
+        reply = "OK\r\n"
+      else:
+        reply, error = "ERROR\r\n", True
+      if error or tokens[-1] != "noreply":
+        self.wfile.write(reply)
+
+class _UnixMemcachedHandler(_MemcachedHandler):
+  disable_nagle_algorithm = False # not a TCP socket
+
+def _read_vint(f):
+  result = shift = 0
+  while True:
+    b = ord(f.read(1))
+    result |= (b & 0x7f) << shift
+    if not b & 0x80:
+      return result
+    shift += 7
+
+def _vint(n):
+  out = ""
+  while n >= 0x80:
+    out += chr((n & 0x7f) | 0x80)
+    n >>= 7
+  return out + chr(n)
+
+class _HotRodHandler(SocketServer.StreamRequestHandler):
+  """put, get, get with version, contains, remove, replace with version and remove with version of
+     HotRod protocol 1.0"""
+  disable_nagle_algorithm = True
+
+  def handle(self):
+    store = self.server.store
+    f = self.rfile
+    while True:
+      magic = f.read(1)
+      if not magic:
+        return
+      msg_id = _read_vint(f)
+      version, op = struct.unpack(">BB", f.read(2))
+      f.read(_read_vint(f)) # cache name
+      flag, client_int, topo_id, tx_type = struct.unpack(">4B", f.read(4))
+      key = f.read(_read_vint(f))
+      self.server.requests.append((op, key))
+      status, body = 0, ""
+      if op in (0x01, 0x05, 0x09): # put, put if absent, replace with version
+        _read_vint(f), _read_vint(f) # lifespan, max idle
+        entry_version = struct.unpack(">Q", f.read(8))[0] if op == 0x09 else None
+        value = f.read(_read_vint(f))
+        if not store.put(key, value, entry_version, op == 0x05):
+          status = 0x01
+      elif op in (0x03, 0x11): # get, get with version
+        entry = store.get(key)
+        if entry == None:
+          status = 0x02
+        elif op == 0x03:
+          body = _vint(len(entry[1])) + entry[1]
+        else:
+          body = struct.pack(">Q", entry[0]) + _vint(len(entry[1])) + entry[1]
+      elif op == 0x0F: # contains
+        status = 0x00 if store.get(key) != None else 0x02
+      elif op in (0x0B, 0x0D): # remove, remove with version
+        entry_version = struct.unpack(">Q", f.read(8))[0] if op == 0x0D else None
+        removed = store.remove(key, entry_version)
+        status = {True: 0x00, None: 0x01, False: 0x02}[removed]
+      self.wfile.write(struct.pack(">B", 0xA1) + _vint(msg_id) + struct.pack(">BBB", op + 1, status, 0) + body)
+
+class _RestHandler(BaseHTTPRequestHandler):
+  """keep-alive HTTP/1.1 server with the GET, HEAD, PUT, POST and DELETE semantics of the REST
+     server, versions are served as ETag. gzip request bodies are decompressed, their Content-Encoding
+     is recorded in server.request_encodings. GET responses use server.response_encoding (gzip or
+     deflate) when the request accepts it"""
+  protocol_version = "HTTP/1.1"
+  disable_nagle_algorithm = True
+
+  def log_message(self, *args):
+    pass
+
+  def parse_request(self):
+    if not BaseHTTPRequestHandler.parse_request(self):
+      return False
+    self.server.requests.append((self.command, self.path))
+    return True
+
+  def _reply(self, code, body="", etag=None):
+    self.send_response(code)
+    encoding = self.server.response_encoding
+    if body and encoding != None and encoding in self.headers.get("Accept-Encoding", ""):
+      compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS)
+      body = compressor.compress(body) + compressor.flush()
+      self.send_header("Content-Encoding", encoding)
+    self.send_header("Content-Length", str(len(body)))
+    if etag != None:
+      self.send_header("ETag", etag)
+    self.end_headers()
+    if self.command != "HEAD":
+      self.wfile.write(body)
+
+  def _etag(self, key):
+    entry = self.server.store.get(key)
+    return hashlib.md5(entry[1]).hexdigest() if entry != None else None
+
+  def do_GET(self):
+    entry = self.server.store.get(self.path)
+    if entry == None:
+      self._reply(404)
+    else:
+      self._reply(200, entry[1], hashlib.md5(entry[1]).hexdigest())
+
+  do_HEAD = do_GET
+
+  def _store(self, absent):
+    value = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    encoding = self.headers.get("Content-Encoding")
+    self.server.request_encodings.append(encoding)
+    if encoding == "gzip":
+      value = zlib.decompress(value, 16 + zlib.MAX_WBITS)
+    if_match = self.headers.get("If-Match")
+    if (absent and self._etag(self.path) != None) or (if_match != None and self._etag(self.path) != if_match):
+      self._reply(409)
+    else:
+      self.server.store.put(self.path, value)
+      self._reply(200)
+
+  def do_PUT(self):
+    self._store(False)
+
+  def do_POST(self):
+    self._store(True)
+
+  def do_DELETE(self):
+    # the REST server answers 204 when there was nothing to remove
+    self._reply(200 if self.server.store.remove(self.path) else 204)
+
+class _LoopbackServer(SocketServer.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, handler, unix_path=None):
+    if unix_path != None:
+      self.address_family = socket.AF_UNIX
+    SocketServer.ThreadingTCPServer.__init__(self, unix_path or ("127.0.0.1", 0), handler)
+    self.store = _Store()
+    self.max_value = 1024 * 1024 # largest value the memcached handler stores
+    self.response_encoding = None # Content-Encoding of the rest handler's responses
+    self.request_encodings = []
+    self.touches = [] # (key, exptime) of the touch commands the memcached handler got
+    self.requests = [] # (method or operation code, key) of the requests of the rest and hotrod handlers
+    self.handlers = []
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def process_request(self, request, client_address):
+    thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+    thread.daemon = True
+    self.handlers.append((thread, request))
+    thread.start()
+
+  def close(self, timeout=1.0):
+    """stops the server, breaks its connections like a crashed server would and waits for the
+       handlers, so that they don't outlive the interpreter"""
+    self.shutdown()
+    self.server_close()
+    for thread, request in self.handlers:
+      try:
+        request.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass # closed by the client
+    deadline = time.time() + timeout
+    for thread, request in self.handlers:
+      thread.join(max(deadline - time.time(), 0))
+
+def _loopback_config(client_type, server):
+  config = Config()
+  config["client_type"] = client_type
+  config["host"] = "127.0.0.1"
+  config["port"] = str(server.server_address[1])
+  config["memcached.meta_commands"] = "false"
+  config["chunking.threshold"] = "0"
+  config["limit.ops_per_second"] = "0"
+  config["limit.bytes_per_second"] = "0"
+  config["buffer.max_entries"] = "0"
+  config["hotkeys.capacity"] = "0"
+  config["default_codec"] = CODEC_NONE
+  return config
+
+#################################### benchmarks ####################################
+
+class _NullOutput(object):
+  def write(self, data):
+    pass
+
+def _codec_values(name, size):
+  """value of given size the codec can encode, None if size doesn't apply to the codec"""
+  if name in (CODEC_NONE, "RiverString", "RiverByteArray"):
+    return "a" * size
+  if name == "RiverList":
+    return json.dumps(range(size / 4))
+  if name == "RiverMap":
+    return json.dumps(dict(("k%d" % i, i) for i in range(size / 8)))
+  if size != SIZES[0]:
+    return None
+  return {"RiverInt": "123456", "RiverLong": "1234567890123", "RiverBoolean": "true"}[name]
+
+def _codec_benchmarks():
+  benchmarks = []
+  for name in KNOWN_CODECS:
+    codec = ispncon.codec.fromString(name)
+    if codec == None:
+      continue
+    for size in SIZES:
+      value = _codec_values(name, size)
+      if value == None:
+        continue
+      encoded = codec.encode(value)
+      decoded = codec.decode(encoded)
+      if isinstance(decoded, (list, dict)):
+        value_ok = decoded == json.loads(value)
+      elif isinstance(decoded, basestring):
+        value_ok = decoded == value
+      else:
+        value_ok = str(decoded).lower() == value
+      if not value_ok:
+        raise AssertionError("codec %s doesn't round trip value of size %d" % (name, size))
+      benchmarks.append(("codec.%s.encode.%d" % (name, size), lambda codec=codec, value=value: codec.encode(value)))
+      benchmarks.append(("codec.%s.decode.%d" % (name, size), lambda codec=codec, encoded=encoded: codec.decode(encoded)))
+  return benchmarks
+
+def _parse_benchmarks():
+  line = "put -l 3600 -e RiverString some_key 'some value with spaces'"
+  spec = ("i:v:l:I:ae:", ["input-filename=", "version=", "lifespan=", "max-idle=", "put-if-absent", "encode="])
+  tokens = shlex.split(line)[1:]
+  return [("parse.shlex", lambda: shlex.split(line)),
+          ("parse.getopt", lambda: getopt.getopt(tokens, spec[0], spec[1])),
+          ("parse.compile_line", lambda: compile_line(line))]
+
+def _client_benchmarks(servers):
+  benchmarks = []
+  for client_type, server in servers:
+    config = _loopback_config(client_type, server)
+    client = ispncon.client.fromString(config)
+    for size in SIZES:
+      value = "v" * size
+      key = "bench_%d" % size
+      client.put(key, value)
+      benchmarks.append(("client.%s.put.%d" % (client_type, size), lambda client=client, key=key, value=value: client.put(key, value)))
+      benchmarks.append(("client.%s.get.%d" % (client_type, size), lambda client=client, key=key: client.get(key)))
+    benchmarks.append(("client.%s.version" % client_type, lambda client=client: client.version("bench_16")))
+  return benchmarks
+
+def _execute_benchmarks(servers):
+  from ispncon.console import CommandExecutor
+  config = _loopback_config(*servers[0])
+  executor = CommandExecutor(config)
+  return [("execute.put", lambda: executor.execute("put some_key some_value")),
+          ("execute.get", lambda: executor.execute("get some_key")),
+          ("execute.get_version", lambda: executor.execute("get -v some_key"))]
+
+#################################### checks ####################################
+
+def _expect(condition, msg):
+  if not condition:
+    raise AssertionError(msg)
+
+def _loopback_session(servers, client_type, settings={}):
+  from ispncon.api import Session
+  config = _loopback_config(client_type, servers[client_type])
+  for key, value in settings.iteritems():
+    config[key] = value
+  return Session(config)
+
+def _check_sketch_exact(servers):
+  sketch = SpaceSavingSketch(10)
+  for i in xrange(5):
+    for j in xrange(i + 1):
+      sketch.offer("k%d" % i, 10)
+  _expect(sketch.top() == [("k%d" % i, i + 1, 0, 10 * (i + 1)) for i in xrange(4, -1, -1)], "top %r" % sketch.top())
+  _expect(sketch.top(2) == sketch.top()[:2], "top(2) isn't the head of top()")
+
+def _check_sketch_heavy_hitters(servers):
+  sketch = SpaceSavingSketch(8)
+  counts = {}
+  for i in xrange(5000):
+    key = "hot%d" % (i % 3) if i % 2 == 0 else "cold%d" % i
+    counts[key] = counts.get(key, 0) + 1
+    sketch.offer(key)
+  top = sketch.top(3)
+  _expect(sorted(key for key, count, error, nbytes in top) == ["hot0", "hot1", "hot2"], "top %r" % top)
+  for key, count, error, nbytes in sketch.top():
+    _expect(count - error <= counts[key] <= count, "%s counted %d, error %d, real %d" % (key, count, error, counts[key]))
+  sketch.reset()
+  _expect(sketch.top() == [], "reset sketch isn't empty")
+
+def _check_session_hotkeys(servers):
+  session = _loopback_session(servers, "memcached", {"hotkeys.capacity": "4"})
+  try:
+    session.put("a", "12345")
+    for i in xrange(3):
+      session.get("a")
+    session.put("b", "1")
+    top = session.hotkeys(1, reset=True)
+    _expect([(hot.key, hot.count, hot.error, hot.bytes) for hot in top] == [("a", 4, 0, 20)], "hotkeys %r" % top)
+    _expect(session.hotkeys() == [], "hotkeys not reset")
+  finally:
+    session.close()
+
+def _check_histogram(servers):
+  histogram = LogHistogram()
+  _expect(histogram.ranges() == [] and histogram.mean() == 0, "empty histogram")
+  for value in [0, 1, 2, 3, 4, 7, 8, 1000]:
+    histogram.add(value)
+  expected = [(0, 1, 1), (1, 2, 1), (2, 4, 2), (4, 8, 2), (8, 16, 1), (512, 1024, 1)]
+  _expect(histogram.ranges() == expected, "ranges %r" % histogram.ranges())
+  _expect((histogram.count, histogram.min, histogram.max) == (8, 0, 1000), "count, min, max")
+  _expect(histogram.mean() == 1025 / 8.0, "mean %r" % histogram.mean())
+
+def _check_session_sizes(servers):
+  for client_type in sorted(servers.keys()):
+    session = _loopback_session(servers, client_type)
+    try:
+      for size in [1, 5, 6, 100]:
+        session.put("size_%d" % size, "s" * size)
+      stats = session.sizes(["size_1", "size_5", "size_6", "size_100", "size_missing"], workers=2)
+      ranges = stats.histogram.ranges()
+      _expect(ranges == [(1, 2, 1), (4, 8, 2), (64, 128, 1)], "%s ranges %r" % (client_type, ranges))
+      _expect((stats.not_found, stats.errors) == (1, 0), "%s not found %d, errors %d" % (client_type, stats.not_found, stats.errors))
+    finally:
+      session.close()
+
+def _stored(server, prefix):
+  """number of entries in the loopback store whose key contains the prefix (hotrod keys are encoded)"""
+  return len([key for key in server.store.entries.keys() if prefix in key])
+
+def _check_chunking(servers):
+  for client_type in sorted(servers.keys()):
+    server = servers[client_type]
+    session = _loopback_session(servers, client_type, {"chunking.threshold": "10", "chunking.chunk_size": "4", "bulk.workers": "2"})
+    try:
+      big, bigger = "0123456789abcdef", "x" * 30
+      # the old value is only read when the key holds a chunked value (memcached reads the markers)
+      inner = session._get_client().client
+      gets = []
+      def counting_get(key, get_version=False, get=inner.get):
+        if not key.endswith(".__chunk.marker"):
+          gets.append(key)
+        return get(key, get_version)
+      inner.get = counting_get
+      session.put("chunked_plain", "short")
+      session.put("chunked_plain", "short")
+      session.put("chunked_a", big)
+      _expect(gets == [], "%s puts read old values of %r" % (client_type, gets))
+      _expect(_stored(server, "chunked_a") == 2 + 4, "%s stores %d entries for 4 chunks" % (client_type, _stored(server, "chunked_a")))
+      _expect(session.get("chunked_a") == big, "%s get of chunked value" % client_type)
+      del gets[:]
+      session.put("chunked_a", bigger)
+      _expect(gets == ["chunked_a"], "%s overwrite of chunked value read %r" % (client_type, gets))
+      _expect(_stored(server, "chunked_a") == 2 + 8, "%s overwrite leaves %d entries" % (client_type, _stored(server, "chunked_a")))
+      _expect(session.get("chunked_a") == bigger, "%s get of overwritten chunked value" % client_type)
+      session.put("chunked_a", "short")
+      _expect(_stored(server, "chunked_a") == 1, "%s short overwrite leaves %d entries" % (client_type, _stored(server, "chunked_a")))
+      _expect(session.get("chunked_a") == "short", "%s get of short value" % client_type)
+      results = list(session.put_many([("chunked_b", big), ("chunked_c", "short"), ("chunked_a", bigger)]))
+      _expect([error for key, result, error in results] == [None] * 3, "%s put_many %r" % (client_type, results))
+      values = dict((key, result) for key, result, error in session.get_many(["chunked_a", "chunked_b", "chunked_c"]))
+      _expect(values == {"chunked_a": bigger, "chunked_b": big, "chunked_c": "short"}, "%s get_many %r" % (client_type, values))
+      list(session.put_many([("chunked_b", "short")]))
+      _expect(_stored(server, "chunked_b") == 1, "%s short put_many overwrite leaves %d entries" % (client_type, _stored(server, "chunked_b")))
+      session.delete("chunked_plain")
+      session.delete("chunked_a")
+      results = list(session.delete_many(["chunked_b", "chunked_c"]))
+      _expect([error for key, result, error in results] == [None] * 2, "%s delete_many %r" % (client_type, results))
+      _expect(_stored(server, "chunked_") == 0, "%s deletes leave %d entries" % (client_type, _stored(server, "chunked_")))
+    finally:
+      session.close()
+
+def _loopback_client(servers, client_type, settings={}):
+  config = _loopback_config(client_type, servers[client_type])
+  for key, value in settings.iteritems():
+    config[key] = value
+  return ispncon.client.fromString(config)
+
+def _expect_error(error_type, operation, *args):
+  try:
+    operation(*args)
+  except error_type as e:
+    return e
+  raise AssertionError("%s%r didn't raise %s" % (operation.__name__, args, error_type.__name__))
+
+def _check_memcached_status(servers):
+  from ispncon.client import CacheClientError, ConflictError, NotFoundError
+  server = servers["memcached"]
+  client = _loopback_client(servers, "memcached")
+  try:
+    client.put("mc_a", "1")
+    version = client.get("mc_a", True)[0]
+    _expect_error(ConflictError, client.put, "mc_a", "2", version + 1) # EXISTS
+    _expect_error(ConflictError, client.put, "mc_a", "2", None, None, None, True) # NOT_STORED
+    _expect_error(NotFoundError, client.put, "mc_missing", "2", 1) # NOT_FOUND
+    client.put("mc_a", "2", version)
+    _expect(client.get("mc_a") == "2", "put with the right version")
+    server.max_value = 10
+    error = _expect_error(CacheClientError, client.put, "mc_big", "x" * 11)
+    _expect("SERVER_ERROR" in error.msg, "put of too large value: %s" % error.msg)
+    results = list(client.put_many([("mc_b", "b"), ("mc_big", "x" * 11), ("mc_c", "c")]))
+    _expect([(key, error == None) for key, result, error in results] == [("mc_b", True), ("mc_big", False), ("mc_c", True)],
+            "put_many results %r" % results)
+  finally:
+    server.max_value = 1024 * 1024
+    for key in ["mc_a", "mc_b", "mc_c"]:
+      server.store.remove(key)
+    client.close()
+
+def _check_memcached_noreply(servers):
+  server = servers["memcached"]
+  client = _loopback_client(servers, "memcached", {"memcached.noreply_bulk": "true", "memcached.pipeline_window": "3"})
+  entries = [("mc_nr_%d" % i, "v%d" % i) for i in xrange(10)]
+  entries[4] = ("mc_nr_4", "x" * 11)
+  try:
+    server.max_value = 10
+    results = list(client.put_many(entries))
+    _expect([key for key, result, error in results] == [key for key, value in entries], "put_many keys")
+    failed = [key for key, result, error in results if error != None]
+    _expect(failed == ["mc_nr_3", "mc_nr_4", "mc_nr_5"], "failed batch %r" % failed)
+    # the error replies were read, the next command gets its own reply
+    _expect(client.get("mc_nr_0") == "v0" and client.get("mc_nr_9") == "v9", "reply stream out of sync")
+    _expect(_stored(server, "mc_nr_") == 9, "noreply puts stored %d entries" % _stored(server, "mc_nr_"))
+  finally:
+    server.max_value = 1024 * 1024
+    for key, value in entries:
+      server.store.remove(key)
+    client.close()
+
+def _check_memcached_meta(servers):
+  from ispncon.client import NotFoundError
+  server = servers["memcached"]
+  client = _loopback_client(servers, "memcached", {"memcached.meta_commands": "auto"})
+  try:
+    client.put("mc_meta", "12345")
+    _expect(client._use_meta(), "meta commands not detected")
+    get = client.get
+    client.get = None # metadata operations mustn't transfer the value
+    _expect(client.version("mc_meta") == server.store.get("mc_meta")[0], "version")
+    _expect(client.size("mc_meta") == 5, "size")
+    client.exists("mc_meta")
+    _expect_error(NotFoundError, client.exists, "mc_missing")
+    _expect_error(NotFoundError, client.version, "mc_missing")
+    versions = list(client.versions(["mc_meta", "mc_missing"]))
+    _expect(versions == [("mc_meta", server.store.get("mc_meta")[0], None), ("mc_missing", None, None)], "versions %r" % versions)
+    client.get = get
+  finally:
+    server.store.remove("mc_meta")
+    client.close()
+
+def _check_memcached_incr(servers):
+  from ispncon.client import CacheClientError, NotFoundError
+  client = _loopback_client(servers, "memcached")
+  try:
+    client.put("mc_counter", "5")
+    _expect(client.incr("mc_counter", 3) == 8, "incr")
+    _expect(client.incr("mc_counter", -10) == 0, "decr doesn't stop at 0")
+    _expect(client.get("mc_counter") == "0", "stored counter")
+    _expect_error(NotFoundError, client.incr, "mc_missing")
+    client.put("mc_counter", "text")
+    _expect_error(CacheClientError, client.incr, "mc_counter")
+  finally:
+    client.delete("mc_counter")
+    client.close()
+
+def _check_memcached_touch(servers):
+  from ispncon.api import TOUCH_BATCH_SIZE
+  server = servers["memcached"]
+  session = _loopback_session(servers, "memcached")
+  keys = ["mc_touch_%d" % i for i in xrange(TOUCH_BATCH_SIZE + 5)]
+  try:
+    for key in keys[:-1]:
+      server.store.put(key, "v", None, False)
+    versions = [server.store.get(key)[0] for key in keys[:-1]]
+    del server.touches[:]
+    stats = session.touch_many(keys, 60, workers=2)
+    _expect((stats.touched, stats.not_found, stats.errors) == (len(keys) - 1, 1, []), "touch stats %r" % (stats,))
+    # native touch commands, no value is re-put
+    _expect(sorted(server.touches) == sorted((key, 60) for key in keys), "touch commands %r" % server.touches[:3])
+    _expect([server.store.get(key)[0] for key in keys[:-1]] == versions, "values re-put")
+  finally:
+    for key in keys:
+      server.store.remove(key)
+    session.close()
+
+def _check_session_watch(servers):
+  from ispncon.api import CREATED, CHANGED
+  server = servers["memcached"]
+  session = _loopback_session(servers, "memcached")
+  server.store.put("watched_a", "1")
+  # both entries change between two polls
+  writer = threading.Timer(0.2, lambda: [server.store.put("watched_a", "2"), server.store.put("watched_b", "1")])
+  writer.start()
+  try:
+    changes = list(session.watch(["watched_a", "watched_b"], 0.5, 0.5, 1, 5.0))
+    _expect([(change.kind, change.key) for change in changes] == [(CHANGED, "watched_a")], "watch -n 1 reported %r" % changes)
+    changes = list(session.watch(["watched_a", "watched_b"], 0.05, 0.05, None, 0.2))
+    _expect(changes == [], "changes without writes %r" % changes)
+    writer = threading.Timer(0.2, lambda: server.store.put("watched_c", "1"))
+    writer.start()
+    changes = list(session.watch(["watched_c"], 0.05, 0.05, 1, 5.0))
+    _expect([(change.kind, change.key) for change in changes] == [(CREATED, "watched_c")], "watch of created entry %r" % changes)
+  finally:
+    writer.join()
+    for key in ["watched_a", "watched_b", "watched_c"]:
+      server.store.remove(key)
+    session.close()
+
+def _check_session_update(servers):
+  from ispncon.client import CacheClientError, ConflictError, NotFoundError
+  for client_type in ["hotrod", "rest"]:
+    session = _loopback_session(servers, client_type)
+    other = _loopback_client(servers, client_type)
+    try:
+      session.put("update_counter", "5")
+      _expect(session.incr("update_counter", 3) == 8, "%s incr" % client_type)
+      _expect(session.incr("update_counter", -10) == -2, "%s decr" % client_type)
+      _expect_error(NotFoundError, session.incr, "update_missing")
+      # a write between the read and the versioned put makes the update start over
+      seen = []
+      def transform(value):
+        seen.append(value)
+        if len(seen) == 1:
+          other.put("update_counter", "100")
+        return value + "x"
+      _expect(session.update("update_counter", transform) == "100x", "%s update result" % client_type)
+      _expect(seen == ["-2", "100"] and session.get("update_counter") == "100x", "%s update saw %r" % (client_type, seen))
+      del seen[:]
+      _expect_error(ConflictError, session.update, "update_counter", transform, 0)
+      session.put("update_counter", "text")
+      _expect_error(CacheClientError, session.incr, "update_counter")
+    finally:
+      other.delete("update_counter")
+      other.close()
+      session.close()
+  # concurrent increments aren't lost
+  session = _loopback_session(servers, "hotrod")
+  session.put("update_counter", "0")
+  sessions = [_loopback_session(servers, "hotrod") for i in xrange(4)]
+  def increment(session):
+    for i in xrange(25):
+      session.incr("update_counter", 1, 100)
+  threads = [threading.Thread(target=increment, args=(s,)) for s in sessions]
+  try:
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    _expect(session.get("update_counter") == "100", "concurrent incr result %s" % session.get("update_counter"))
+  finally:
+    session.delete("update_counter")
+    for s in sessions + [session]:
+      s.close()
+
+def _check_session_checksum(servers):
+  from ispncon.stats import entry_hash, key_bucket, DIGEST_MASK
+  server = servers["memcached"]
+  session = _loopback_session(servers, "memcached")
+  entries = [("checksum_%d" % i, "value_%d" % i) for i in xrange(50)]
+  keys = [key for key, value in entries]
+  try:
+    for key, value in entries:
+      server.store.put(key, value)
+    result = session.checksum(keys + ["checksum_missing"], 3, 4)
+    expected = sum(entry_hash(key, value) for key, value in entries) & DIGEST_MASK
+    _expect((result.digest.count, result.digest.digest) == (50, expected), "digest %r" % ((result.digest.count, result.digest.digest),))
+    _expect((result.not_found, result.errors) == (1, 0), "not found %d, errors %d" % (result.not_found, result.errors))
+    _expect(sum(count for count, digest in result.digest.buckets) == 50, "bucket counts %r" % result.digest.buckets)
+    # the digest doesn't depend on the order, one changed entry changes just its bucket
+    server.store.put("checksum_7", "changed")
+    changed = session.checksum(list(reversed(keys)), 2, 4)
+    bucket = key_bucket("checksum_7", 4)
+    differ = [i for i in xrange(4) if changed.digest.buckets[i] != result.digest.buckets[i]]
+    _expect(differ == [bucket] and changed.digest.digest != result.digest.digest, "changed buckets %r" % differ)
+    single = session.checksum(keys, 1, 4, bucket)
+    _expect(("checksum_7", entry_hash("checksum_7", "changed")) in single.entries, "entries of bucket %d" % bucket)
+    _expect(all(key_bucket(key, 4) == bucket for key, ehash in single.entries), "entries of other buckets")
+    _expect(single.digest.buckets[bucket] == changed.digest.buckets[bucket], "single bucket digest")
+  finally:
+    for key in keys:
+      server.store.remove(key)
+    session.close()
+
+def _check_transport(servers):
+  from ispncon.client import CacheClientError
+  from ispncon.transport import TransportError, fromConfig, resolve
+  config = _loopback_config("memcached", servers["memcached"])
+  config["transport.keepalive"] = "true"
+  config["transport.send_buffer"] = "65536"
+  config["transport.read_timeout"] = "2.5"
+  sock = fromConfig(config).connect("127.0.0.1", config["port"])
+  try:
+    _expect(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) != 0, "TCP_NODELAY isn't set")
+    _expect(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) != 0, "SO_KEEPALIVE isn't set")
+    _expect(sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536, "SO_SNDBUF isn't set")
+    _expect(sock.gettimeout() == 2.5, "read timeout %r" % sock.gettimeout())
+  finally:
+    sock.close()
+  config["transport.send_buffer"] = "big"
+  _expect_error(TransportError, fromConfig, config)
+  _expect(resolve("localhost", 1) is resolve("localhost", 1), "resolved address isn't cached")
+  # a server that accepts connections and never replies
+  silent = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  silent.bind(("127.0.0.1", 0))
+  silent.listen(1)
+  config = _loopback_config("memcached", servers["memcached"])
+  config["port"] = str(silent.getsockname()[1])
+  config["transport.read_timeout"] = "0.2"
+  client = ispncon.client.fromString(config)
+  try:
+    start = time.time()
+    _expect_error(CacheClientError, client.get, "transport_key")
+    _expect(time.time() - start < 2.0, "read timeout took %.1fs" % (time.time() - start))
+  finally:
+    client.close()
+    silent.close()
+  path = tempfile.mktemp(prefix="ispncon_check_")
+  server = _LoopbackServer(_UnixMemcachedHandler, path)
+  config = _loopback_config("memcached", servers["memcached"])
+  config["host"] = "unix:" + path
+  client = ispncon.client.fromString(config)
+  try:
+    client.put("transport_key", "over unix socket")
+    _expect(server.store.get("transport_key")[1] == "over unix socket", "put over unix socket")
+    _expect(client.get("transport_key") == "over unix socket", "get over unix socket")
+  finally:
+    client.close()
+    server.close()
+    os.remove(path)
+
+class _RecordingLimiter(object):
+  """limiter recording the (ops, bytes) acquired instead of waiting"""
+  def __init__(self):
+    self.acquired = []
+
+  def active(self):
+    return True
+
+  def acquire(self, ops=1, nbytes=0):
+    self.acquired.append((ops, nbytes))
+
+def _check_limited_update(servers):
+  from ispncon.ratelimit import LimitedClient
+  limiter = _RecordingLimiter()
+  client = _loopback_client(servers, "memcached")
+  limited = LimitedClient(client, limiter)
+  try:
+    limited.put("limited_a", "12345")
+    _expect(limiter.acquired == [(1, 5)], "put acquired %r" % limiter.acquired)
+    del limiter.acquired[:]
+    _expect(limited.update("limited_a", lambda value: value + "678") == "12345678", "updated value")
+    # the old value is read, the new one written
+    _expect(limiter.acquired == [(2, 5 + 8)], "update acquired %r" % limiter.acquired)
+    del limiter.acquired[:]
+    limited.touch("limited_a", 60)
+    _expect(limiter.acquired == [(1, 0)], "touch acquired %r" % limiter.acquired)
+  finally:
+    client.delete("limited_a")
+    client.close()
+
+def _check_metadata_only(servers):
+  from ispncon.client import NotFoundError
+  value = "v" * 10000
+  for client_type in ["rest", "hotrod"]:
+    server = servers[client_type]
+    client = _loopback_client(servers, client_type)
+    try:
+      client.put("metadata_key", value)
+      del server.requests[:]
+      client.exists("metadata_key")
+      _expect_error(NotFoundError, client.exists, "metadata_missing")
+      if client_type == "rest":
+        _expect(client.version("metadata_key") == hashlib.md5(value).hexdigest(), "rest version")
+        _expect(client.size("metadata_key") == len(value), "rest size")
+        _expect([version for key, version, error in client.versions(["metadata_key", "metadata_missing"])] ==
+                [hashlib.md5(value).hexdigest(), None], "rest versions")
+      # no request transfers the value
+      methods = set(method for method, key in server.requests)
+      _expect(methods == (set(["HEAD"]) if client_type == "rest" else set([0x0F])), "%s requests %r" % (client_type, methods))
+    finally:
+      client.delete("metadata_key")
+      client.close()
+  # without meta commands memcached falls back to gets
+  client = _loopback_client(servers, "memcached", {"memcached.meta_commands": "false"})
+  try:
+    client.put("metadata_key", "12345")
+    _expect(not client._use_meta(), "meta commands used")
+    _expect(client.version("metadata_key") == servers["memcached"].store.get("metadata_key")[0], "memcached version")
+    _expect(client.size("metadata_key") == 5, "memcached size")
+    _expect_error(NotFoundError, client.exists, "metadata_missing")
+  finally:
+    client.delete("metadata_key")
+    client.close()
+
+def _check_client_cache(servers):
+  from ispncon.client import ClientCache
+  server = servers["memcached"]
+  config = _loopback_config("memcached", server)
+  window = lambda size, **settings: dict(config, **dict(settings, **{"memcached.pipeline_window": size}))
+  cache = ClientCache(2, 0)
+  try:
+    a = cache.get(window("1"))
+    b = cache.get(window("2"))
+    _expect(cache.get(window("1")) is a, "client isn't reused")
+    # session settings don't need another client
+    _expect(cache.get(window("1", **{"limit.ops_per_second": "10"})) is a, "limit.* created a client")
+    cache.get(window("3"))
+    _expect(cache.get(window("1")) is a, "recently used client evicted")
+    _expect(cache.get(window("2")) is not b, "least recently used client not evicted")
+  finally:
+    cache.close()
+  cache = ClientCache(8, 0.05)
+  try:
+    a = cache.get(window("1"))
+    cache.get(window("2"))
+    time.sleep(0.1)
+    _expect(cache.get(window("1")) is not a, "idle client reused")
+  finally:
+    cache.close()
+  # switching hosts back and forth doesn't open new connections
+  session = _loopback_session(servers, "memcached")
+  try:
+    session.put("client_cache_key", "a")
+    session.configure("host", "localhost")
+    session.get("client_cache_key")
+    connections = len(server.handlers)
+    for i in xrange(5):
+      for host in ["127.0.0.1", "localhost"]:
+        session.configure("host", host)
+        session.get("client_cache_key")
+    _expect(len(server.handlers) == connections, "%d new connections" % (len(server.handlers) - connections))
+  finally:
+    server.store.remove("client_cache_key")
+    session.close()
+
+def _check_delete_many(servers):
+  from ispncon.client import NotFoundError
+  keys = ["mdelete_%d" % i for i in xrange(20)]
+  settings = {"memcached": {"memcached.noreply_bulk": "true", "memcached.pipeline_window": "4"},
+              "rest": {"rest.pipeline_window": "4"}, "hotrod": {}}
+  for client_type in sorted(servers.keys()):
+    client = _loopback_client(servers, client_type, settings[client_type])
+    try:
+      for key in keys[:15]:
+        client.put(key, "v")
+      results = list(client.delete_many(keys))
+      _expect([key for key, result, error in results] == keys, "%s delete_many keys" % client_type)
+      outcome = [error == None or type(error).__name__ for key, result, error in results]
+      _expect(outcome == [True] * 15 + [NotFoundError.__name__] * 5, "%s delete_many results %r" % (client_type, outcome))
+      _expect(_stored(servers[client_type], "mdelete_") == 0, "%s entries left" % client_type)
+      # the replies were all read
+      client.put("mdelete_0", "after")
+      _expect(client.get("mdelete_0") == "after", "%s reply stream out of sync" % client_type)
+    finally:
+      for key in keys:
+        servers[client_type].store.remove(key)
+      client.close()
+  from ispncon.console import CommandExecutor
+  from ispncon.shard import _capture
+  server = servers["memcached"]
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  executor = CommandExecutor(_loopback_config("memcached", server))
+  try:
+    os.write(fd, "".join(key + "\n" for key in keys[:10]))
+    os.close(fd)
+    for key in keys[:15]:
+      server.store.put(key, "v")
+    output = _capture(executor.execute, "mdelete -f %s" % path)
+    _expect(output == "DELETED 10\nNOT_FOUND 0\nERRORS 0\n", "mdelete -f output %r" % output)
+    output = _capture(executor.execute, "mdelete %s" % " ".join(keys[5:]))
+    _expect(output == "DELETED 5\nNOT_FOUND 10\nERRORS 0\n", "mdelete output %r" % output)
+  finally:
+    executor.close()
+    os.remove(path)
+    for key in keys:
+      server.store.remove(key)
+
+def _check_rest_encoding(servers):
+  from StringIO import StringIO
+  server = servers["rest"]
+  value = "compressible value " * 100
+  keys = ["encoded_%d" % i for i in xrange(3)]
+  for encoding in ["gzip", "deflate", None]:
+    client = _loopback_client(servers, "rest", {"rest.compress_threshold": "1000", "rest.pipeline_window": "2"})
+    try:
+      server.response_encoding = encoding
+      del server.request_encodings[:]
+      client.put(keys[0], value)
+      client.put(keys[1], "short")
+      list(client.put_many([(keys[2], value)]))
+      _expect(server.request_encodings == ["gzip", None, "gzip"], "request encodings %r" % server.request_encodings)
+      stored = [entry[1] for path, entry in server.store.entries.items() if path.endswith("/" + keys[0])]
+      _expect(stored == [value], "compressed put stored %r" % stored)
+      _expect(client.get(keys[0]) == value and client.get(keys[1]) == "short", "%s get" % encoding)
+      _expect(client.get(keys[0], True)[1] == value, "%s get with version" % encoding)
+      values = [result for key, result, error in client.get_many(keys)]
+      _expect(values == [value, "short", value], "%s get_many %r" % (encoding, values))
+      out = StringIO()
+      _expect(client.get_into(keys[2], out) == len(value) and out.getvalue() == value, "%s get_into" % encoding)
+    finally:
+      server.response_encoding = None
+      client.close()
+  client = _loopback_client(servers, "rest", {"rest.accept_encoding": "identity"})
+  try:
+    server.response_encoding = "gzip"
+    _expect(client.get(keys[0]) == value, "identity get")
+    list(client.delete_many(keys))
+  finally:
+    server.response_encoding = None
+    client.close()
+
+def _check_hotrod_failover(servers):
+  live = servers["hotrod"]
+  dead_port = _free_port() # nothing listens there
+  client = _loopback_client(servers, "hotrod", {"hotrod.servers": "127.0.0.1:%d,127.0.0.1:%d" % (dead_port, live.server_address[1]),
+                                                "hotrod.retry_interval": "60"})
+  try:
+    for i in xrange(4):
+      client.put("failover_%d" % i, "v")
+      _expect(client.get("failover_%d" % i) == "v", "get after failover")
+    pool = client.remote_cache
+    _expect(pool.servers[0].dead_until > time.time() and pool.servers[1].dead_until == 0, "dead server isn't marked")
+    _expect(client.retries == 1, "dead server tried %d times" % client.retries)
+  finally:
+    client.close()
+  # a second node of the "cluster" (same store) crashes while the client holds connections to it
+  second = _LoopbackServer(_HotRodHandler)
+  second.store = live.store
+  client = _loopback_client(servers, "hotrod", {"hotrod.servers": "127.0.0.1:%d,127.0.0.1:%d" % (live.server_address[1], second.server_address[1]),
+                                                "hotrod.retry_interval": "60"})
+  try:
+    for i in xrange(4):
+      client.put("failover_%d" % i, "w")
+    _expect(len(second.handlers) == 1, "round robin didn't use the second server")
+    second.close()
+    for i in xrange(4):
+      _expect(client.get("failover_%d" % i) == "w", "get after the crash")
+    _expect(client.retries == 1, "crashed server tried %d times" % client.retries)
+    for i in xrange(4):
+      client.delete("failover_%d" % i)
+  finally:
+    second.close()
+    client.close()
+
+def _check_rest_pipelining(servers):
+  server = servers["rest"]
+  keys = ["pipelined_%d" % i for i in xrange(10)]
+  for window in ["1", "3"]:
+    config = _loopback_config("rest", server)
+    config["rest.pipeline_window"] = window
+    client = ispncon.client.fromString(config)
+    try:
+      connections = len(server.handlers)
+      results = list(client.put_many((key, key * 100) for key in keys))
+      _expect(results == [(key, None, None) for key in keys], "window %s put_many %r" % (window, results))
+      asked = ["pipelined_missing"] + keys[:5] + ["pipelined_missing2"] + keys[5:]
+      results = list(client.get_many(asked))
+      _expect([key for key, result, error in results] == asked, "window %s get_many out of order" % window)
+      for key, result, error in results:
+        if "missing" in key:
+          _expect(isinstance(error, ispncon.client.NotFoundError), "window %s %s: %r" % (window, key, error))
+        else:
+          _expect(error == None and result == key * 100, "window %s %s: %r" % (window, key, error))
+      results = list(client.delete_many(keys + ["pipelined_missing"]))
+      _expect([error for key, result, error in results[:-1]] == [None] * len(keys), "window %s delete_many" % window)
+      _expect(_stored(server, "pipelined_") == 0, "window %s deletes leave entries" % window)
+      _expect(len(server.handlers) - connections <= 1, "window %s opened %d connections" % (window, len(server.handlers) - connections))
+    finally:
+      client.close()
+
+def _expect_codec_error(codec_name, operation, value):
+  codec = ispncon.codec.fromString(codec_name)
+  try:
+    getattr(codec, operation)(value)
+  except CodecError:
+    return
+  raise AssertionError("%s %s of %r didn't fail" % (codec_name, operation, value))
+
+def _check_river_codecs(servers):
+  values = [("RiverInt", -2147483648), ("RiverInt", 2147483647), ("RiverLong", -9223372036854775808L),
+            ("RiverLong", 9223372036854775807L), ("RiverBoolean", True), ("RiverBoolean", False),
+            ("RiverList", []), ("RiverList", [1, 2147483648L, -1.5, None, True, "a", u"\u017elu\u0165", "a", [], {}]),
+            ("RiverList", [["x"] * 3, {"k": ["x", "y"]}, "y" * 70000]),
+            ("RiverMap", {}), ("RiverMap", {"a": 1, "b": {"c": [1, 2]}, "d": "a", "e": "a"})]
+  for name, value in values:
+    codec = ispncon.codec.fromString(name)
+    decoded = codec.decode(codec.encode(value))
+    # JSON tells booleans from numbers, int and long print the same
+    _expect(json.dumps(decoded, sort_keys=True) == json.dumps(value, sort_keys=True), "%s round trip of %r gives %r" % (name, value, decoded))
+  _expect(ispncon.codec.fromString("RiverMap").decode(ispncon.codec.fromString("RiverMap").encode('{"a": [1]}')) == {"a": [1]}, "RiverMap from JSON")
+  for name, value in [("RiverInt", "2147483648"), ("RiverInt", "x"), ("RiverLong", "9223372036854775808"),
+                      ("RiverBoolean", "yes"), ("RiverList", "{}"), ("RiverList", "[1"), ("RiverMap", "[]")]:
+    _expect_codec_error(name, "encode", value)
+  int_bytes = ispncon.codec.fromString("RiverInt").encode("1")
+  list_bytes = ispncon.codec.fromString("RiverList").encode("[1, 2]")
+  for name, value in [("RiverLong", int_bytes), ("RiverBoolean", int_bytes), ("RiverMap", list_bytes),
+                      ("RiverList", list_bytes[:-1]), ("RiverList", "\x02" + list_bytes[1:])]:
+    _expect_codec_error(name, "decode", value)
+
+def _check_session_codecs(servers):
+  session = _loopback_session(servers, "hotrod")
+  try:
+    session.put("codec_list", "[1, \"a\", {\"b\": false}]", codec="RiverList")
+    _expect(session.get("codec_list", codec="RiverList") == [1, "a", {"b": False}], "RiverList through hotrod")
+    session.put("codec_int", "42", codec="RiverInt")
+    _expect(session.get("codec_int", codec="RiverInt") == 42, "RiverInt through hotrod")
+  finally:
+    session.close()
+
+def _wait_for(condition, timeout=5.0):
+  deadline = time.time() + timeout
+  while not condition() and time.time() < deadline:
+    time.sleep(0.01)
+  return condition()
+
+def _check_write_behind(servers):
+  server = servers["memcached"]
+  config = _loopback_config("memcached", server)
+  buf = WriteBehindBuffer(config, 100, 60.0)
+  try:
+    buf.put("buffered_a", "1")
+    buf.put("buffered_b", "1")
+    buf.put("buffered_a", "2")
+    _expect(buf.contains("buffered_a") and server.store.get("buffered_a") == None, "put written before flush")
+    buf.flush()
+    _expect(not buf.contains("buffered_a"), "flushed key still buffered")
+    _expect(buf.take_results() == (2, []), "coalesced puts of one key aren't written once")
+    _expect(server.store.get("buffered_a")[1] == "2", "last buffered value isn't the one written")
+  finally:
+    buf.close()
+  buf = WriteBehindBuffer(config, 3, 60.0)
+  try:
+    for i in xrange(3):
+      buf.put("buffered_full_%d" % i, "v")
+    _expect(_wait_for(lambda: server.store.get("buffered_full_2") != None), "full buffer isn't written")
+  finally:
+    buf.close()
+  buf = WriteBehindBuffer(config, 100, 0.05)
+  try:
+    buf.put("buffered_timed", "v")
+    _expect(_wait_for(lambda: server.store.get("buffered_timed") != None), "buffer isn't written after flush_interval")
+  finally:
+    buf.close()
+  config["port"] = "1" # nothing listens there
+  buf = WriteBehindBuffer(config, 100, 60.0)
+  buf.put("buffered_failed", "v")
+  buf.close()
+  written, errors = buf.take_results()
+  _expect(written == 0 and [key for key, error in errors] == ["buffered_failed"], "failed write %r" % errors)
+
+def _check_session_write_behind(servers):
+  for client_type in sorted(servers.keys()):
+    server = servers[client_type]
+    session = _loopback_session(servers, client_type, {"buffer.max_entries": "100", "buffer.flush_interval": "60"})
+    try:
+      session.put("buffered_s", "1")
+      session.put("buffered_s", "2")
+      _expect(_stored(server, "buffered_s") == 0, "%s put written before flush" % client_type)
+      _expect(session.get("buffered_s") == "2", "%s get doesn't read the buffered put" % client_type)
+      session.put("buffered_t", "3")
+      # the put written for the get is reported too
+      _expect(session.flush() == (2, []), "%s flush doesn't report the buffered puts" % client_type)
+      session.put("buffered_u", "4")
+      _expect(session.close() == (1, []), "%s close doesn't write out the buffer" % client_type)
+    finally:
+      session.close()
+    _expect(_stored(server, "buffered_u") == 1, "%s buffered put lost on close" % client_type)
+
+def _include_output(servers, path, jobs):
+  from ispncon.console import CommandExecutor
+  from ispncon.shard import _capture
+  config = _loopback_config("hotrod", servers["hotrod"])
+  config["hotkeys.capacity"] = "100"
+  executor = CommandExecutor(config)
+  try:
+    return _capture(executor.execute, "include -j %d %s" % (jobs, path))
+  finally:
+    executor.close()
+
+def _check_sharded_include(servers):
+  lines = []
+  for i in xrange(20):
+    lines.append("put sharded_%d value_%d" % (i, i))
+    lines.extend(["get sharded_%d" % i] * i)
+  lines += ["put sharded_counter 0"] + ["incr sharded_counter"] * 5 + ["get sharded_counter", "hotkeys 5", "exists sharded_3"]
+  lines += ["delete sharded_%d" % i for i in xrange(0, 20, 2)] + ["get sharded_4", "exists sharded_4", "delete sharded_counter"]
+  lines += ["delete sharded_%d" % i for i in xrange(1, 20, 2)]
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  try:
+    os.write(fd, "".join(line + "\n" for line in lines))
+    os.close(fd)
+    serial = _include_output(servers, path, 1)
+    _expect(serial.count("\n") > len(lines) and not "ERROR" in serial, "serial include output %r" % serial)
+    for jobs in [2, 3]:
+      sharded = _include_output(servers, path, jobs)
+      _expect(sharded == serial, "include -j %d output differs:\n%s" % (jobs, sharded))
+    f = open(path, "w")
+    try:
+      f.write("bloom -i\n")
+    finally:
+      f.close()
+    refused = _include_output(servers, path, 2)
+    _expect(refused.startswith("ERROR bloom -i can't be used with include -j"), "bloom -i in include -j: %r" % refused)
+  finally:
+    os.remove(path)
+  _expect(_stored(servers["hotrod"], "sharded_") == 0, "entries left by the include")
+
+def _check_sharded_bloom(servers):
+  # the keys are written by another client, only a rebuilt filter knows them
+  keys = ["sharded_bloom_%d" % i for i in xrange(10)]
+  client = _loopback_client(servers, "hotrod")
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  os.close(fd)
+  bloom_path = path + ".bloom"
+  try:
+    for key in keys:
+      client.put(key, "v")
+    f = open(path, "w")
+    try:
+      f.write("config bloom.file %s\nbloom -n 100 %s\n" % (bloom_path, " ".join(keys)))
+      f.write("".join("get %s\n" % key for key in keys))
+    finally:
+      f.close()
+    outputs = []
+    for jobs in [1, 2]:
+      # the workers start with an outdated filter of no keys
+      session = _loopback_session(servers, "hotrod", {"bloom.file": bloom_path})
+      session.build_bloom([])
+      session.close()
+      outputs.append(_include_output(servers, path, jobs))
+    _expect(outputs[0].splitlines().count("v") == len(keys) and not "NOT_FOUND" in outputs[0], "serial include output %r" % outputs[0])
+    _expect(outputs[1] == outputs[0], "include -j 2 output differs:\n%s" % outputs[1])
+  finally:
+    for key in keys:
+      client.delete(key)
+    client.close()
+    for name in [path, bloom_path]:
+      if os.path.exists(name):
+        os.remove(name)
+
+def _check_compiled_include(servers):
+  from ispncon.script import ParsedArgs, ScriptCache
+  op = compile_line("put -l 60 'key with spaces' value\n")
+  _expect(op.cmd == "put" and op.args.opts == [("-l", "60")] and op.args.args == ["key with spaces", "value"], "compiled put")
+  _expect(list(op.args) == ["-l", "60", "key with spaces", "value"], "tokens of compiled put")
+  _expect(isinstance(compile_line("put -x key value").args, ParsedArgs) and compile_line("put -x key value").args.error != None,
+          "wrong option isn't recorded")
+  _expect(compile_line("put 'unterminated").error != None, "tokenizing error isn't recorded")
+  _expect(compile_line("   \n") == None and compile_line("exists key").args == ["key"], "plain commands")
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  try:
+    os.write(fd, "put compiled_a 1\n\nget compiled_a\n")
+    os.close(fd)
+    cache = ScriptCache()
+    operations, lines = cache.compile(path)
+    _expect(lines == 3 and [op.cmd for op in operations] == ["put", "get"], "compiled %d lines" % lines)
+    _expect(cache.compile(path) == (operations, 0), "cached script compiled again")
+    f = open(path, "a")
+    try:
+      f.write("delete compiled_a\n")
+    finally:
+      f.close()
+    operations, lines = cache.compile(path)
+    _expect(lines == 4 and operations[-1].cmd == "delete", "changed script isn't compiled again")
+    # the second include replays the cached operations
+    from ispncon.console import CommandExecutor
+    from ispncon.shard import _capture
+    from StringIO import StringIO
+    executor = CommandExecutor(_loopback_config("hotrod", servers["hotrod"]))
+    stderr = sys.stderr
+    sys.stderr = stats = StringIO()
+    try:
+      outputs = [_capture(executor.execute, "include -s %s" % path) for i in xrange(2)]
+    finally:
+      sys.stderr = stderr
+      executor.close()
+    _expect(outputs[0] == outputs[1] == "STORED\n1\nDELETED\n", "include outputs %r" % outputs)
+    parse_stats = [line for line in stats.getvalue().splitlines() if line.startswith("PARSE")]
+    _expect(len(parse_stats) == 2 and parse_stats[0].startswith("PARSE 4 lines") and parse_stats[1] == "PARSE cached",
+            "include stats %r" % parse_stats)
+  finally:
+    os.remove(path)
+
+def _check_bloom_filter(servers):
+  bloom = ispncon.bloom.for_capacity(1000, 0.01, "target")
+  for i in xrange(1000):
+    bloom.add("in_%d" % i)
+  _expect(not [i for i in xrange(1000) if not "in_%d" % i in bloom], "false negatives")
+  false_positives = len([i for i in xrange(10000) if "out_%d" % i in bloom])
+  _expect(false_positives < 300, "%d false positives in 10000, expected about 100" % false_positives)
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  os.close(fd)
+  try:
+    bloom.save(path)
+    loaded = ispncon.bloom.load(path)
+    _expect((loaded.bits, loaded.hashes, loaded.target, loaded.count, loaded.data) ==
+            (bloom.bits, bloom.hashes, bloom.target, bloom.count, bloom.data), "loaded filter differs")
+    # two processes adding their keys to the same file keep each other's keys
+    first, second = ispncon.bloom.load(path), ispncon.bloom.load(path)
+    first.add("first")
+    first.save(path, ["first"])
+    second.add("second")
+    saved = second.save(path, ["second"])
+    loaded = ispncon.bloom.load(path)
+    _expect("first" in saved and "first" in loaded and "second" in loaded, "keys of concurrent saves lost")
+    _expect(loaded.count == 1002, "count %d of the merged filter" % loaded.count)
+    for content in ["garbage\n", '{"format": "ispncon-bloom-1", "bits": 64, "hashes": 1, "target": "", "count": 0}\n1234']:
+      f = open(path, "wb")
+      try:
+        f.write(content)
+      finally:
+        f.close()
+      try:
+        ispncon.bloom.load(path)
+        raise AssertionError("loaded %r" % content)
+      except ValueError:
+        pass
+  finally:
+    for leftover in [path, path + ".lock"]:
+      if os.path.exists(leftover):
+        os.remove(leftover)
+
+def _check_session_bloom(servers):
+  from ispncon.api import SessionError
+  from ispncon.client import NotFoundError
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  os.close(fd)
+  os.remove(path)
+  settings = {"bloom.file": path, "bloom.capacity": "100"}
+  try:
+    session = _loopback_session(servers, "memcached", settings)
+    try:
+      session.put("bloom_a", "a")
+      info = session.build_bloom(["bloom_a"])
+      _expect((info.keys, info.skipped) == (1, 0), "built filter %r" % (info,))
+      servers["memcached"].store.put("bloom_b", "b") # written by someone else after the build
+      try:
+        session.get("bloom_b")
+        raise AssertionError("get of a key missing in the filter went to the cache")
+      except NotFoundError:
+        pass
+      _expect(not session.exists("bloom_b") and session.exists("bloom_a"), "exists with the filter")
+      session.put("bloom_c", "c")
+      _expect(session.get("bloom_c") == "c", "key put by the session isn't in the filter")
+      _expect(session.bloom_info().skipped == 2, "skipped lookups %d" % session.bloom_info().skipped)
+    finally:
+      session.close()
+    session = _loopback_session(servers, "memcached", settings)
+    try:
+      _expect(session.get("bloom_c") == "c" and session.bloom_info().keys == 2, "saved filter lost the put key")
+      session.configure("port", str(servers["hotrod"].server_address[1]))
+      session.configure("client_type", "hotrod")
+      try:
+        session.bloom_info()
+        raise AssertionError("filter of another cache used")
+      except SessionError:
+        pass
+    finally:
+      session.close()
+  finally:
+    for leftover in [path, path + ".lock"]:
+      if os.path.exists(leftover):
+        os.remove(leftover)
+    for key in ["bloom_a", "bloom_b", "bloom_c"]:
+      servers["memcached"].store.remove(key)
+
+_SAMPLE = re.compile(r'^([a-z_]+)\{((?:[a-z_]+="(?:[^"\\]|\\.)*",?)*)\} ([0-9.e+-]+)$')
+
+def _parse_metrics(text):
+  """{(sample name, labels string): value} of OpenMetrics text, fails on malformed lines"""
+  lines = text.split("\n")
+  _expect(lines[-2:] == ["# EOF", ""], "exposition doesn't end with # EOF")
+  samples = {}
+  for line in lines[:-2]:
+    if line.startswith("# TYPE ") or line.startswith("# HELP "):
+      continue
+    match = _SAMPLE.match(line)
+    _expect(match != None, "malformed line %r" % line)
+    samples[(match.group(1), match.group(2))] = float(match.group(3))
+  return samples
+
+def _check_metrics_format(servers):
+  metrics = MetricsRegistry()
+  labels = (("client", "rest"), ("operation", "get"))
+  metrics.inc("ispncon_operations", labels, 3)
+  metrics.inc("ispncon_errors", labels + (("error", 'odd "error"\\\n'),))
+  for seconds in [0.00005, 0.003, 0.003, 20.0]:
+    metrics.observe(labels, seconds)
+  text = metrics.render()
+  samples = _parse_metrics(text)
+  _expect(samples[("ispncon_operations_total", 'client="rest",operation="get"')] == 3, "operations counter")
+  _expect(('ispncon_errors_total', 'client="rest",operation="get",error="odd \\"error\\"\\\\\\n"') in samples, "label escaping %r" % text)
+  buckets = [samples[("ispncon_operation_duration_seconds_bucket", 'client="rest",operation="get",le="%r"' % bound)] for bound in LATENCY_BUCKETS]
+  _expect(buckets == sorted(buckets) and buckets[0] == 1 and buckets[-1] == 3, "buckets aren't cumulative %r" % buckets)
+  _expect(samples[("ispncon_operation_duration_seconds_bucket", 'client="rest",operation="get",le="+Inf"')] == 4, "+Inf bucket")
+  _expect(samples[("ispncon_operation_duration_seconds_count", 'client="rest",operation="get"')] == 4, "histogram count")
+  _expect(abs(samples[("ispncon_operation_duration_seconds_sum", 'client="rest",operation="get"')] - 20.00605) < 1e-9, "histogram sum")
+  for name in ["ispncon_operations", "ispncon_errors", "ispncon_sent_bytes", "ispncon_received_bytes", "ispncon_retries"]:
+    _expect("# TYPE %s counter\n" % name in text, "no TYPE of %s" % name)
+  _expect("# TYPE ispncon_operation_duration_seconds histogram\n" in text, "no TYPE of the histogram")
+
+def _free_port():
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  try:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+  finally:
+    sock.close()
+
+def _check_session_metrics(servers):
+  from ispncon.client import NotFoundError
+  fd, path = tempfile.mkstemp(prefix="ispncon_check_")
+  os.close(fd)
+  port = _free_port()
+  settings = {"metrics.file": path, "metrics.port": str(port), "metrics.host": "127.0.0.1", "metrics.interval": "60"}
+  session = _loopback_session(servers, "memcached", settings)
+  try:
+    session.put("metrics_a", "12345")
+    session.put("metrics_a", "123")
+    _expect(session.get("metrics_a") == "123", "get")
+    try:
+      session.get("metrics_missing")
+    except NotFoundError:
+      pass
+    list(session.get_many(["metrics_a", "metrics_missing"]))
+    resp = urllib2.urlopen("http://127.0.0.1:%d/metrics" % port)
+    try:
+      _expect(resp.info().getheader("Content-Type").startswith("application/openmetrics-text"), "content type")
+      served = _parse_metrics(resp.read())
+    finally:
+      resp.close()
+  finally:
+    session.close()
+  try:
+    written = _parse_metrics(open(path).read())
+  finally:
+    os.remove(path)
+  _expect(served == written, "file and HTTP metrics differ")
+  labels = 'client="memcached",operation="%s"'
+  expected = {("ispncon_operations_total", labels % "put"): 2, ("ispncon_sent_bytes_total", labels % "put"): 8,
+              ("ispncon_operations_total", labels % "get"): 2, ("ispncon_received_bytes_total", labels % "get"): 3,
+              ("ispncon_errors_total", (labels % "get") + ',error="NotFoundError"'): 1,
+              ("ispncon_operations_total", labels % "get_many"): 2, ("ispncon_received_bytes_total", labels % "get_many"): 3,
+              ("ispncon_errors_total", (labels % "get_many") + ',error="NotFoundError"'): 1,
+              ("ispncon_operation_duration_seconds_count", labels % "put"): 2}
+  for sample, value in expected.iteritems():
+    _expect(written.get(sample) == value, "%s{%s} is %r, expected %d" % (sample[0], sample[1], written.get(sample), value))
+  servers["memcached"].store.remove("metrics_a")
+
+def _check_buffer_config_change(servers):
+  server = servers["rest"]
+  session = _loopback_session(servers, "rest", {"buffer.max_entries": "100", "buffer.flush_interval": "60"})
+  try:
+    cache = session.config["cache"]
+    session.put("buffered_switch", "v")
+    _expect(session.configure("cache", "other_cache") == [], "buffered put failed")
+    _expect(_stored(server, "/other_cache/buffered_switch") == 0, "buffered put went to the new cache")
+    _expect(_stored(server, "/%s/buffered_switch" % cache) == 1, "buffered put isn't in the old cache")
+    session.put("buffered_switch", "w")
+    session.configure("cache", cache)
+    _expect(session.get("buffered_switch") == "v", "put after the switch went to the old cache")
+    session.delete("buffered_switch")
+    session.configure("cache", "other_cache")
+    session.delete("buffered_switch")
+  finally:
+    session.close()
+
+CHECKS = [("hotkeys.sketch_exact", _check_sketch_exact),
+          ("hotkeys.sketch_heavy_hitters", _check_sketch_heavy_hitters),
+          ("hotkeys.session", _check_session_hotkeys),
+          ("sizes.histogram", _check_histogram),
+          ("sizes.session", _check_session_sizes),
+          ("chunking", _check_chunking),
+          ("memcached.status", _check_memcached_status),
+          ("memcached.noreply", _check_memcached_noreply),
+          ("memcached.meta", _check_memcached_meta),
+          ("memcached.incr", _check_memcached_incr),
+          ("memcached.touch", _check_memcached_touch),
+          ("metadata.only", _check_metadata_only),
+          ("client_cache", _check_client_cache),
+          ("mdelete", _check_delete_many),
+          ("update.session", _check_session_update),
+          ("checksum.session", _check_session_checksum),
+          ("transport", _check_transport),
+          ("watch.count", _check_session_watch),
+          ("limit.update", _check_limited_update),
+          ("rest.pipelining", _check_rest_pipelining),
+          ("rest.encoding", _check_rest_encoding),
+          ("hotrod.failover", _check_hotrod_failover),
+          ("codec.river", _check_river_codecs),
+          ("codec.session", _check_session_codecs),
+          ("buffer.write_behind", _check_write_behind),
+          ("buffer.session", _check_session_write_behind),
+          ("buffer.config_change", _check_buffer_config_change),
+          ("include.compiled", _check_compiled_include),
+          ("shard.include", _check_sharded_include),
+          ("shard.bloom", _check_sharded_bloom),
+          ("bloom.filter", _check_bloom_filter),
+          ("bloom.session", _check_session_bloom),
+          ("metrics.format", _check_metrics_format),
+          ("metrics.session", _check_session_metrics)]
+
+def check(prefixes):
+  """runs the checks, prints PASS or FAIL for each one, returns names of the failed ones"""
+  servers = {"memcached": _LoopbackServer(_MemcachedHandler),
+             "hotrod": _LoopbackServer(_HotRodHandler),
+             "rest": _LoopbackServer(_RestHandler)}
+  failed = []
+  try:
+    for name, function in CHECKS:
+      if prefixes and not [prefix for prefix in prefixes if name.startswith(prefix)]:
+        continue
+      try:
+        function(servers)
+        print "%-36s PASS" % name
+      except Exception as e:
+        failed.append(name)
+        print "%-36s FAIL %s: %s" % (name, type(e).__name__, e)
+  finally:
+    for server in servers.values():
+      server.close()
+  return failed
+
+def measure(operation, ops, repeats):
+  """seconds per call of operation, the fastest of repeats measurements"""
+  best = None
+  for i in xrange(repeats):
+    start = timeit.default_timer()
+    for j in xrange(ops):
+      operation()
+    elapsed = timeit.default_timer() - start
+    if best == None or elapsed < best:
+      best = elapsed
+  return best / ops
+
+def run(prefixes, ops, repeats):
+  """returns dict benchmark name -> seconds per operation"""
+  servers = [("memcached", _LoopbackServer(_MemcachedHandler)),
+             ("hotrod", _LoopbackServer(_HotRodHandler)),
+             ("rest", _LoopbackServer(_RestHandler))]
+  benchmarks = _parse_benchmarks() + _codec_benchmarks() + _client_benchmarks(servers) + _execute_benchmarks(servers)
+  results = {}
+  stdout = sys.stdout
+  for name, operation in benchmarks:
+    if prefixes and not [prefix for prefix in prefixes if name.startswith(prefix)]:
+      continue
+    sys.stdout = _NullOutput() # execute prints the results
+    try:
+      results[name] = measure(operation, ops, repeats)
+    finally:
+      sys.stdout = stdout
+    print "%-36s %12.2f us/op" % (name, results[name] * 1e6)
+  return results
+
+def compare(results, baseline, threshold):
+  """prints comparison with the baseline, returns names of benchmarks slower than threshold allows"""
+  regressions = []
+  print "%-36s %12s %12s %8s" % ("benchmark", "us/op", "baseline", "ratio")
+  for name in sorted(results.keys()):
+    if not name in baseline:
+      continue
+    ratio = results[name] / baseline[name] if baseline[name] > 0 else 1.0
+    status = ""
+    if ratio > threshold:
+      regressions.append(name)
+      status = "SLOWER"
+    print "%-36s %12.2f %12.2f %8.2f %s" % (name, results[name] * 1e6, baseline[name] * 1e6, ratio, status)
+  return regressions
+
+def main(args):
+  try:
+    opts, prefixes = getopt.getopt(args, "n:r:s:b:t:c", ["ops=", "repeats=", "save=", "baseline=", "threshold=", "check"])
+    ops, repeats, threshold = 2000, 5, 1.5
+    save, baseline, checks = None, None, False
+    for opt, arg in opts:
+      if opt in ("-n", "--ops"):
+        ops = int(arg)
+      if opt in ("-r", "--repeats"):
+        repeats = int(arg)
+      if opt in ("-s", "--save"):
+        save = arg
+      if opt in ("-b", "--baseline"):
+        baseline = arg
+      if opt in ("-t", "--threshold"):
+        threshold = float(arg)
+      if opt in ("-c", "--check"):
+        checks = True
+  except (getopt.GetoptError, ValueError):
+    print __doc__
+    sys.exit(2)
+  if checks:
+    failed = check(prefixes)
+    if failed:
+      print "FAIL %d of the checks: %s" % (len(failed), ", ".join(failed))
+      sys.exit(1)
+    return
+  results = run(prefixes, ops, repeats)
+  if save != None:
+    f = open(save, "w")
+    try:
+      json.dump(results, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+  if baseline != None:
+    f = open(baseline, "r")
+    try:
+      baseline_results = json.load(f)
+    finally:
+      f.close()
+    regressions = compare(results, baseline_results, threshold)
+    if regressions:
+      print "FAIL %d benchmarks slower than %.2f times baseline: %s" % (len(regressions), threshold, ", ".join(regressions))
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
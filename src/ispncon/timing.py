@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Phase level profiling of command execution
+"""
+import time
+import types
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+PHASE_TOTAL = "total"
+PHASE_PARSE = "parse"
+PHASE_ENCODE = "encode"
+PHASE_DECODE = "decode"
+PHASE_NETWORK = "network"
+PHASE_OUTPUT = "output"
+
+PHASES = [PHASE_TOTAL, PHASE_PARSE, PHASE_ENCODE, PHASE_DECODE, PHASE_NETWORK, PHASE_OUTPUT]
+
+class _NoPhase(object):
+  def __enter__(self):
+    return self
+  def __exit__(self, *exc_info):
+    return False
+
+NO_PHASE = _NoPhase()
+
+class _Phase(object):
+  def __init__(self, profiler, phase, command=None):
+    self.profiler = profiler
+    self.phase = phase
+    self.command = command
+
+  def __enter__(self):
+    if self.command != None:
+      self.profiler.commands.append(self.command)
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc_info):
+    elapsed = time.time() - self.start
+    if self.command != None:
+      self.profiler.commands.pop()
+      self.profiler.add(self.command, self.phase, elapsed)
+    else:
+      self.profiler.add(self.profiler.current_command(), self.phase, elapsed)
+    return False
+
+class PhaseProfiler(object):
+  """Accumulates wall clock time spent in each phase of each command.
+     Phases are attributed to the innermost running command (commands of an include file count on their own).
+  """
+  def __init__(self):
+    self.stats = {} # (command, phase) -> [calls, seconds]
+    self.commands = []
+
+  def current_command(self):
+    return self.commands[-1] if self.commands else "-"
+
+  def command(self, name):
+    """context manager measuring total time of a command"""
+    return _Phase(self, PHASE_TOTAL, name)
+
+  def phase(self, name):
+    """context manager measuring a phase of the current command"""
+    return _Phase(self, name)
+
+  def add(self, command, phase, seconds):
+    stat = self.stats.get((command, phase))
+    if stat == None:
+      self.stats[(command, phase)] = [1, seconds]
+    else:
+      stat[0] += 1
+      stat[1] += seconds
+
+  def report(self):
+    """returns report lines: command, phase, number of calls, total and average time in milliseconds"""
+    lines = ["%-12s %-8s %10s %12s %10s" % ("command", "phase", "calls", "total[ms]", "avg[ms]")]
+    order = dict((phase, idx) for idx, phase in enumerate(PHASES))
+    for (command, phase) in sorted(self.stats.keys(), key=lambda k: (k[0], order.get(k[1], len(PHASES)))):
+      calls, seconds = self.stats[(command, phase)]
+      lines.append("%-12s %-8s %10d %12.3f %10.3f" % (command, phase, calls, seconds * 1000, seconds * 1000 / calls))
+    return lines
+
+class ProfiledClient(object):
+  """Cache client proxy accounting time of every client call (including iterating results) as network phase"""
+  def __init__(self, client, profiler):
+    self.client = client
+    self.profiler = profiler
+
+  def __getattr__(self, name):
+    attr = getattr(self.client, name)
+    if name.startswith("_") or not callable(attr):
+      return attr
+    def timed(*args, **kw):
+      with self.profiler.phase(PHASE_NETWORK):
+        result = attr(*args, **kw)
+      if isinstance(result, types.GeneratorType):
+        return self._timed_iter(result)
+      return result
+    return timed
+
+  def _timed_iter(self, iterator):
+    while True:
+      with self.profiler.phase(PHASE_NETWORK):
+        try:
+          item = iterator.next()
+        except StopIteration:
+          return
+      yield item
+
+class ProfiledOutput(object):
+  """Wraps sys.stdout, accounting time of writes as output phase"""
+  def __init__(self, stream, profiler):
+    self.stream = stream
+    self.profiler = profiler
+
+  def write(self, data):
+    with self.profiler.phase(PHASE_OUTPUT):
+      self.stream.write(data)
+
+  def __getattr__(self, name):
+    return getattr(self.stream, name)
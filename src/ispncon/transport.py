@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Socket creation shared by all cache clients
+
+Applies the transport.* config values (TCP_NODELAY, SO_KEEPALIVE, buffer sizes, timeouts), caches DNS
+resolution and understands unix:<path> endpoints (Unix domain sockets, the port is ignored then).
+"""
+from ispncon import TRUE_STR_VALUES
+import socket
+import threading
+import time
+
+__author__ = "Michal Linhard"
+__copyright__ = "(C) 2011 Red Hat Inc."
+
+UNIX_PREFIX = "unix:"
+
+class TransportError(Exception):
+  """Invalid transport configuration"""
+  def __init__(self, msg):
+    Exception.__init__(self, msg)
+    self.msg = msg
+
+_dns_cache = {} # (host, port) -> (expiration time, addrinfo list)
+_dns_lock = threading.Lock()
+
+def resolve(host, port, ttl=60):
+  """getaddrinfo of the host for TCP, cached for ttl seconds (0 disables caching)"""
+  if ttl <= 0:
+    return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+  now = time.time()
+  with _dns_lock:
+    cached = _dns_cache.get((host, port))
+  if cached != None and cached[0] > now:
+    return cached[1]
+  addrs = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+  with _dns_lock:
+    _dns_cache[(host, port)] = (now + ttl, addrs)
+  return addrs
+
+def is_unix(host):
+  return host.startswith(UNIX_PREFIX)
+
+def host_header(host, port):
+  """value of HTTP Host header for the endpoint"""
+  if is_unix(host):
+    return "localhost"
+  return "%s:%s" % (host, port)
+
+class Transport(object):
+  """Creates connected sockets with the configured options. Timeouts and buffer sizes of 0 mean
+     the system defaults (no timeout)."""
+  def __init__(self, tcp_nodelay=True, keepalive=False, send_buffer=0, receive_buffer=0,
+               connect_timeout=0, read_timeout=0, dns_cache_ttl=60):
+    self.tcp_nodelay = tcp_nodelay
+    self.keepalive = keepalive
+    self.send_buffer = send_buffer
+    self.receive_buffer = receive_buffer
+    self.connect_timeout = connect_timeout
+    self.read_timeout = read_timeout
+    self.dns_cache_ttl = dns_cache_ttl
+
+  def _configure(self, sock, tcp):
+    if tcp and self.tcp_nodelay:
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if tcp and self.keepalive:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # buffer sizes have to be set before connecting to affect TCP window scaling
+    if self.send_buffer > 0:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+    if self.receive_buffer > 0:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+    sock.settimeout(self.connect_timeout if self.connect_timeout > 0 else None)
+
+  def connect(self, host, port):
+    """returns socket connected to host:port or to unix:<path>, raises socket.error"""
+    if is_unix(host):
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        self._configure(sock, False)
+        sock.connect(host[len(UNIX_PREFIX):])
+      except:
+        sock.close()
+        raise
+      sock.settimeout(self.read_timeout if self.read_timeout > 0 else None)
+      return sock
+    error = socket.error("getaddrinfo returned empty list")
+    for family, socktype, proto, canonname, addr in resolve(host, int(port), self.dns_cache_ttl):
+      sock = socket.socket(family, socktype, proto)
+      try:
+        self._configure(sock, True)
+        sock.connect(addr)
+      except socket.error as e:
+        sock.close()
+        error = e
+        continue
+      sock.settimeout(self.read_timeout if self.read_timeout > 0 else None)
+      return sock
+    raise error
+
+def fromConfig(config):
+  """Transport configured by transport.* config values"""
+  try:
+    return Transport(config["transport.tcp_nodelay"] in TRUE_STR_VALUES,
+                     config["transport.keepalive"] in TRUE_STR_VALUES,
+                     int(config["transport.send_buffer"]),
+                     int(config["transport.receive_buffer"]),
+                     float(config["transport.connect_timeout"]),
+                     float(config["transport.read_timeout"]),
+                     float(config["transport.dns_cache_ttl"]))
+  except ValueError:
+    raise TransportError("transport buffer sizes must be integers, timeouts and dns_cache_ttl numbers of seconds")
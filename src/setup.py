@@ -8,7 +8,7 @@ setup(name = 'ispncon',
       description = 'Infinispan Console',
       author = 'Michal Linhard',
       author_email = 'michal@linhard.sk',
-      py_modules = ['ispncon.console', 'ispncon.client', 'ispncon.codec' ],
+      py_modules = ['ispncon.console', 'ispncon.client', 'ispncon.codec', 'ispncon.stats', 'ispncon.bulk', 'ispncon.memcached', 'ispncon.timing', 'ispncon.ratelimit', 'ispncon.transport', 'ispncon.buffer', 'ispncon.script', 'ispncon.config', 'ispncon.api', 'ispncon.shard', 'ispncon.bloom', 'ispncon.metrics' ],
       classifiers = [
           "License :: OSI Approved :: GNU Library or Lesser General Public License (LGPL)",
           "Programming Language :: Python",
@@ -21,8 +21,7 @@ setup(name = 'ispncon',
       install_requires = [
         'setuptools',
         'greenlet',
-        'infinispan',
-        'python-memcached'
+        'infinispan'
       ],
       long_description = "See `Infinispan Console <https://github.com/infinispan/ispncon>`_ for more information."
       )
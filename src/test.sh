@@ -104,6 +104,22 @@ assertEquals "" $ret
 
 }
 
+test_incr() {
+test_case_begin "test_incr"
+
+ret=`$CMD put a_counter 5`
+assertEquals "STORED" $ret
+ret=`$CMD incr a_counter`
+assertEquals "6" $ret
+ret=`$CMD incr a_counter 10`
+assertEquals "16" $ret
+ret=`$CMD incr a_counter -6`
+assertEquals "10" $ret
+ret=`$CMD get a_counter`
+assertEquals "10" $ret
+
+}
+
 #################################### helper functions ##############################
 
 startserver() {
@@ -230,6 +246,9 @@ echo -e $CONFIG_MEMCACHED > ~/.ispncon
 test_basic_put_get
 test_basic_put_get_return_codes
 test_put_get_file
+test_versioned_put
+test_versioned_put_return_codes
+test_incr
 
 stopserver
 
@@ -241,6 +260,7 @@ test_basic_put_get
 test_basic_put_get_return_codes
 test_put_get_file
 test_versioned_put
+test_incr
 # doesn't work yet
 #test_versioned_put_return_codes
 
@@ -253,6 +273,7 @@ echo -e $CONFIG_REST > ~/.ispncon
 test_basic_put_get
 test_basic_put_get_return_codes
 test_put_get_file
+test_incr
 
 stopserver
 